@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# xlcrypto_py/bench/bench_bloom_batch.py
+
+"""
+Compare sorted and unsorted batch queries and inserts on BloomSHA
+filters of increasing size, to find the filter size at which sorting
+probes by address starts to pay off.
+
+Run from the project directory as
+    PYTHONPATH=src python3 bench/bench_bloom_batch.py [--max-m 30]
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector
+
+
+def best_of(func, reps):
+    """ Return the shortest of reps timings of func(). """
+    best = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(cls, m, k, batch, reps):
+    """
+    Return (insert_unsorted, insert_sorted, query_unsorted, query_sorted)
+    in nanoseconds per key.
+    """
+    fltr = cls(m, k, key_bytes=32)
+    keysels = [KeySelector(os.urandom(32), fltr) for _ in range(batch)]
+    for keysel in keysels:
+        _ = keysel.filter_bits              # precalculate
+        _ = keysel.wordsel
+
+    scale = 1e9 / batch
+    ins = best_of(lambda: fltr.insert_many(keysels), reps)
+    ins_sorted = best_of(lambda: fltr.insert_many(keysels, sort=True), reps)
+    query = best_of(lambda: fltr.is_member_many(keysels), reps)
+    query_sorted = best_of(
+        lambda: fltr.is_member_many(keysels, sort=True), reps)
+    return ins * scale, ins_sorted * scale, query * scale, query_sorted * scale
+
+
+def main():
+    """ Run the benchmark and report the crossover point. """
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--min-m', type=int, default=16,
+                        help='smallest filter, as log2 of bits')
+    parser.add_argument('--max-m', type=int, default=30,
+                        help='largest filter, as log2 of bits')
+    parser.add_argument('-k', type=int, default=8,
+                        help='number of hash functions')
+    parser.add_argument('-b', '--batch', type=int, default=100000,
+                        help='keys per batch')
+    parser.add_argument('-r', '--reps', type=int, default=3,
+                        help='repetitions; best time is reported')
+    parser.add_argument('-w', '--words', action='store_true',
+                        help='use the 64-bit word storage engine')
+    args = parser.parse_args()
+    cls = WordBloomSHA if args.words else BloomSHA
+
+    print("%s, k = %d, %d keys per batch; ns/key" % (
+        cls.__name__, args.k, args.batch))
+    print("%3s %10s %10s %10s %10s %10s" % (
+        'm', 'MiB', 'insert', 'sorted', 'query', 'sorted'))
+    crossover = None
+    for m in range(args.min_m, args.max_m + 1, 2):
+        ins, ins_sorted, query, query_sorted = bench(
+            cls, m, args.k, args.batch, args.reps)
+        print("%3d %10.1f %10.0f %10.0f %10.0f %10.0f" % (
+            m, (1 << m) / 8 / 2**20, ins, ins_sorted, query, query_sorted))
+        sys.stdout.flush()
+        if crossover is None and query_sorted < query:
+            crossover = m
+    if crossover is None:
+        print("sorted queries did not pay off for m <= %d" % args.max_m)
+    else:
+        print("sorted queries pay off from m = %d (%.1f MiB)" % (
+            crossover, (1 << crossover) / 8 / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# xlcrypto_py/bench/bench_digest_many.py
+
+"""
+Compare digest_many() with hashing small messages one XLHash object at
+a time, in nanoseconds per message.
+
+Run from the project directory as
+    PYTHONPATH=src python3 bench/bench_digest_many.py [--count 200000]
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from xlattice import HashTypes
+from xlcrypto.hash import digest_many, get_hash_class
+
+
+def best_of(func, reps):
+    """ Return the shortest of reps timings of func(). """
+    best = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=200000,
+                        help='messages per batch')
+    parser.add_argument('--reps', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print("ns per message, %d messages (best of %d)" % (
+        args.count, args.reps))
+    print("%-12s %6s %10s %12s %12s" % (
+        'hash', 'bytes', 'wrapper', 'digest_many', 'with offsets'))
+    for hashtype in sorted(HashTypes):
+        cls = get_hash_class(hashtype)
+        for size in (16, 64, 256):
+            messages = [os.urandom(size) for _ in range(args.count)]
+            packed = b''.join(messages)
+            offsets = range(0, len(packed) + 1, size)
+            timings = (
+                best_of(lambda: b''.join([cls(msg).digest()
+                                          for msg in messages]), args.reps),
+                best_of(lambda: digest_many(hashtype, messages), args.reps),
+                best_of(lambda: digest_many(hashtype, packed, offsets),
+                        args.reps))
+            print("%-12s %6d %10.0f %12.0f %12.0f" % (
+                (cls.hash_name(), size) +
+                tuple(elapsed * 1e9 / args.count for elapsed in timings)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
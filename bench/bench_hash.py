@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# xlcrypto_py/bench/bench_hash.py
+
+"""
+Measure the throughput and per-call latency of each XLHash class and of
+the hashlib function it wraps, over message sizes from 16 bytes up.
+
+Run from the project directory as
+    PYTHONPATH=src python3 bench/bench_hash.py [--max-size 1G]
+        [--json results.json] [--baseline baseline.json]
+
+Each call hashes one message from start to digest: the hash object is
+created, fed, and finalized.  Messages larger than CHUNK_SIZE are fed
+in CHUNK_SIZE updates from one buffer, so that a 1 GiB message needs
+no 1 GiB of memory.  Each timing is the best of --reps runs of enough
+calls to hash about --budget bytes, and at least one call.
+
+With --baseline, results are compared with a file written earlier by
+--json, and the exit status is 1 if throughput at any size fell by more
+than --tolerance percent, or if time per call for messages of up to
+SMALL_SIZE bytes, where fixed per-call costs dominate, rose by more
+than --tolerance percent.  Only results measured on the same machine
+and Python are comparable.
+"""
+
+import hashlib
+import json
+import platform
+import ssl
+import sys
+import time
+from argparse import ArgumentParser
+
+from xlattice import HashTypes
+from xlcrypto.hash import get_hash_class
+
+# largest update made in one call
+CHUNK_SIZE = 1 << 24
+
+# per-call time is also compared for messages up to this size
+SMALL_SIZE = 1 << 12
+
+ROW_FORMAT = "%-12s %10d %12.0f %10.1f %12.0f %10.1f %8.1f%%\n"
+
+SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(text):
+    """ Parse a size such as 4096, 64K, 16M, or 1G. """
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SUFFIXES:
+        return int(text[:-1]) * SUFFIXES[text[-1]]
+    return int(text)
+
+
+def sizes_up_to(max_size):
+    """ Return 16 bytes and successive powers of 4 up to max_size. """
+    sizes = []
+    size = 16
+    while size <= max_size:
+        sizes.append(size)
+        size *= 4
+    return sizes
+
+
+def raw_factory(hashtype):
+    """ Return a function creating the bare hashlib object. """
+    if hashtype == HashTypes.BLAKE2B:
+        return lambda: hashlib.blake2b(digest_size=32)
+    return get_hash_class(hashtype).lib_func()
+
+
+def time_calls(factory, buf, size, calls, reps):
+    """
+    Return the best of reps timings of calls digests of size-byte
+    messages, each made by a new hash object from factory().
+    """
+    view = memoryview(buf)
+    chunks = [view[:CHUNK_SIZE]] * (size // CHUNK_SIZE)
+    if size % CHUNK_SIZE:
+        chunks.append(view[:size % CHUNK_SIZE])
+    best = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        for _ in range(calls):
+            xlh = factory()
+            for chunk in chunks:
+                xlh.update(chunk)
+            xlh.digest()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(hashtypes, sizes, budget, reps, out=None):
+    """
+    Benchmark each hash type at each size, XLHash and hashlib alike.
+
+    @return list of result dicts
+    """
+    buf = bytes(range(256)) * (min(max(sizes), CHUNK_SIZE) // 256 + 1)
+    results = []
+    for hashtype in hashtypes:
+        cls = get_hash_class(hashtype)
+        for size in sizes:
+            calls = max(1, budget // size)
+            row = {}
+            for impl, factory in (('hashlib', raw_factory(hashtype)),
+                                  ('xlhash', cls)):
+                elapsed = time_calls(factory, buf, size, calls, reps)
+                result = {
+                    'hash': cls.hash_name(),
+                    'impl': impl,
+                    'size': size,
+                    'calls': calls,
+                    'ns_per_call': elapsed * 1e9 / calls,
+                    'mb_per_s': size * calls / elapsed / 1e6,
+                }
+                results.append(result)
+                row[impl] = result
+            if out is not None:
+                out.write(ROW_FORMAT % (
+                    cls.hash_name(), size,
+                    row['hashlib']['ns_per_call'],
+                    row['hashlib']['mb_per_s'],
+                    row['xlhash']['ns_per_call'],
+                    row['xlhash']['mb_per_s'],
+                    100.0 * (row['xlhash']['ns_per_call'] /
+                             row['hashlib']['ns_per_call'] - 1)))
+                out.flush()
+    return results
+
+
+def environment():
+    """ Describe what the results were measured on. """
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'openssl': ssl.OPENSSL_VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with baseline results.
+
+    @return list of (result, baseline result, metric, percent change)
+            where throughput ('mb_per_s') fell, or for sizes up to
+            SMALL_SIZE time per call ('ns_per_call') rose, by more than
+            tolerance percent
+    """
+    old = dict(((res['hash'], res['impl'], res['size']), res)
+               for res in baseline)
+    regressions = []
+    for res in results:
+        base = old.get((res['hash'], res['impl'], res['size']))
+        if base is None:
+            continue
+        change = 100.0 * (res['mb_per_s'] / base['mb_per_s'] - 1)
+        if change < -tolerance:
+            regressions.append((res, base, 'mb_per_s', change))
+        if res['size'] <= SMALL_SIZE:
+            change = 100.0 * (res['ns_per_call'] / base['ns_per_call'] - 1)
+            if change > tolerance:
+                regressions.append((res, base, 'ns_per_call', change))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hashes', nargs='+', default=None,
+                        choices=[cls.hash_name() for cls in
+                                 (get_hash_class(ht) for ht in HashTypes)],
+                        help='hashes to measure (default all)')
+    parser.add_argument('--max-size', type=parse_size, default=1 << 26,
+                        help='largest message, e.g. 1G (default 64M)')
+    parser.add_argument('--budget', type=parse_size, default=1 << 26,
+                        help='bytes hashed per timing (default 64M)')
+    parser.add_argument('--reps', type=int, default=3)
+    parser.add_argument('--json', metavar='PATH',
+                        help='write results to PATH')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare with results saved by --json')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='percent drop in MB/s, or rise in ns per call '
+                        'for small messages, reported (default 10)')
+    args = parser.parse_args(argv)
+
+    hashtypes = [ht for ht in sorted(HashTypes)
+                 if args.hashes is None or
+                 get_hash_class(ht).hash_name() in args.hashes]
+    sizes = sizes_up_to(args.max_size)
+    if not sizes:
+        parser.error("--max-size must be at least 16")
+
+    out = sys.stdout
+    out.write("best of %d; overhead is XLHash time over hashlib time\n" %
+              args.reps)
+    out.write("%-12s %10s %12s %10s %12s %10s %9s\n" % (
+        'hash', 'bytes', 'hashlib ns', 'MB/s', 'xlhash ns', 'MB/s',
+        'overhead'))
+    results = run(hashtypes, sizes, args.budget, args.reps, out)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'environment': environment(), 'results': results},
+                      file, indent=2, sort_keys=True)
+            file.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            saved = json.load(file)
+        regressions = compare(results, saved['results'], args.tolerance)
+        out.write("\ncompared with %s (%s, Python %s)\n" % (
+            args.baseline, saved['environment'].get('time', '?'),
+            saved['environment'].get('python', '?')))
+        units = {'mb_per_s': 'MB/s', 'ns_per_call': 'ns/call'}
+        for res, base, metric, change in regressions:
+            out.write("REGRESSION %-12s %-8s %10d %10.1f -> %10.1f %-7s "
+                      "(%+.1f%%)\n" % (res['hash'], res['impl'], res['size'],
+                                       base[metric], res[metric],
+                                       units[metric], change))
+        if regressions:
+            return 1
+        out.write("no regressions beyond %.1f%%\n" % args.tolerance)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
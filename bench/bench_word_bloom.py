@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# xlcrypto_py/bench/bench_word_bloom.py
+
+"""
+Compare the byte and 64-bit word storage engines of BloomSHA, key by
+key and over whole filters.
+
+Run from the project directory as
+    PYTHONPATH=src python3 bench/bench_word_bloom.py [-m 20] [--keys 50000]
+
+Key operations include building each KeySelector, as callers must.
+The exit status is 1 if WordBloomSHA is not faster than BloomSHA at
+every whole-filter operation, which is what it is for.
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector
+
+# operations on whole filters, which the word engine should speed up
+WHOLE_FILTER = ('popcount', 'union', 'equal', 'clear')
+
+
+def best_of(func, reps):
+    """ Return the shortest of reps timings of func(). """
+    best = None
+    for _ in range(reps):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(cls, m, k, keys, reps):
+    """ Return a dict mapping operation to seconds, for one engine. """
+    fltr = cls(m, k, len(keys[0]))
+    other = cls(m, k, len(keys[0]))
+    other.insert_many([KeySelector(key, other) for key in keys[::2]])
+    timings = {}
+    timings['insert'] = best_of(
+        lambda: [fltr.insert(KeySelector(key, fltr)) for key in keys], reps)
+    timings['query'] = best_of(
+        lambda: [fltr.is_member(KeySelector(key, fltr)) for key in keys],
+        reps)
+    timings['insert_many'] = best_of(
+        lambda: fltr.insert_many([KeySelector(key, fltr) for key in keys]),
+        reps)
+    timings['insert sorted'] = best_of(
+        lambda: fltr.insert_many([KeySelector(key, fltr) for key in keys],
+                                 sort=True), reps)
+    timings['popcount'] = best_of(fltr.popcount, reps)
+    timings['union'] = best_of(lambda: fltr.union(other), reps)
+    timings['equal'] = best_of(lambda: fltr == other, reps)
+    timings['clear'] = best_of(other.clear, reps)
+    return timings
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-m', type=int, default=20,
+                        help='log2 of the number of bits (default 20)')
+    parser.add_argument('-k', type=int, default=8,
+                        help='number of hash functions (default 8)')
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--reps', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    keys = [os.urandom(20) for _ in range(args.keys)]
+    byte = bench(BloomSHA, args.m, args.k, keys, args.reps)
+    word = bench(WordBloomSHA, args.m, args.k, keys, args.reps)
+
+    print("m = %d, k = %d, %d keys (best of %d)" % (
+        args.m, args.k, args.keys, args.reps))
+    print("%-14s %12s %12s %8s" % ('operation', 'byte', 'word', 'speedup'))
+    slower = []
+    for name in byte:
+        print("%-14s %10.3fms %10.3fms %7.2fx" % (
+            name, byte[name] * 1e3, word[name] * 1e3,
+            byte[name] / word[name]))
+        if name in WHOLE_FILTER and word[name] >= byte[name]:
+            slower.append(name)
+    if slower:
+        print("word engine not faster at: %s" % ', '.join(slower))
+        return 1
+    print("word engine faster at every whole-filter operation")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,11 @@ setup(name='xlcrypto_py',
       include_package_data=False,
       zip_safe=False,
       scripts=[],
+      entry_points={
+          'console_scripts': [
+              'xlcrypto-bloom = xlcrypto.filters.cli:main',
+          ],
+      },
       ext_modules=[],
       description='crypto layer for xlattice_py',
       url='https://jddixon.github.io/xlcrypto_py',
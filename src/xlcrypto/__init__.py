@@ -3,6 +3,8 @@
 """ Crypto library for python XLattice packages. """
 
 import hashlib
+import mmap
+import os
 import sys
 
 if sys.version_info < (3, 6):
@@ -15,6 +17,7 @@ __version_date__ = '2018-02-26'
 
 
 __all__ = ['AES_BLOCK_BITS', 'AES_BLOCK_BYTES',
+           'HASH_CHUNK_SIZE', 'HASH_MMAP_THRESHOLD',
            'next_nb_line', 'collect_pem_rsa_public_key',
            # Classes
            'XLCryptoError', 'xLFilterError', 'SP',
@@ -26,6 +29,11 @@ __all__ = ['AES_BLOCK_BITS', 'AES_BLOCK_BYTES',
 AES_BLOCK_BITS = 128
 AES_BLOCK_BYTES = 16
 
+# size of the buffer XLHash reads files into
+HASH_CHUNK_SIZE = 1 << 20
+# XLHash.hash_file() maps files at least this large into memory
+HASH_MMAP_THRESHOLD = 1 << 24
+
 
 class XLCryptoError(RuntimeError):
     """ General purpose exception for the package. """
@@ -43,6 +51,63 @@ class XLHash(object):
     def update(self, data):
         raise NotImplementedError
 
+    def update_from(self, fileobj, chunk_size=HASH_CHUNK_SIZE):
+        """
+        Read a binary file object to the end, adding what is read to the
+        hash.  Reads go into a single preallocated buffer.
+
+        @return the number of bytes read
+        """
+        if chunk_size < 1:
+            raise XLCryptoError("chunk_size must be positive")
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        total = 0
+        while True:
+            count = fileobj.readinto(buf)
+            if not count:
+                break
+            self.update(view[:count])
+            total += count
+        return total
+
+    @classmethod
+    def hash_fileobj(cls, fileobj, chunk_size=HASH_CHUNK_SIZE):
+        """ Return the binary digest of the rest of a binary file object. """
+        xlh = cls()
+        xlh.update_from(fileobj, chunk_size)
+        return xlh.digest()
+
+    @classmethod
+    def hash_file(cls, path, chunk_size=HASH_CHUNK_SIZE,
+                  mmap_threshold=HASH_MMAP_THRESHOLD):
+        """
+        Return the binary digest of the file at path.  Files of at least
+        mmap_threshold bytes are mapped into memory and hashed chunk by
+        chunk through a memoryview, with no copying; smaller files are
+        read into a reused buffer.  An mmap_threshold of None disables
+        mapping.
+        """
+        if chunk_size < 1:
+            raise XLCryptoError("chunk_size must be positive")
+        xlh = cls()
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if mmap_threshold is None or size < max(1, mmap_threshold):
+                # no point in a buffer bigger than the file, unless the
+                # size is unknown: FIFOs and /proc files report zero
+                xlh.update_from(file, min(chunk_size, size) or chunk_size)
+            else:
+                with mmap.mmap(file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for offset in range(0, len(view), chunk_size):
+                            xlh.update(view[offset:offset + chunk_size])
+                    finally:
+                        view.release()
+        return xlh.digest()
+
     def digest(self, data):
         raise NotImplementedError
 
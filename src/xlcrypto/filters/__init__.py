@@ -3,14 +3,22 @@
 
 """ Bloom filter for fixed length keys which are usually SHA hashes. """
 
+import struct
+import sys
+from array import array
+from collections import OrderedDict
 from threading import Lock
+from weakref import WeakSet
 # from binascii import b2a_hex
 from copy import deepcopy
 from math import exp
 
 from xlcrypto import XLFilterError
 
-__all__ = ['MIN_M', 'MIN_K', 'BloomSHA', 'NibbleCounters']
+__all__ = ['MIN_M', 'MIN_K', 'BloomSHA', 'WordBloomSHA', 'BloomSnapshot',
+           'BufferSnapshot',
+           'NibbleCounters', 'SelectorCache',
+           'pack_filter_header', 'unpack_filter_header', 'split_keys', ]
 
 # EXPORTED CONSTANTS ------------------------------------------------
 
@@ -20,6 +28,78 @@ MIN_K = 1   # minimum number of 'hash functions'
 # PRIVATE CONSTANTS -------------------------------------------------
 
 SIZEOF_UINT64 = 8  # bytes
+WORD_SHIFT = 6      # log2 of the number of bits in a 64-bit word
+
+# snapshots copy the filter a page at a time, and only when it changes
+PAGE_SHIFT = 12
+PAGE_BYTES = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_BYTES - 1
+
+# serialized filters begin with a fixed-size header:
+#   magic, filter kind, m, k, key_bytes, key_count
+FILTER_MAGIC = b'XLBF'
+FILTER_HEADER = struct.Struct('<4sBBHHQ')
+KIND_BLOOM = 1      # BloomSHA and WordBloomSHA share the same body
+KIND_COUNT_MIN = 2  # CountMinSHA
+KIND_IBLT = 3       # IBLTSHA
+KIND_GCS = 4        # GolombCodedSetSHA
+KIND_COUNTING = 5   # CountingBloom checkpoint: filter, then counters
+
+if sys.version_info >= (3, 10):
+    _bit_count = int.bit_count
+else:
+    def _bit_count(val):
+        """ Number of bits set in a non-negative int. """
+        return bin(val).count('1')
+
+# number of bits set in each possible byte value
+BYTE_POPCOUNT = bytes(_bit_count(i) for i in range(256))
+
+# each possible byte value with both of its nibbles halved
+HALVE_NIBBLES = bytes((i >> 1) & 0x77 for i in range(256))
+
+
+def pack_filter_header(kind, m, k, key_bytes, key_count):
+    """ Return the serialized header for a filter of the given kind. """
+    return FILTER_HEADER.pack(FILTER_MAGIC, kind, m, k, key_bytes, key_count)
+
+
+def unpack_filter_header(data, kind):
+    """
+    Parse the header at the front of a serialized filter.
+
+    @param data  bytes-like serialization of a filter
+    @param kind  filter kind expected
+    @return      (m, k, key_bytes, key_count, body) where body is a
+                 memoryview of whatever follows the header
+    """
+    if data is None or len(data) < FILTER_HEADER.size:
+        raise XLFilterError("serialized filter is too short")
+    magic, got_kind, m, k, key_bytes, key_count = \
+        FILTER_HEADER.unpack_from(data)
+    if magic != FILTER_MAGIC:
+        raise XLFilterError("not a serialized filter")
+    if got_kind != kind:
+        raise XLFilterError(
+            "serialized filter is of kind %d, expected %d" % (got_kind, kind))
+    return m, k, key_bytes, key_count, memoryview(data)[FILTER_HEADER.size:]
+
+
+def split_keys(packed, key_bytes):
+    """
+    Split a buffer of keys packed end to end into a list of keys.
+
+    @param packed     bytes-like, a whole number of keys long
+    @param key_bytes  length of each key in bytes
+    @return           list of bytes objects
+    """
+    packed = bytes(packed)
+    if len(packed) % key_bytes:
+        raise XLFilterError(
+            "packed keys: length %d is not a multiple of %d" % (
+                len(packed), key_bytes))
+    return [packed[ndx:ndx + key_bytes]
+            for ndx in range(0, len(packed), key_bytes)]
 
 
 # ===================================================================
@@ -52,6 +132,9 @@ class BloomSHA(object):
     exhaustively tested.
     """
 
+    # log2 of the number of bits in each unit of storage
+    _UNIT_SHIFT = 3
+
     def __init__(self, m=20, k=8, key_bytes=20):
         """
         Creates a filter with 2**m bits and k 'hash functions',
@@ -86,8 +169,9 @@ class BloomSHA(object):
         # convenience variables
         self._filter_bits = 1 << m
         self._filter_bytes = (self._filter_bits + 7) // 8   # round up
-        self._filter = bytearray(self._filter_bytes)
+        self._filter = self._new_filter()
         self._lock = Lock()
+        self._views = WeakSet()     # live snapshots of this filter
 
         # DEBUG
         # print("Bloom ctor: m %d, k %d, filter_bits %d, filter_bytes %d" % (
@@ -109,11 +193,16 @@ class BloomSHA(object):
         """ Length in bytes of acceptable keys (default == 20 bytes). """
         return self._key_bytes
 
+    def _new_filter(self):
+        """ Allocate the zeroed storage holding the filter bits. """
+        return bytearray(self._filter_bytes)
+
     def _do_clear(self):
         """ Clear the filter, unsynchronized. """
 
-        for i in range(self._filter_bytes):
-            self._filter[i] = 0
+        if self._views:
+            self._preserve_all()
+        self._filter[:] = bytes(self._filter_bytes)
 
     def clear(self):
         """ Clear the filter, synchronized version. """
@@ -164,11 +253,9 @@ class BloomSHA(object):
         if keysel is None:
             raise XLFilterError("KeySelector may not be None")
 
-        bitsel, bytesel = keysel.bitsel, keysel.bytesel
         try:
             self._lock.acquire()
-            for i in range(self._kk):
-                self._filter[bytesel[i]] |= (1 << bitsel[i])
+            self._do_insert(keysel)
             self._key_count += 1
             # DEBUG
             # print("key count := %d" % self._key_count)
@@ -176,6 +263,14 @@ class BloomSHA(object):
         finally:
             self._lock.release()
 
+    def _do_insert(self, keysel):
+        """ Set the k bits selected by the key, unsynchronized. """
+        bits, fltr = keysel.filter_bits, self._filter
+        if self._views:
+            self._preserve([bit >> 3 for bit in bits])
+        for bit in bits:
+            fltr[bit >> 3] |= 1 << (bit & 7)
+
     def _is_member(self, keysel):
         """
         Whether a key is in the filter.  Sets up the bit and byte offset
@@ -184,10 +279,9 @@ class BloomSHA(object):
         @param keysel  KeySelector for key (SHA digest)
         @return True if b is in the filter
         """
-        bitsel, bytesel = keysel.bitsel, keysel.bytesel
-        for i in range(self._kk):
-            check_byte = self._filter[bytesel[i]]
-            if (check_byte & (1 << bitsel[i])) == 0:
+        fltr = self._filter
+        for bit in keysel.filter_bits:
+            if not fltr[bit >> 3] & (1 << (bit & 7)):
                 return False
         return True
 
@@ -207,6 +301,577 @@ class BloomSHA(object):
         finally:
             self._lock.release()
 
+    # BATCH OPERATIONS ----------------------------------------------
+
+    def _sorted_bits(self, keysels):
+        """
+        Return the filter bit offsets selected by a batch of keys, in
+        ascending order, so that the filter is traversed from one end to
+        the other rather than probed at random.
+        """
+        bits = []
+        for keysel in keysels:
+            bits.extend(keysel.filter_bits)
+        bits.sort()
+        return bits
+
+    def insert_many(self, keysels, sort=False):
+        """
+        Add a batch of keys to the filter, taking the lock only once.
+
+        If sort is True the bits to be set are first sorted by address.
+        This costs a sort but for filters much larger than the CPU cache
+        turns random memory accesses into a sequential sweep.  See
+        bench/bench_bloom_batch.py for where the crossover lies.
+
+        @param keysels  iterable of KeySelectors
+        @param sort     whether to sort probes by address
+        @return         the number of keys inserted
+        """
+        keysels = list(keysels)
+        if None in keysels:
+            raise XLFilterError("KeySelector may not be None")
+        bits = self._sorted_bits(keysels) if sort else None
+        try:
+            self._lock.acquire()
+            self._do_insert_many(keysels, bits)
+        finally:
+            self._lock.release()
+        return len(keysels)
+
+    def _do_insert_many(self, keysels, bits=None):
+        """
+        Insert a batch of keys, unsynchronized.  If bits, the sorted
+        offsets of the bits selected by the keys, is supplied, the bits
+        are set in that order.
+        """
+        if bits is None:
+            for keysel in keysels:
+                self._do_insert(keysel)
+        else:
+            shift = self._UNIT_SHIFT
+            mask = (1 << shift) - 1
+            if self._views:
+                self._preserve([bit >> 3 for bit in bits])
+            for bit in bits:
+                self._filter[bit >> shift] |= 1 << (bit & mask)
+        self._key_count += len(keysels)
+
+    def is_member_many(self, keysels, sort=False):
+        """
+        Test a batch of keys for membership, taking the lock only once.
+
+        If sort is True the probes for all keys are sorted by address
+        before the filter is touched and the results are then mapped back
+        to the order of the input.  See insert_many().
+
+        @param keysels  iterable of KeySelectors
+        @param sort     whether to sort probes by address
+        @return         list of booleans, True where the key may be present
+        """
+        keysels = list(keysels)
+        if None in keysels:
+            raise XLFilterError("KeySelector may not be None")
+        count = len(keysels)
+        if sort:
+            # each probe is encoded as (bit_offset << ndx_bits) | key_index
+            # so that a plain sort of ints orders the probes by address
+            ndx_bits = count.bit_length()
+            ndx_mask = (1 << ndx_bits) - 1
+            probes = []
+            for ndx, keysel in enumerate(keysels):
+                probes.extend((bit << ndx_bits) | ndx
+                              for bit in keysel.filter_bits)
+            probes.sort()
+        try:
+            self._lock.acquire()
+            if not sort:
+                return [self._is_member(keysel) for keysel in keysels]
+            shift = self._UNIT_SHIFT + ndx_bits
+            mask = (1 << self._UNIT_SHIFT) - 1
+            results = [True] * count
+            fltr = self._filter
+            for probe in probes:
+                if not (fltr[probe >> shift] >>
+                        ((probe >> ndx_bits) & mask)) & 1:
+                    results[probe & ndx_mask] = False
+            return results
+        finally:
+            self._lock.release()
+
+    # WHOLE-FILTER OPERATIONS ---------------------------------------
+
+    def _same_geometry(self, other):
+        """ Raise unless other has the same m, k, and key_bytes. """
+        if not isinstance(other, BloomSHA):
+            raise XLFilterError("not a BloomSHA: %s" % type(other).__name__)
+        if (self._mm, self._kk, self._key_bytes) != \
+                (other.m, other.k, other.key_bytes):
+            raise XLFilterError(
+                "filter geometries differ: (%d, %d, %d) vs (%d, %d, %d)" % (
+                    self._mm, self._kk, self._key_bytes,
+                    other.m, other.k, other.key_bytes))
+
+    def _do_popcount(self):
+        """ Number of bits set in the filter, unsynchronized. """
+        return sum(BYTE_POPCOUNT[b] for b in self._filter)
+
+    def popcount(self):
+        """ Return the number of bits set in the filter. """
+        try:
+            self._lock.acquire()
+            return self._do_popcount()
+        finally:
+            self._lock.release()
+
+    def _body(self):
+        """ The filter bits in the serialized (byte) layout. """
+        return bytes(self._filter)
+
+    def _load_body(self, body):
+        """ Replace the filter bits from the serialized layout. """
+        self._filter[:] = body
+
+    def _do_union(self, other_body):
+        """ OR the serialized bits of another filter into this one. """
+        if self._views:
+            self._preserve_all()
+        for i, val in enumerate(other_body):
+            if val:
+                self._filter[i] |= val
+
+    def union(self, other):
+        """
+        Merge another filter of the same geometry into this one, so that
+        this filter then represents the union of the two sets.  The
+        other filter may use either storage engine.  Key counts are
+        summed.
+        """
+        self._same_geometry(other)
+        other_body, other_count = other.to_bytes(header=False), len(other)
+        try:
+            self._lock.acquire()
+            self._do_union(other_body)
+            self._key_count += other_count
+        finally:
+            self._lock.release()
+
+    def __eq__(self, other):
+        """
+        Filters are equal if they have the same geometry and the same
+        bits set, whatever their storage engine.  Key counts are ignored.
+        """
+        if not isinstance(other, BloomSHA):
+            return NotImplemented
+        if (self._mm, self._kk, self._key_bytes) != \
+                (other.m, other.k, other.key_bytes):
+            return False
+        return self.to_bytes(header=False) == other.to_bytes(header=False)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    # filters are mutable, so equal filters may hash differently; as
+    # before equality was defined, they can be used in sets and as keys
+    __hash__ = object.__hash__
+
+    # SNAPSHOTS -----------------------------------------------------
+
+    def _preserve(self, byte_offsets):
+        """
+        Called by writers, holding the lock, before they change the
+        bytes at the offsets given.  Each live snapshot saves its own
+        copy of any affected page which it has not already saved.
+        """
+        pages = set(offset >> PAGE_SHIFT for offset in byte_offsets)
+        for view in list(self._views):
+            view.save_pages(pages)
+
+    def _preserve_all(self):
+        """ Called by writers before they change the whole filter. """
+        pages = range((self._filter_bytes + PAGE_MASK) >> PAGE_SHIFT)
+        for view in list(self._views):
+            view.save_pages(pages)
+
+    def snapshot(self):
+        """
+        Return an immutable point-in-time view of the filter.
+
+        The snapshot shares the filter's storage; before a page of the
+        filter is first changed, the snapshot is given a copy of that
+        page.  Taking a snapshot therefore costs nothing like a full
+        copy, and readers of the snapshot never take the filter's lock.
+        A snapshot costs writers something only while it is alive, so
+        release() it, or let it be garbage collected, when done.
+        """
+        try:
+            self._lock.acquire()
+            view = BloomSnapshot(self)
+            self._views.add(view)
+        finally:
+            self._lock.release()
+        return view
+
+    # SERIALIZATION -------------------------------------------------
+
+    def to_bytes(self, header=True):
+        """
+        Serialize the filter.  Bit i of the filter is bit (i % 8) of
+        byte (i // 8) of the body, whatever the storage engine, so that
+        a filter serialized by one engine can be loaded by the other.
+
+        @param header  if False, return only the filter bits
+        """
+        try:
+            self._lock.acquire()
+            body = self._body()
+            count = self._key_count
+        finally:
+            self._lock.release()
+        if not header:
+            return body
+        return pack_filter_header(KIND_BLOOM, self._mm, self._kk,
+                                  self._key_bytes, count) + body
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Create a filter from the serialization produced by to_bytes(). """
+        m, k, key_bytes, key_count, body = unpack_filter_header(
+            data, KIND_BLOOM)
+        fltr = cls(m, k, key_bytes)
+        if fltr.k != k:
+            raise XLFilterError("serialized k %d is impossible for m %d" % (
+                k, m))
+        if len(body) != fltr._filter_bytes:
+            raise XLFilterError(
+                "serialized filter has %d bytes of bits, expected %d" % (
+                    len(body), fltr._filter_bytes))
+        fltr._load_body(body)
+        fltr._key_count = key_count
+        return fltr
+
+# ===================================================================
+
+
+class WordBloomSHA(BloomSHA):
+    """
+    A BloomSHA which keeps the filter in an array of 64-bit words
+    rather than in a bytearray.
+
+    Whole-filter operations (clear, popcount, union, comparison)
+    proceed a word at a time, and so run several times faster than on
+    a bytearray.  Single probes do not: under CPython each 64-bit word
+    read is a new int object, where bytes are cached small ints, so
+    inserts and queries cost somewhat more than in a BloomSHA.  Sorted
+    batch inserts set all of the bits falling in one word at once.
+    bench/bench_word_bloom.py compares the two.
+
+    The serialized form is identical to that of BloomSHA: either class
+    can load what the other writes.
+
+    The filter must hold at least one word, so m may not be less than 6.
+    """
+
+    _UNIT_SHIFT = WORD_SHIFT
+
+    def __init__(self, m=20, k=8, key_bytes=20):
+        m = int(m)
+        if m < WORD_SHIFT:
+            raise XLFilterError("m = %d but must be >= %d" % (m, WORD_SHIFT))
+        self._filter_words = 1 << (m - WORD_SHIFT)
+        super().__init__(m, k, key_bytes)
+
+    def _new_filter(self):
+        return array('Q', [0]) * self._filter_words
+
+    def _do_clear(self):
+        """ Clear the filter, unsynchronized; the array is not resized. """
+        if self._views:
+            self._preserve_all()
+        self._filter[:] = array('Q', [0]) * self._filter_words
+
+    def _do_insert(self, keysel):
+        bits, fltr = keysel.filter_bits, self._filter
+        if self._views:
+            self._preserve([(bit >> 6) << 3 for bit in bits])
+        for bit in bits:
+            fltr[bit >> 6] |= 1 << (bit & 63)
+
+    def _is_member(self, keysel):
+        fltr = self._filter
+        for bit in keysel.filter_bits:
+            if not fltr[bit >> 6] & (1 << (bit & 63)):
+                return False
+        return True
+
+    def _do_insert_many(self, keysels, bits=None):
+        if bits is None:
+            super()._do_insert_many(keysels)
+            return
+        # the bits are sorted, so those in the same word are adjacent
+        # and each word is written once
+        if self._views:
+            self._preserve([bit >> 3 for bit in bits])
+        fltr = self._filter
+        word, acc = -1, 0
+        for bit in bits:
+            if bit >> 6 != word:
+                if acc:
+                    fltr[word] |= acc
+                word, acc = bit >> 6, 0
+            acc |= 1 << (bit & 63)
+        if acc:
+            fltr[word] |= acc
+        self._key_count += len(keysels)
+
+    def _do_popcount(self):
+        return sum(map(_bit_count, self._filter))
+
+    @staticmethod
+    def _to_words(body):
+        """ Convert the serialized byte layout to an array of words. """
+        words = array('Q')
+        words.frombytes(body)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words
+
+    def _body(self):
+        if sys.byteorder == 'big':
+            words = array('Q', self._filter)
+            words.byteswap()
+            return words.tobytes()
+        return self._filter.tobytes()
+
+    def _load_body(self, body):
+        self._filter[:] = self._to_words(body)
+
+    def _do_union(self, other_body):
+        if self._views:
+            self._preserve_all()
+        for i, val in enumerate(self._to_words(other_body)):
+            if val:
+                self._filter[i] |= val
+
+# ===================================================================
+
+
+class BufferSnapshot(object):
+    """
+    A read-only, point-in-time view of a buffer (a bytearray or array)
+    whose owner calls save_pages() before changing any part of it.
+
+    Reads take no locks.  The snapshot reads the owner's own storage
+    except where the owner has since changed a page, in which case it
+    reads the copy of that page made just before the change.  The live
+    byte is read before looking for a saved page, and the owner saves
+    a page before changing it, so a reader always sees the value the
+    byte had when the snapshot was taken.
+    """
+
+    def __init__(self, buf):
+        """ Called by the owner, which must not be writing. """
+        self._live = memoryview(buf).cast('B')
+        self._nbytes = len(self._live)
+        self._pages = {}                    # page number -> saved copy
+
+    def save_pages(self, pages):
+        """
+        Save a copy of each of the pages listed unless already saved.
+        Called by the owner, holding its lock, before it writes.
+        """
+        for page in pages:
+            if page not in self._pages:
+                start = page << PAGE_SHIFT
+                self._pages[page] = bytes(self._live[start:start + PAGE_BYTES])
+
+    def _byte_at(self, offset):
+        """ Value of the byte at the offset given. """
+        value = self._live[offset]
+        saved = self._pages.get(offset >> PAGE_SHIFT)
+        if saved is not None:
+            value = saved[offset & PAGE_MASK]
+        return value
+
+    def pages(self):
+        """
+        Generate the contents of the buffer as it was when the snapshot
+        was taken, a page at a time.
+        """
+        for page in range((self._nbytes + PAGE_MASK) >> PAGE_SHIFT):
+            start = page << PAGE_SHIFT
+            chunk = bytes(self._live[start:start + PAGE_BYTES])
+            saved = self._pages.get(page)
+            if saved is not None:
+                chunk = saved
+            yield chunk
+
+# ===================================================================
+
+
+class BloomSnapshot(BufferSnapshot):
+    """
+    A read-only, point-in-time view of a BloomSHA, returned by
+    BloomSHA.snapshot().  Reads never take the filter's lock; they
+    hold the snapshot's own lock only so that release() cannot pull
+    the saved pages out from under them.
+    """
+
+    def __init__(self, fltr):
+        """ Called by the filter, holding its lock. """
+        super().__init__(fltr._filter)
+        self._mm = fltr.m
+        self._kk = fltr.k
+        self._key_bytes = fltr.key_bytes
+        self._filter_bits = fltr.capacity
+        self._key_count = fltr._key_count
+        self._fltr = fltr
+        self._lock = Lock()
+        self._released = False
+
+        # 64-bit words are stored natively, so on big-endian hosts
+        # byte b of the byte layout is at offset b ^ 7
+        self._swap = 7 if (sys.byteorder == 'big' and
+                           memoryview(fltr._filter).itemsize > 1) else 0
+
+    def release(self):
+        """
+        Detach the snapshot from its filter, which then no longer saves
+        pages on its behalf.  Any other use of the snapshot afterwards
+        raises XLFilterError.  Waits for reads in progress to finish.
+        """
+        try:
+            self._lock.acquire()
+            if self._released:
+                return
+            self._released = True
+            fltr = self._fltr
+            try:
+                fltr._lock.acquire()
+                fltr._views.discard(self)
+            finally:
+                fltr._lock.release()
+            self._fltr = None
+            self._pages = {}
+        finally:
+            self._lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def m(self):
+        """ Return m, the number of bits in the filter. """
+        self._check_live()
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return k, the number of hash functions. """
+        self._check_live()
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        self._check_live()
+        return self._key_bytes
+
+    @property
+    def capacity(self):
+        """ Return number of bits in filter. """
+        self._check_live()
+        return self._filter_bits
+
+    def __len__(self):
+        """ The number of keys in the filter when the snapshot was taken. """
+        self._check_live()
+        return self._key_count
+
+    def false_positives(self, n=0):
+        """
+        @param n number of set members
+        @return approximate False positive rate
+        """
+        self._check_live()
+        if n == 0:
+            n = self._key_count
+        return (1 - exp(-self._kk * n / self._filter_bits)) ** self._kk
+
+    def _check_live(self):
+        """ Raise XLFilterError if the snapshot has been released. """
+        try:
+            self._lock.acquire()
+            if self._released:
+                raise XLFilterError("snapshot released")
+        finally:
+            self._lock.release()
+
+    def _byte_at(self, offset):
+        """ Value of the byte at the offset given in the byte layout. """
+        return super()._byte_at(offset ^ self._swap)
+
+    def pages(self):
+        """
+        Generate the filter as it was when the snapshot was taken, a
+        page at a time.  Raises XLFilterError if the snapshot is
+        released, including part way through.
+        """
+        chunks = super().pages()
+        while True:
+            try:
+                self._lock.acquire()
+                if self._released:
+                    raise XLFilterError("snapshot released")
+                chunk = next(chunks, None)
+            finally:
+                self._lock.release()
+            if chunk is None:
+                return
+            yield chunk
+
+    def is_member(self, keysel):
+        """
+        Whether a key was in the filter when the snapshot was taken.
+        Never blocks.
+
+        @param keysel    KeySelector for a key (SHA digest)
+        @return True if the key is in the snapshot
+        """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        try:
+            self._lock.acquire()
+            if self._released:
+                raise XLFilterError("snapshot released")
+            for bit in keysel.filter_bits:
+                if not self._byte_at(bit >> 3) & (1 << (bit & 7)):
+                    return False
+            return True
+        finally:
+            self._lock.release()
+
+    def to_bytes(self, header=True):
+        """
+        Serialize the snapshot in the format of BloomSHA.to_bytes();
+        BloomSHA.from_bytes() will load the result.
+        """
+        body = b''.join(self.pages())
+        if self._swap:
+            words = array('Q', body)
+            words.byteswap()
+            body = words.tobytes()
+        if not header:
+            return body
+        return pack_filter_header(KIND_BLOOM, self._mm, self._kk,
+                                  self._key_bytes, self._key_count) + body
+
 # ===================================================================
 
 
@@ -229,41 +894,64 @@ class KeySelector(object):
                     len(key), key_bytes))
         m, k = bloom.m, bloom.k
 
-        # DEBUG
-        # print("KeySelector: m = %d, k = %d" % (m, k))
-        # END
-        bitsel = [0] * k        # ints used to select flag bits
-        bytesel = [0] * k       # ints used to select flag bytes
-
-        # Given a key, populate the byte and bit offset arrays, each
-        # of which has k elements.  The low order 3 bits are used to
-        # select a bit within a byte.  The higher order bits are used
-        # select the byte.
-
-        # convert the bytes of the key to a single long int
+        # The filter bit offsets are sliced m bits at a time from the
+        # key, taken as a little-endian integer.  The low order 3 bits
+        # of each offset select a bit within a byte and the rest select
+        # the byte; equally the low order 6 bits select a bit within a
+        # 64-bit word.  The byte and word selectors are derived from
+        # the offsets only if asked for.
         i = int.from_bytes(key, 'little')     # signed=False
+        mask = (1 << m) - 1
+        self._filter_bits = [(i >> (j * m)) & mask for j in range(k)]
+        self._mm = m
+        self._bitsel = None
+        self._bytesel = None
+        self._wordsel = None
+        self._wbitsel = None
 
-        # extract the k bit and byte selectors
-        for j in range(k):
-            bitsel[j] = i & 0x7       # get 3 bits selecting bit in byte
-            i >>= 3
-            byte_mask = (1 << (m - 3)) - 1
-            bytesel[j] = i & byte_mask
-            i >>= m - 3
+    @property
+    def m(self):
+        """ Return log2 of the number of bits the selector was built for. """
+        return self._mm
 
-        self._bitsel = bitsel
-        self._bytesel = bytesel
+    @property
+    def k(self):
+        """ Return the number of hash functions selected for. """
+        return len(self._filter_bits)
 
     @property
     def bitsel(self):
         """ Return the bit selector. """
+        if self._bitsel is None:
+            self._bitsel = [bit & 7 for bit in self._filter_bits]
         return self._bitsel
 
     @property
     def bytesel(self):
         """ Return the byte selector. """
+        if self._bytesel is None:
+            self._bytesel = [bit >> 3 for bit in self._filter_bits]
         return self._bytesel
 
+    @property
+    def filter_bits(self):
+        """ Return the offsets of the k selected bits within the filter. """
+        return self._filter_bits
+
+    @property
+    def wordsel(self):
+        """ Return the selector for 64-bit words. """
+        if self._wordsel is None:
+            self._wordsel = [bit >> 6 for bit in self._filter_bits]
+        return self._wordsel
+
+    @property
+    def wbitsel(self):
+        """ Return the selector for bits within 64-bit words. """
+        if self._wbitsel is None:
+            self._wbitsel = [bit & 63 for bit in self._filter_bits]
+        return self._wbitsel
+
     @property
     def key(self):
         """ Return the value of the key associated with the selector. """
@@ -272,6 +960,110 @@ class KeySelector(object):
 # ===================================================================
 
 
+class SelectorCache(object):
+    """
+    A size-bounded, least-recently-used cache of KeySelectors, keyed by
+    (key, m, k, key_bytes), so that selectors for frequently seen keys
+    are sliced out of the key only once.
+
+    Because the key is part of the cache key and the selectors depend
+    only on the key, m, and k, one cache can be shared by any number of
+    filters, of any kind, and by any number of threads.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, maxsize=4096):
+        """
+        @param maxsize  the number of selectors retained
+        """
+        maxsize = int(maxsize)
+        if maxsize <= 0:
+            raise XLFilterError("cache size must be positive")
+        self._maxsize = maxsize
+        self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = Lock()
+
+    @property
+    def maxsize(self):
+        """ Return the number of selectors retained. """
+        return self._maxsize
+
+    @property
+    def hits(self):
+        """ Number of lookups satisfied from the cache. """
+        return self._hits
+
+    @property
+    def misses(self):
+        """ Number of lookups which built a new KeySelector. """
+        return self._misses
+
+    def hit_rate(self):
+        """ Fraction of lookups satisfied from the cache. """
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, bloom):
+        """
+        Return a KeySelector for the key and filter, from the cache if
+        possible.
+
+        @param key    the key (SHA digest)
+        @param bloom  the filter, or anything else with m, k, and key_bytes
+        """
+        if bloom is None:
+            raise XLFilterError("bloom may not be None")
+        if not key:
+            raise XLFilterError("key may not be None or empty")
+        # key_bytes too, so that a hit never skips KeySelector's check
+        # of the key's length
+        cache_key = (bytes(key), bloom.m, bloom.k, bloom.key_bytes)
+        try:
+            self._lock.acquire()
+            keysel = self._cache.get(cache_key)
+            if keysel is not None:
+                self._cache.move_to_end(cache_key)
+                self._hits += 1
+                return keysel
+            self._misses += 1
+        finally:
+            self._lock.release()
+
+        # build the selector without holding the lock
+        keysel = KeySelector(cache_key[0], bloom)
+        try:
+            self._lock.acquire()
+            self._cache[cache_key] = keysel
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+        finally:
+            self._lock.release()
+        return keysel
+
+    def get_many(self, keys, bloom):
+        """ Return KeySelectors for a batch of keys, in input order. """
+        return [self.get(key, bloom) for key in keys]
+
+    def clear(self):
+        """ Empty the cache and zero the statistics. """
+        try:
+            self._lock.acquire()
+            self._cache.clear()
+            self._hits = 0
+            self._misses = 0
+        finally:
+            self._lock.release()
+
+# ===================================================================
+
+
 class NibbleCounters(object):
     """
     Maintain a set of 4-bit counters, one for each bit in a BloomSHA.
@@ -288,12 +1080,64 @@ class NibbleCounters(object):
     def __init__(self, m=20):           # default is for SHA1
         self._nibble_count = 1 << m     # ie, 2**20; the size of the filter
         self._counters = bytearray(self._nibble_count // 2)
+        self._views = WeakSet()         # live snapshots of the counters
+
+    def snapshot(self):
+        """
+        Return a BufferSnapshot of the counters, two to a byte, low-order
+        nibble first.  Unsynchronized: the caller must ensure that the
+        counters are not changed while this runs, and must detach() the
+        snapshot, under the same synchronization, when done with it.
+        """
+        view = BufferSnapshot(self._counters)
+        self._views.add(view)
+        return view
+
+    def detach(self, view):
+        """ Stop saving pages for a snapshot.  Unsynchronized. """
+        self._views.discard(view)
+
+    def _preserve(self, byte_offset):
+        """ Let live snapshots save the page about to be changed. """
+        pages = (byte_offset >> PAGE_SHIFT,)
+        for view in list(self._views):
+            view.save_pages(pages)
+
+    def _preserve_all(self):
+        pages = range((len(self._counters) + PAGE_MASK) >> PAGE_SHIFT)
+        for view in list(self._views):
+            view.save_pages(pages)
 
     def clear(self):
         """ Zero out all of the counters.  Unsynchronized. """
 
-        for i in range(self._counters // 2):
-            self._counters[i] = 0           # zeroes out two counters
+        if self._views:
+            self._preserve_all()
+        self._counters[:] = bytes(len(self._counters))
+
+    def halve(self):
+        """
+        Halve every counter, rounding down, in a single pass over the
+        bytes.  Unsynchronized.
+        """
+        if self._views:
+            self._preserve_all()
+        self._counters[:] = self._counters.translate(HALVE_NIBBLES)
+
+    def value(self, filter_bit):
+        """
+        @param filter_bit offset of bit in the filter
+        @return           current value of the nibble
+        """
+        if filter_bit < 0:
+            raise XLFilterError("filter bit offset cannot be negative.")
+        if filter_bit >= self._nibble_count:
+            raise XLFilterError("filter bit offset %d out of range" %
+                                filter_bit)
+        cur_byte = self._counters[filter_bit // 2]
+        if filter_bit & 1:
+            return cur_byte >> 4
+        return cur_byte & 0xf
 
     def inc(self, filter_bit):
         """
@@ -325,6 +1169,8 @@ class NibbleCounters(object):
         # print("0x%x  " % value, end='')
         # END
 
+        if self._views:
+            self._preserve(byte_offset)
         if upper_nibble:
             self._counters[byte_offset] &= 0x0f  # mask off existing value
             self._counters[byte_offset] |= (value << 4)
@@ -370,6 +1216,8 @@ class NibbleCounters(object):
         # print("0x%x  " % value, end='')
         # END
 
+        if self._views:
+            self._preserve(byte_offset)
         if upper_nibble:
             self._counters[byte_offset] &= 0x0f  # mask off existing value
             self._counters[byte_offset] |= value << 4
@@ -410,10 +1258,10 @@ class CountingBloom(BloomSHA):
         Clear both the underlying filter in the superclass and the
         bit counters maintained here.
 
-        XXX Possible deadlock.
+        Locks are taken in the same order as everywhere else in this
+        class, _cb_lock then _lock, so this cannot deadlock against
+        insert() or remove(); see xlcrypto.filters.stress.
         """
-
-        # XXX ORDER IN WHICH LOCKS ARE OBTAINED MUST BE THE SAME EVERYWHERE.
         try:
             self._cb_lock.acquire()
             super().clear()        # BloomSHA; otherwise unsynchronized
@@ -428,18 +1276,46 @@ class CountingBloom(BloomSHA):
 
         @param b byte array representing a key (SHA digest)
         """
-        bytesel, bitsel = keysel.bytesel, keysel.bitsel
-        filter_bit = []
-        for i in range(self._kk):
-            filter_bit.append((bytesel[i] << 3) + bitsel[i])
         try:
             self._cb_lock.acquire()
             super().insert(keysel)                  # add to BloomSHA
-            for i in range(self._kk):
-                self._counters.inc(filter_bit[i])   # increment counter
+            for bit in keysel.filter_bits:
+                self._counters.inc(bit)             # increment counter
         finally:
             self._cb_lock.release()
 
+    def insert_many(self, keysels, sort=False):
+        """
+        Add a batch of keys to the filter, updating counters as it does
+        so.  If sort is True, counters as well as filter bits are
+        updated in address order.  See BloomSHA.insert_many().
+
+        @param keysels  iterable of KeySelectors
+        @param sort     whether to sort probes by address
+        @return         the number of keys inserted
+        """
+        keysels = list(keysels)
+        if None in keysels:
+            raise XLFilterError("KeySelector may not be None")
+        bits = self._sorted_bits(keysels) if sort else None
+        try:
+            self._cb_lock.acquire()
+            try:
+                self._lock.acquire()
+                self._do_insert_many(keysels, bits)     # add to BloomSHA
+            finally:
+                self._lock.release()
+            if bits is None:
+                for keysel in keysels:
+                    for bit in keysel.filter_bits:
+                        self._counters.inc(bit)     # increment counter
+            else:
+                for bit in bits:
+                    self._counters.inc(bit)
+        finally:
+            self._cb_lock.release()
+        return len(keysels)
+
     def remove(self, keysel):
         """
         Remove a key from the set, updating counters while doing so.
@@ -454,22 +1330,58 @@ class CountingBloom(BloomSHA):
         """
         if not self.is_member(keysel):
             return
+        try:
+            self._cb_lock.acquire()
+            # lock order as in insert(): _cb_lock, then _lock
+            try:
+                self._lock.acquire()
+                self._do_remove(keysel)
+            finally:
+                self._lock.release()
+        finally:
+            self._cb_lock.release()
 
-        bytesel, bitsel = keysel.bytesel, keysel.bitsel
-        filter_bit = []
-        for i in range(self._kk):
-            filter_bit.append((bytesel[i] << 3) + bitsel[i])
+    def remove_many(self, keysels):
+        """
+        Remove a batch of keys from the set, taking the locks only once.
+        Keys which are not members are skipped.
+
+        @param keysels  iterable of KeySelectors
+        @return         the number of keys removed
+        """
+        keysels = list(keysels)
+        if None in keysels:
+            raise XLFilterError("KeySelector may not be None")
+        removed = 0
         try:
             self._cb_lock.acquire()
-            present = self.is_member(keysel)
-            if present:
-                for i in range(self._kk):
-                    new_count = self._counters.dec(filter_bit[i])
-                    if new_count == 0:
-                        # mask out the relevant bit
-                        val = self._filter[bytesel[i]] & ~(1 << bitsel[i])
-                        self._filter[bytesel[i]] = val
-                if self._key_count > 0:
-                    self._key_count -= 1
+            try:
+                self._lock.acquire()
+                for keysel in keysels:
+                    if self._do_remove(keysel):
+                        removed += 1
+            finally:
+                self._lock.release()
         finally:
             self._cb_lock.release()
+        return removed
+
+    def _do_remove(self, keysel):
+        """
+        Remove a key if it is present.  The caller holds both locks.
+
+        @return True if the key was removed
+        """
+        if not self._is_member(keysel):
+            return False
+        bits = keysel.filter_bits
+        if self._views:
+            self._preserve([bit >> 3 for bit in bits])
+        for bit in bits:
+            new_count = self._counters.dec(bit)
+            if new_count == 0:
+                # mask out the relevant bit
+                self._filter[bit >> 3] &= ~(1 << (bit & 7))
+        if self._key_count > 0:
+            self._key_count -= 1
+        return True
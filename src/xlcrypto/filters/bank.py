@@ -0,0 +1,247 @@
+# xlcrypto_py/src/xlcrypto/filters/bank.py
+
+"""
+A bank of same-geometry Bloom filters stored bit-sliced, so that one
+probe tests a key against every filter in the bank.
+"""
+
+from threading import Lock
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, KIND_BLOOM, pack_filter_header
+
+__all__ = ['BloomBank', ]
+
+# load() merges a filter into the bank this many bytes at a time
+MERGE_BYTES = 4096
+
+
+class BloomBank(object):
+    """
+    N Bloom filters of identical geometry (m, k, key_bytes), stored
+    bit-sliced: for each of the 2**m filter bits there is a row of N
+    bits, bit i of which is that filter bit of filter i.
+
+    A key is tested against all N filters by reading the k rows its
+    KeySelector selects and ANDing them together: bit i of the result
+    is set if filter i may contain the key.  So locating a key costs k
+    row reads rather than N * k probes.
+
+    The bank takes (N + 7) // 8 * 2**m / 8 bytes, what N separate
+    filters would take.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, count, m=20, k=8, key_bytes=20):
+        """
+        Create a bank of count empty filters.
+
+        @param count     number of filters in the bank
+        @param m         determines number of bits in each filter
+        @param k         number of hash functions
+        @param key_bytes length in bytes of keys acceptable to the filters
+        """
+        count = int(count)
+        if count <= 0:
+            raise XLFilterError("bank must hold at least one filter")
+        # BloomSHA validates the parameters and reduces k if necessary
+        proto = BloomSHA(m, k, key_bytes)
+        self._mm, self._kk, self._key_bytes = proto.m, proto.k, proto.key_bytes
+        self._count = count
+        self._row_bytes = (count + 7) // 8
+        self._bank = bytearray(self._row_bytes << self._mm)
+        self._key_counts = [0] * count
+        self._lock = Lock()
+
+    @classmethod
+    def from_filters(cls, filters):
+        """ Create a bank holding copies of a list of BloomSHAs. """
+        filters = list(filters)
+        if not filters:
+            raise XLFilterError("no filters to put in the bank")
+        first = filters[0]
+        bank = cls(len(filters), first.m, first.k, first.key_bytes)
+        for ndx, fltr in enumerate(filters):
+            bank.load(ndx, fltr)
+        return bank
+
+    @property
+    def m(self):
+        """ Return m, log2 of the number of bits in each filter. """
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return k, the number of hash functions. """
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    @property
+    def count(self):
+        """ Number of filters in the bank. """
+        return self._count
+
+    def key_count(self, ndx):
+        """ Number of keys inserted into the filter at index ndx. """
+        self._check_ndx(ndx)
+        return self._key_counts[ndx]
+
+    def _check_ndx(self, ndx):
+        if not 0 <= ndx < self._count:
+            raise XLFilterError("filter index %d out of range 0..%d" % (
+                ndx, self._count - 1))
+
+    def _check_keysel(self, keysel):
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        if keysel.m != self._mm or keysel.k != self._kk:
+            raise XLFilterError(
+                "KeySelector is for m=%d, k=%d but bank has m=%d, k=%d" %
+                (keysel.m, keysel.k, self._mm, self._kk))
+
+    def _column(self, ndx):
+        """
+        The slice of the bank holding the byte of each row in which the
+        bit for filter ndx lies.
+        """
+        return slice(ndx >> 3, None, self._row_bytes)
+
+    # SINGLE FILTERS ------------------------------------------------
+
+    def insert(self, ndx, keysel):
+        """ Add a key to the filter at index ndx. """
+        self._check_ndx(ndx)
+        self._check_keysel(keysel)
+        offset = ndx >> 3
+        mask = 1 << (ndx & 7)
+        row_bytes = self._row_bytes
+        try:
+            self._lock.acquire()
+            for bit in keysel.filter_bits:
+                self._bank[bit * row_bytes + offset] |= mask
+            self._key_counts[ndx] += 1
+        finally:
+            self._lock.release()
+
+    def _do_clear_filter(self, ndx):
+        """ Zero the bits of filter ndx, unsynchronized. """
+        column = self._column(ndx)
+        keep = bytes(val & ~(1 << (ndx & 7)) for val in range(256))
+        self._bank[column] = self._bank[column].translate(keep)
+        self._key_counts[ndx] = 0
+
+    def clear_filter(self, ndx):
+        """ Empty the filter at index ndx. """
+        self._check_ndx(ndx)
+        try:
+            self._lock.acquire()
+            self._do_clear_filter(ndx)
+        finally:
+            self._lock.release()
+
+    def load(self, ndx, fltr):
+        """
+        Replace the filter at index ndx with a copy of a BloomSHA of the
+        same geometry.
+        """
+        self._check_ndx(ndx)
+        if (fltr.m, fltr.k, fltr.key_bytes) != \
+                (self._mm, self._kk, self._key_bytes):
+            raise XLFilterError("filter geometry differs from the bank's")
+        body = fltr.to_bytes(header=False)
+        key_count = len(fltr)
+
+        # row r is bit (r % 8) of byte (r // 8) of the filter, so rows
+        # j, j + 8, j + 16 ... of the column take bit j of each byte,
+        # moved to the filter's bit position by a translation table
+        set_bit = 1 << (ndx & 7)
+        stride = self._row_bytes << 3
+        try:
+            self._lock.acquire()
+            self._do_clear_filter(ndx)
+            bank = self._bank
+            for j in range(8):
+                table = bytes(set_bit if (val >> j) & 1 else 0
+                              for val in range(256))
+                bits = body.translate(table)
+                column = slice((ndx >> 3) + j * self._row_bytes, None, stride)
+                rows = bank[column]
+                for start in range(0, len(rows), MERGE_BYTES):
+                    end = start + MERGE_BYTES
+                    chunk = rows[start:end]
+                    merged = int.from_bytes(chunk, 'little') | \
+                        int.from_bytes(bits[start:end], 'little')
+                    rows[start:end] = merged.to_bytes(len(chunk), 'little')
+                bank[column] = rows
+            self._key_counts[ndx] = key_count
+        finally:
+            self._lock.release()
+
+    def extract(self, ndx):
+        """ Return a copy of the filter at index ndx as a BloomSHA. """
+        self._check_ndx(ndx)
+        try:
+            self._lock.acquire()
+            rows = bytes(self._bank[self._column(ndx)])
+            key_count = self._key_counts[ndx]
+        finally:
+            self._lock.release()
+        # row r is bit (r % 8) of byte (r // 8) of the filter
+        set_bit = 1 << (ndx & 7)
+        packed = 0
+        for j in range(8):
+            table = bytes((1 << j) if val & set_bit else 0
+                          for val in range(256))
+            packed |= int.from_bytes(rows[j::8].translate(table), 'little')
+        return BloomSHA.from_bytes(
+            pack_filter_header(KIND_BLOOM, self._mm, self._kk,
+                               self._key_bytes, key_count) +
+            packed.to_bytes(len(rows) // 8, 'little'))
+
+    # WHOLE BANK ----------------------------------------------------
+
+    def _do_query(self, keysel):
+        row_bytes = self._row_bytes
+        bank = self._bank
+        result = -1
+        for bit in keysel.filter_bits:
+            start = bit * row_bytes
+            result &= int.from_bytes(bank[start:start + row_bytes], 'little')
+            if not result:
+                break
+        return result & ((1 << self._count) - 1)
+
+    def query(self, keysel):
+        """
+        Test a key against every filter in the bank.
+
+        @param keysel  KeySelector for the key (SHA digest)
+        @return        int bitmask; bit i is set if filter i may hold the key
+        """
+        self._check_keysel(keysel)
+        try:
+            self._lock.acquire()
+            return self._do_query(keysel)
+        finally:
+            self._lock.release()
+
+    def query_many(self, keysels):
+        """ Return the bitmasks for a batch of keys, in input order. """
+        keysels = list(keysels)
+        for keysel in keysels:
+            self._check_keysel(keysel)
+        try:
+            self._lock.acquire()
+            return [self._do_query(keysel) for keysel in keysels]
+        finally:
+            self._lock.release()
+
+    def holders(self, keysel):
+        """ Return the indexes of the filters which may hold the key. """
+        mask = self.query(keysel)
+        return [ndx for ndx in range(self._count) if (mask >> ndx) & 1]
@@ -0,0 +1,286 @@
+# xlcrypto_py/src/xlcrypto/filters/cli.py
+
+"""
+xlcrypto-bloom: build, query, describe, and merge serialized BloomSHA
+filters from lists of digests.
+
+    xlcrypto-bloom build -o FILTER [-m M] [-k K] [-b KEY_BYTES] [INPUT ...]
+    xlcrypto-bloom query FILTER [--absent] [INPUT ...]
+    xlcrypto-bloom stats FILTER ...
+    xlcrypto-bloom merge -o FILTER INPUT_FILTER ...
+
+Digests are read from the files named, or from stdin if none are named
+or a name is '-'.  With --format hex (the default) or base64 the input
+is text, one digest per line or separated by any whitespace; with
+--format raw it is digests packed end to end.
+"""
+
+import binascii
+import os
+import sys
+from argparse import ArgumentParser
+
+from xlcrypto import XLCryptoError, XLFilterError
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector, split_keys
+
+__all__ = ['main', 'read_keys', 'FORMATS']
+
+FORMATS = ('hex', 'base64', 'raw')
+
+# bytes read from an input at a time
+CHUNK_BYTES = 1 << 22
+
+
+def _open_inputs(names):
+    """ Generate (name, binary file) for each input, '-' being stdin. """
+    for name in names or ['-']:
+        if name == '-':
+            yield '<stdin>', sys.stdin.buffer
+        else:
+            with open(name, 'rb') as file:
+                yield name, file
+
+
+def _decode_tokens(tokens, fmt, key_bytes, where):
+    """ Decode a list of text tokens into a list of keys, in bulk. """
+    if not tokens:
+        return []
+    try:
+        # every token must be the right length, not just their total,
+        # or one short token and one long one would decode as two keys
+        if fmt == 'hex':
+            width = 2 * key_bytes
+            if all(len(token) == width for token in tokens):
+                return split_keys(binascii.unhexlify(b''.join(tokens)),
+                                  key_bytes)
+        elif key_bytes % 3 == 0:
+            # unpadded, so the tokens can be decoded all at once
+            width = 4 * (key_bytes // 3)
+            if all(len(token) == width for token in tokens):
+                return split_keys(binascii.a2b_base64(b''.join(tokens)),
+                                  key_bytes)
+        else:
+            keys = [binascii.a2b_base64(token) for token in tokens]
+            if all(len(key) == key_bytes for key in keys):
+                return keys
+    except binascii.Error as exc:
+        raise XLFilterError("%s: bad %s input: %s" % (where, fmt, exc))
+    # find the offending token for the message
+    decode = binascii.unhexlify if fmt == 'hex' else binascii.a2b_base64
+    for token in tokens:
+        try:
+            if len(decode(token)) == key_bytes:
+                continue
+        except binascii.Error:
+            pass
+        raise XLFilterError("%s: %r is not a %d-byte %s digest" % (
+            where, token[:80], key_bytes, fmt))
+    raise XLFilterError("%s: bad %s input" % (where, fmt))
+
+
+def read_keys(names, fmt='hex', key_bytes=20, chunk_bytes=CHUNK_BYTES):
+    """
+    Read digests from the files named, generating them as lists of keys,
+    one list per chunk of input.
+
+    @param names        file names, '-' meaning stdin; stdin if empty
+    @param fmt          one of FORMATS
+    @param key_bytes    length in bytes of each digest
+    @param chunk_bytes  approximate number of bytes read at a time
+    """
+    if fmt not in FORMATS:
+        raise XLFilterError("unknown input format '%s'" % fmt)
+    if fmt == 'raw':
+        # read whole numbers of keys at a time
+        chunk_bytes = max(1, chunk_bytes // key_bytes) * key_bytes
+    for where, file in _open_inputs(names):
+        tail = b''
+        while True:
+            chunk = file.read(chunk_bytes)
+            if fmt == 'raw':
+                if not chunk:
+                    if tail:
+                        raise XLFilterError(
+                            "%s: %d bytes left over after the last digest" % (
+                                where, len(tail)))
+                    break
+                chunk = tail + chunk
+                usable = len(chunk) - len(chunk) % key_bytes
+                tail = chunk[usable:]
+                yield split_keys(chunk[:usable], key_bytes)
+                continue
+
+            if not chunk:
+                tokens = tail.split()
+                tail = b''
+            else:
+                chunk = tail + chunk
+                # a token may be split across chunks: hold back the rest
+                # of the input after the last whitespace
+                cut = max(chunk.rfind(b'\n'), chunk.rfind(b' '),
+                          chunk.rfind(b'\t'), chunk.rfind(b'\r'))
+                tail = chunk[cut + 1:]
+                tokens = chunk[:cut + 1].split()
+            keys = _decode_tokens(tokens, fmt, key_bytes, where)
+            if keys:
+                yield keys
+            if not chunk:
+                break
+
+
+def _load_filter(path):
+    with open(path, 'rb') as file:
+        return BloomSHA.from_bytes(file.read())
+
+
+def _write_filter(path, fltr):
+    """ Write the filter atomically, or to stdout if path is '-'. """
+    data = fltr.to_bytes()
+    if path == '-':
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def do_build(args):
+    cls = WordBloomSHA if args.word else BloomSHA
+    fltr = cls(args.m, args.k, args.key_bytes)
+    for keys in read_keys(args.inputs, args.format, args.key_bytes):
+        fltr.insert_many([KeySelector(key, fltr) for key in keys])
+    _write_filter(args.output, fltr)
+    if args.verbose:
+        sys.stderr.write("%d keys; false positive rate %.3g\n" % (
+            len(fltr), fltr.false_positives()))
+    return 0
+
+
+def do_query(args):
+    fltr = _load_filter(args.filter)
+    if fltr.key_bytes != args.key_bytes and args.key_bytes_given:
+        raise XLFilterError("filter takes %d-byte keys, not %d" % (
+            fltr.key_bytes, args.key_bytes))
+    key_bytes = fltr.key_bytes
+    want = not args.absent
+    out = sys.stdout
+    found = missing = 0
+    for keys in read_keys(args.inputs, args.format, key_bytes):
+        results = fltr.is_member_many(
+            [KeySelector(key, fltr) for key in keys])
+        lines = []
+        for key, present in zip(keys, results):
+            if present:
+                found += 1
+            else:
+                missing += 1
+            if present == want:
+                lines.append(binascii.hexlify(key).decode('ascii'))
+        if lines:
+            out.write('\n'.join(lines) + '\n')
+    if args.verbose:
+        sys.stderr.write("%d present, %d absent\n" % (found, missing))
+    return 0
+
+
+def do_stats(args):
+    for path in args.filters:
+        fltr = _load_filter(path)
+        bits = fltr.popcount()
+        print("%s:" % path)
+        print("    m          %d (%d bits)" % (fltr.m, fltr.capacity))
+        print("    k          %d" % fltr.k)
+        print("    key_bytes  %d" % fltr.key_bytes)
+        print("    keys       %d" % len(fltr))
+        print("    bits set   %d (%.2f%%)" % (bits,
+                                              100.0 * bits / fltr.capacity))
+        # the fill ratio gives the actual rate, whatever the key count
+        print("    false pos  %.3g" % ((bits / fltr.capacity) ** fltr.k))
+    return 0
+
+
+def do_merge(args):
+    merged = None
+    for path in args.inputs:
+        fltr = _load_filter(path)
+        if merged is None:
+            merged = fltr
+        else:
+            merged.union(fltr)
+    _write_filter(args.output, merged)
+    return 0
+
+
+def _parser():
+    parser = ArgumentParser(
+        prog='xlcrypto-bloom',
+        description='build, query, and combine BloomSHA filters')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    def add_input_args(cmd):
+        cmd.add_argument('-f', '--format', choices=FORMATS, default='hex',
+                         help='input encoding (default hex)')
+        cmd.add_argument('-b', '--key-bytes', type=int, default=None,
+                         help='digest length in bytes (default 20)')
+        cmd.add_argument('-v', '--verbose', action='store_true',
+                         help='report counts on stderr')
+        cmd.add_argument('inputs', nargs='*',
+                         help="digest files; '-' or none for stdin")
+
+    cmd = sub.add_parser('build', help='build a filter from digests')
+    cmd.add_argument('-o', '--output', required=True,
+                     help="filter file to write; '-' for stdout")
+    cmd.add_argument('-m', type=int, default=20,
+                     help='log2 of the number of bits (default 20)')
+    cmd.add_argument('-k', type=int, default=8,
+                     help='number of hash functions (default 8)')
+    cmd.add_argument('-w', '--word', action='store_true',
+                     help='use 64-bit word storage while building')
+    add_input_args(cmd)
+    cmd.set_defaults(func=do_build)
+
+    cmd = sub.add_parser('query', help='print digests found in a filter')
+    cmd.add_argument('filter', help='filter file')
+    cmd.add_argument('-a', '--absent', action='store_true',
+                     help='print digests not found instead')
+    add_input_args(cmd)
+    cmd.set_defaults(func=do_query)
+
+    cmd = sub.add_parser('stats', help='describe filters')
+    cmd.add_argument('filters', nargs='+', help='filter files')
+    cmd.set_defaults(func=do_stats)
+
+    cmd = sub.add_parser('merge', help='union of filters')
+    cmd.add_argument('-o', '--output', required=True,
+                     help="filter file to write; '-' for stdout")
+    cmd.add_argument('inputs', nargs='+', help='filter files')
+    cmd.set_defaults(func=do_merge)
+    return parser
+
+
+def main(argv=None):
+    """ Entry point for the xlcrypto-bloom command. """
+    args = _parser().parse_args(argv)
+    if hasattr(args, 'key_bytes'):
+        args.key_bytes_given = args.key_bytes is not None
+        if not args.key_bytes_given:
+            args.key_bytes = 20
+    try:
+        return args.func(args)
+    except (OSError, XLCryptoError) as exc:
+        sys.stderr.write("xlcrypto-bloom: %s\n" % exc)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# xlcrypto_py/src/xlcrypto/filters/count_min.py
+
+""" Count-min sketch for approximate counts of SHA digests. """
+
+import sys
+from array import array
+from math import e as EULER
+from threading import Lock
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (MIN_M, MIN_K, KIND_COUNT_MIN,
+                              pack_filter_header, unpack_filter_header)
+
+__all__ = ['CountMinSHA', 'COUNTER_BITS']
+
+# array typecodes for each supported counter width
+COUNTER_BITS = {}
+for _code in 'BHILQ':
+    COUNTER_BITS.setdefault(array(_code).itemsize * 8, _code)
+del _code
+
+
+class CountMinSHA(object):
+    """
+    A count-min sketch over SHA digests: an approximate count of the
+    number of times each key has been added.
+
+    The sketch is k rows of 2**m counters.  As in BloomSHA, the k 'hash
+    functions' are disjoint m-bit slices of the digest, so a key is
+    located with a KeySelector: the j-th selected filter bit is the
+    column of the key's counter in row j.  The estimate for a key is the
+    smallest of its k counters; it never undercounts, and overcounts by
+    more than e * N / 2**m, where N is the total of all counts added,
+    with probability no greater than e^-k.
+
+    With conservative update a counter is only raised as far as needed
+    to make the key's estimate correct, which reduces overcounting
+    considerably, but sketches built that way should not be used with
+    subtraction.
+
+    Counters are 8, 16, 32, or 64 bits wide and saturate rather than
+    overflow.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, m=16, k=4, key_bytes=20, counter_bits=32,
+                 conservative=False):
+        """
+        @param m            log2 of the number of counters in each row
+        @param k            number of rows
+        @param key_bytes    length in bytes of acceptable keys
+        @param counter_bits width of each counter in bits
+        @param conservative whether to use conservative update
+        """
+        m = int(m)
+        if m < MIN_M:
+            raise XLFilterError("m = %d but must be > %d" % (m, MIN_M))
+        key_bytes = int(key_bytes)
+        if key_bytes <= 0:
+            raise XLFilterError("must specify a positive key length")
+        k = int(k)
+        if k < MIN_K:
+            raise XLFilterError("k = %d but must be >= %d" % (k, MIN_K))
+        if k * m > key_bytes * 8:
+            k = (key_bytes * 8) // m    # rounds down to number that will fit
+        counter_bits = int(counter_bits)
+        if counter_bits not in COUNTER_BITS:
+            raise XLFilterError("counter width must be one of %s, not %d" % (
+                sorted(COUNTER_BITS), counter_bits))
+
+        self._mm = m
+        self._kk = k
+        self._key_bytes = key_bytes
+        self._counter_bits = counter_bits
+        self._max_count = (1 << counter_bits) - 1
+        self._conservative = bool(conservative)
+        self._total = 0
+        self._counters = array(COUNTER_BITS[counter_bits], [0]) * (k << m)
+        self._lock = Lock()
+
+    @property
+    def m(self):
+        """ Return m, log2 of the number of counters in each row. """
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return k, the number of rows. """
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    @property
+    def counter_bits(self):
+        """ Width of each counter in bits. """
+        return self._counter_bits
+
+    @property
+    def conservative(self):
+        """ Whether conservative update is used. """
+        return self._conservative
+
+    @property
+    def total(self):
+        """ The sum of all counts added to the sketch. """
+        return self._total
+
+    def error_bound(self):
+        """
+        Return the amount by which an estimate may exceed the true count,
+        except with probability e^-k.
+        """
+        return EULER * self._total / (1 << self._mm)
+
+    def _cells(self, keysel):
+        """ Offsets of the key's counter in each row. """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        if keysel.m != self._mm or keysel.k != self._kk:
+            raise XLFilterError(
+                "KeySelector is for m=%d, k=%d but sketch has m=%d, k=%d" %
+                (keysel.m, keysel.k, self._mm, self._kk))
+        bits = keysel.filter_bits
+        m = self._mm
+        return [(j << m) | bits[j] for j in range(self._kk)]
+
+    def _do_add(self, cells, count):
+        """ Add count to the counters at cells, unsynchronized. """
+        counters, max_count = self._counters, self._max_count
+        if self._conservative:
+            target = min(counters[cell] for cell in cells) + count
+            if target > max_count:
+                target = max_count
+            for cell in cells:
+                if counters[cell] < target:
+                    counters[cell] = target
+        else:
+            for cell in cells:
+                value = counters[cell] + count
+                counters[cell] = value if value < max_count else max_count
+        self._total += count
+
+    def add(self, keysel, count=1):
+        """
+        Add count occurrences of a key to the sketch.
+
+        @param keysel  KeySelector for the key (SHA digest)
+        @param count   a non-negative number of occurrences
+        @return        the new estimate for the key
+        """
+        if count < 0:
+            raise XLFilterError("count may not be negative")
+        cells = self._cells(keysel)
+        try:
+            self._lock.acquire()
+            self._do_add(cells, count)
+            return min(self._counters[cell] for cell in cells)
+        finally:
+            self._lock.release()
+
+    def add_many(self, keysels, count=1):
+        """
+        Add count occurrences of each of a batch of keys, taking the
+        lock only once.  Keys may be repeated.
+
+        @param keysels iterable of KeySelectors
+        @param count   occurrences to add for each key
+        @return        the number of keys in the batch
+        """
+        if count < 0:
+            raise XLFilterError("count may not be negative")
+        cells_list = [self._cells(keysel) for keysel in keysels]
+        try:
+            self._lock.acquire()
+            for cells in cells_list:
+                self._do_add(cells, count)
+        finally:
+            self._lock.release()
+        return len(cells_list)
+
+    def estimate(self, keysel):
+        """
+        Return the estimated number of occurrences of a key, which is
+        never less than the true number.
+        """
+        cells = self._cells(keysel)
+        try:
+            self._lock.acquire()
+            return min(self._counters[cell] for cell in cells)
+        finally:
+            self._lock.release()
+
+    def estimate_many(self, keysels):
+        """ Return the estimates for a batch of keys, in input order. """
+        cells_list = [self._cells(keysel) for keysel in keysels]
+        try:
+            self._lock.acquire()
+            counters = self._counters
+            return [min(counters[cell] for cell in cells)
+                    for cells in cells_list]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Zero all counters. """
+        try:
+            self._lock.acquire()
+            self._counters[:] = array(self._counters.typecode, [0]) * \
+                len(self._counters)
+            self._total = 0
+        finally:
+            self._lock.release()
+
+    def merge(self, other):
+        """
+        Add the counts in another sketch of the same geometry to this one.
+        The result estimates counts over the union of the two streams.
+        """
+        if not isinstance(other, CountMinSHA):
+            raise XLFilterError("not a CountMinSHA: %s" % type(other).__name__)
+        if (self._mm, self._kk, self._key_bytes, self._counter_bits) != \
+                (other.m, other.k, other.key_bytes, other.counter_bits):
+            raise XLFilterError("sketch geometries differ")
+        try:
+            other._lock.acquire()
+            theirs = array(other._counters.typecode, other._counters)
+            their_total = other._total
+        finally:
+            other._lock.release()
+        try:
+            self._lock.acquire()
+            counters, max_count = self._counters, self._max_count
+            for ndx, value in enumerate(theirs):
+                if value:
+                    value += counters[ndx]
+                    counters[ndx] = value if value < max_count else max_count
+            self._total += their_total
+        finally:
+            self._lock.release()
+
+    # SERIALIZATION -------------------------------------------------
+
+    def to_bytes(self):
+        """
+        Serialize the sketch: the common filter header, then a byte
+        giving the counter width, a byte which is 1 for conservative
+        update, and the counters as little-endian unsigned ints, row by
+        row.  The header's key count is the total of all counts added.
+        """
+        try:
+            self._lock.acquire()
+            counters = array(self._counters.typecode, self._counters)
+            total = self._total
+        finally:
+            self._lock.release()
+        if sys.byteorder == 'big':
+            counters.byteswap()
+        return pack_filter_header(KIND_COUNT_MIN, self._mm, self._kk,
+                                  self._key_bytes, total) + \
+            bytes([self._counter_bits, int(self._conservative)]) + \
+            counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Create a sketch from the serialization made by to_bytes(). """
+        m, k, key_bytes, total, body = unpack_filter_header(
+            data, KIND_COUNT_MIN)
+        if len(body) < 2:
+            raise XLFilterError("serialized sketch is too short")
+        sketch = cls(m, k, key_bytes, counter_bits=body[0],
+                     conservative=body[1])
+        if sketch.k != k:
+            raise XLFilterError("serialized k %d is impossible for m %d" % (
+                k, m))
+        counters = array(sketch._counters.typecode)
+        if len(body) - 2 != len(sketch._counters) * counters.itemsize:
+            raise XLFilterError("serialized sketch has wrong length")
+        counters.frombytes(body[2:])
+        if sys.byteorder == 'big':
+            counters.byteswap()
+        sketch._counters[:] = counters
+        sketch._total = total
+        return sketch
@@ -0,0 +1,283 @@
+# xlcrypto_py/src/xlcrypto/filters/gcs.py
+
+""" Golomb-coded sets: compact, static sets of SHA digests. """
+
+from bisect import bisect_right
+from struct import Struct
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (KIND_GCS, split_keys,
+                              pack_filter_header, unpack_filter_header)
+
+__all__ = ['GolombCodedSetSHA', ]
+
+MIN_KEY_BYTES = 8       # fingerprints are taken from the first 8 bytes
+MAX_P = 32
+
+# following the header: number of distinct fingerprints, bits in stream
+GCS_BODY = Struct('<QQ')
+
+
+class GolombCodedSetSHA(object):
+    """
+    A read-only set of SHA digests, Golomb-Rice coded.
+
+    Each of the N keys is reduced to a fingerprint in the range
+    0..N * 2**p - 1; the fingerprints are sorted and the differences
+    between successive fingerprints are written with a Golomb-Rice code
+    of parameter p: the quotient in unary, then the remainder in p bits.
+    This takes about p + 1.5 bits per key, where a BloomSHA with the
+    same false positive rate, 2**-p, needs about 1.44 * p.
+
+    A lookup must decode the stream up to the fingerprint sought.  If
+    index_interval is not zero, the fingerprint and bit offset of every
+    index_interval-th entry are kept in memory, so that lookups decode at
+    most that many entries.  The index is not serialized; it is rebuilt
+    when the set is loaded.  Batch lookups sort their fingerprints and
+    decode each block of the stream at most once.
+
+    Instances are immutable and so thread-safe.
+    """
+
+    def __init__(self, packed=b'', key_bytes=20, p=20, index_interval=64):
+        """
+        Build a set from a buffer of keys.
+
+        @param packed          bytes-like, keys packed end to end
+        @param key_bytes       length in bytes of each key, at least 8
+        @param p               Golomb-Rice parameter; the false positive
+                               rate is 2**-p
+        @param index_interval  entries between index points; 0 for none
+        """
+        key_bytes = int(key_bytes)
+        if key_bytes < MIN_KEY_BYTES:
+            raise XLFilterError("keys must be at least %d bytes long" %
+                                MIN_KEY_BYTES)
+        p = int(p)
+        if p < 1 or p > MAX_P:
+            raise XLFilterError("p = %d but must be in 1..%d" % (p, MAX_P))
+        index_interval = int(index_interval)
+        if index_interval < 0:
+            raise XLFilterError("index interval may not be negative")
+
+        keys = split_keys(packed, key_bytes)
+        self._key_bytes = key_bytes
+        self._pp = p
+        self._key_count = len(keys)
+        self._range = len(keys) << p
+        fingerprints = sorted(set(self._fingerprint(key) for key in keys))
+
+        # codes are written most significant bit first; acc holds the
+        # nbits bits not yet flushed to the stream
+        stream = bytearray()
+        rmask = (1 << p) - 1
+        acc, nbits, bit_count, prev = 0, 0, 0, 0
+        for fpr in fingerprints:
+            delta = fpr - prev
+            prev = fpr
+            quot = delta >> p
+            # quot 1s, a 0, then the low order p bits of delta
+            acc = (((acc << quot) | ((1 << quot) - 1)) << (p + 1)) | \
+                (delta & rmask)
+            nbits += quot + 1 + p
+            bit_count += quot + 1 + p
+            if nbits >= 64:
+                spare = nbits & 7
+                stream += (acc >> spare).to_bytes(nbits >> 3, 'big')
+                acc &= (1 << spare) - 1
+                nbits = spare
+        if nbits:
+            # pad on the right to a whole number of bytes
+            pad = -nbits % 8
+            stream += (acc << pad).to_bytes((nbits + pad) >> 3, 'big')
+        self._bit_count = bit_count
+        self._stream = bytes(stream)
+        self._entries = len(fingerprints)
+        self._build_index(index_interval)
+
+    @property
+    def p(self):
+        """ Return the Golomb-Rice parameter. """
+        return self._pp
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    def __len__(self):
+        """ Number of keys from which the set was built. """
+        return self._key_count
+
+    def false_positives(self):
+        """ Return the approximate false positive rate. """
+        return 2.0 ** -self._pp
+
+    @property
+    def size(self):
+        """ Length of the coded stream in bytes. """
+        return len(self._stream)
+
+    def _fingerprint(self, key):
+        """ Map a key onto 0..N * 2**p - 1. """
+        if len(key) != self._key_bytes:
+            raise XLFilterError(
+                "key of length %d but set expects length of %d bytes" % (
+                    len(key), self._key_bytes))
+        return (int.from_bytes(key[:8], 'little') * self._range) >> 64
+
+    def _decode(self, start=0, end=None, value=0):
+        """
+        Generate (fingerprint, bit offset of following entry) for each
+        entry in the stream from bit offset start to bit offset end or
+        the end of the stream, adding deltas to value.
+        """
+        if end is None:
+            end = self._bit_count
+        p, stream = self._pp, self._stream
+        # acc holds the next nbits unread bits, most significant first;
+        # it is refilled 32 bytes at a time from stream[byte:]
+        byte = start >> 3
+        nbits = 8 - (start & 7)
+        acc = stream[byte] & ((1 << nbits) - 1) if start < end else 0
+        byte += 1
+        pos = start
+        while pos < end:
+            # count the 1s of the quotient, up to the terminating 0
+            quot = 0
+            while True:
+                mask = (1 << nbits) - 1
+                ones = nbits - (acc ^ mask).bit_length()
+                if ones < nbits:
+                    quot += ones
+                    nbits -= ones + 1
+                    acc &= mask >> (ones + 1)
+                    break
+                quot += nbits
+                chunk = stream[byte:byte + 32]
+                byte += 32
+                acc, nbits = int.from_bytes(chunk, 'big'), len(chunk) << 3
+            while nbits < p:
+                chunk = stream[byte:byte + 32]
+                byte += 32
+                acc = (acc << (len(chunk) << 3)) | \
+                    int.from_bytes(chunk, 'big')
+                nbits += len(chunk) << 3
+            nbits -= p
+            value += (quot << p) | (acc >> nbits)
+            acc &= (1 << nbits) - 1
+            pos += quot + 1 + p
+            yield value, pos
+
+    def _build_index(self, index_interval):
+        """ Record fingerprint and offset every index_interval entries. """
+        self._index_interval = index_interval
+        self._index_values = []         # fingerprint before the point
+        self._index_offsets = []        # bit offset of the point
+        if index_interval:
+            value, offset = 0, 0
+            for ndx, (fpr, pos) in enumerate(self._decode()):
+                if ndx % index_interval == 0:
+                    self._index_values.append(value)
+                    self._index_offsets.append(offset)
+                value, offset = fpr, pos
+
+    def _seek(self, fpr):
+        """
+        Return (value, start, end): decoding the bits from offset start
+        to offset end, adding deltas to value, will find fpr if it is in
+        the set.
+        """
+        values, offsets = self._index_values, self._index_offsets
+        if not values:
+            return 0, 0, self._bit_count
+        # each index point records the fingerprint of the entry before
+        # it; find the last point whose entry is below fpr
+        ndx = bisect_right(values, fpr) - 1
+        if ndx > 0 and values[ndx] == fpr:
+            ndx -= 1
+        end = offsets[ndx + 1] if ndx + 1 < len(offsets) else self._bit_count
+        return values[ndx], offsets[ndx], end
+
+    def is_member(self, key):
+        """
+        Whether a key may be in the set.
+
+        @param key  a key of key_bytes bytes
+        @return     False if the key is certainly not in the set
+        """
+        if not self._entries:
+            return False
+        fpr = self._fingerprint(key)
+        value, start, end = self._seek(fpr)
+        for got, _ in self._decode(start, end, value):
+            if got >= fpr:
+                return got == fpr
+        return False
+
+    def is_member_many(self, keys):
+        """
+        Test a batch of keys for membership.  The keys are sorted by
+        fingerprint, so each block of the stream which might hold any of
+        them is decoded just once.
+
+        @param keys  iterable of keys, or keys packed end to end
+        @return      list of booleans, in input order
+        """
+        if isinstance(keys, (bytes, bytearray, memoryview)):
+            keys = split_keys(keys, self._key_bytes)
+        wanted = sorted((self._fingerprint(key), ndx)
+                        for ndx, key in enumerate(keys))
+        results = [False] * len(wanted)
+        if not wanted or not self._entries:
+            return results
+
+        # decode only those blocks holding wanted fingerprints
+        want_ndx, want_count = 0, len(wanted)
+        while want_ndx < want_count:
+            value, start, end = self._seek(wanted[want_ndx][0])
+            for got, _ in self._decode(start, end, value):
+                while wanted[want_ndx][0] <= got:
+                    results[wanted[want_ndx][1]] = wanted[want_ndx][0] == got
+                    want_ndx += 1
+                    if want_ndx == want_count:
+                        return results
+            if end == self._bit_count:
+                break                   # the rest are beyond the last entry
+        return results
+
+    # SERIALIZATION -------------------------------------------------
+
+    def to_bytes(self):
+        """
+        Serialize the set: the common filter header, with m holding p
+        and k 1, then the number of distinct fingerprints and the
+        length of the stream in bits, then the stream itself.
+        """
+        return pack_filter_header(KIND_GCS, self._pp, 1, self._key_bytes,
+                                  self._key_count) + \
+            GCS_BODY.pack(self._entries, self._bit_count) + self._stream
+
+    @classmethod
+    def from_bytes(cls, data, index_interval=64):
+        """
+        Load a set from the serialization made by to_bytes(), building
+        an index if index_interval is not zero.
+        """
+        p, _, key_bytes, key_count, body = unpack_filter_header(
+            data, KIND_GCS)
+        if len(body) < GCS_BODY.size:
+            raise XLFilterError("serialized set is too short")
+        entries, bit_count = GCS_BODY.unpack_from(body)
+        stream = bytes(body[GCS_BODY.size:])
+        if len(stream) != (bit_count + 7) // 8:
+            raise XLFilterError("serialized set has wrong length")
+
+        gcs = cls(b'', key_bytes, p, 0)
+        gcs._key_count = key_count
+        gcs._range = key_count << p
+        gcs._entries = entries
+        gcs._bit_count = bit_count
+        gcs._stream = stream
+        gcs._build_index(index_interval)
+        return gcs
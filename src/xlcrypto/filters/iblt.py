@@ -0,0 +1,314 @@
+# xlcrypto_py/src/xlcrypto/filters/iblt.py
+
+"""
+Invertible Bloom Lookup Table (IBLT) for reconciling sets of SHA
+digests held by two peers.
+"""
+
+import hashlib
+import sys
+from array import array
+from threading import Lock
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (MIN_M, MIN_K, KIND_IBLT, KeySelector,
+                              pack_filter_header, unpack_filter_header)
+
+if sys.version_info < (3, 6):
+    from pyblake2 import blake2b
+else:
+    blake2b = hashlib.blake2b
+
+__all__ = ['IBLTSHA', ]
+
+CHECK_BYTES = 8     # length of the per-key check hash
+
+
+def _check_hash(key):
+    """ Hash used to recognize cells holding exactly one key. """
+    return int.from_bytes(blake2b(key, digest_size=CHECK_BYTES).digest(),
+                          'little')
+
+
+class IBLTSHA(object):
+    """
+    An Invertible Bloom Lookup Table whose keys are SHA digests.
+
+    The table is k subtables of 2**m cells.  As in BloomSHA, a key is
+    located with a KeySelector: the j-th selected filter bit is the
+    key's cell in subtable j, so each key occupies k distinct cells.
+    Each cell holds a count, the XOR of the keys in it, and the XOR of
+    a check hash of those keys.
+
+    To reconcile, each peer builds a table of the same geometry over its
+    own keys and sends it to the other; one subtracts the other's table
+    from its own, and decode() recovers the keys held by only one peer.
+    Decoding succeeds with high probability if there are about twice as
+    many cells as differing keys, whatever the size of the sets, so the
+    table need only be sized for the difference; see m_for_difference().
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, m=10, k=3, key_bytes=20):
+        """
+        @param m         log2 of the number of cells in each subtable
+        @param k         number of subtables, so cells per key
+        @param key_bytes length in bytes of acceptable keys
+        """
+        m = int(m)
+        if m < MIN_M:
+            raise XLFilterError("m = %d but must be > %d" % (m, MIN_M))
+        key_bytes = int(key_bytes)
+        if key_bytes <= 0:
+            raise XLFilterError("must specify a positive key length")
+        k = int(k)
+        if k < MIN_K:
+            raise XLFilterError("k = %d but must be >= %d" % (k, MIN_K))
+        if k * m > key_bytes * 8:
+            k = (key_bytes * 8) // m    # rounds down to number that will fit
+
+        self._mm = m
+        self._kk = k
+        self._key_bytes = key_bytes
+        cells = k << m
+        self._counts = array('l', [0]) * cells
+        self._key_sums = [0] * cells
+        self._hash_sums = array('Q', [0]) * cells
+        self._key_count = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def m_for_difference(count, k=3):
+        """
+        Return the smallest m for which a table with k subtables should
+        decode a difference of count keys.
+        """
+        # about 1.5 cells per key suffices for large differences, but
+        # small ones need proportionally more to decode reliably
+        cells = max(1, (2 * int(count) + 24 + k - 1) // k)
+        # KeySelector needs at least one bit beyond the 3 selecting a bit
+        return max(MIN_M + 1, (cells - 1).bit_length())
+
+    @property
+    def m(self):
+        """ Return m, log2 of the number of cells in each subtable. """
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return k, the number of cells occupied by each key. """
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    @property
+    def count(self):
+        """
+        Number of keys inserted less the number removed; after
+        subtract(), may be negative.
+        """
+        return self._key_count
+
+    def _cells(self, keysel):
+        """ Offsets of the key's cell in each subtable. """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        if keysel.m != self._mm or keysel.k != self._kk:
+            raise XLFilterError(
+                "KeySelector is for m=%d, k=%d but table has m=%d, k=%d" %
+                (keysel.m, keysel.k, self._mm, self._kk))
+        bits = keysel.filter_bits
+        m = self._mm
+        return [(j << m) | bits[j] for j in range(self._kk)]
+
+    def _do_update(self, keysel, delta):
+        """ Add (delta 1) or remove (delta -1) a key, unsynchronized. """
+        key = keysel.key
+        key_val = int.from_bytes(key, 'little')
+        check = _check_hash(key)
+        for cell in self._cells(keysel):
+            self._counts[cell] += delta
+            self._key_sums[cell] ^= key_val
+            self._hash_sums[cell] ^= check
+        self._key_count += delta
+
+    def insert(self, keysel):
+        """ Add a key to the table. """
+        try:
+            self._lock.acquire()
+            self._do_update(keysel, 1)
+        finally:
+            self._lock.release()
+
+    def remove(self, keysel):
+        """
+        Remove a key from the table.  The key need not have been
+        inserted; a key removed but never inserted is decoded as one
+        held only by the other peer.
+        """
+        try:
+            self._lock.acquire()
+            self._do_update(keysel, -1)
+        finally:
+            self._lock.release()
+
+    def insert_many(self, keysels):
+        """ Add a batch of keys, taking the lock only once. """
+        keysels = list(keysels)
+        try:
+            self._lock.acquire()
+            for keysel in keysels:
+                self._do_update(keysel, 1)
+        finally:
+            self._lock.release()
+        return len(keysels)
+
+    def remove_many(self, keysels):
+        """ Remove a batch of keys, taking the lock only once. """
+        keysels = list(keysels)
+        try:
+            self._lock.acquire()
+            for keysel in keysels:
+                self._do_update(keysel, -1)
+        finally:
+            self._lock.release()
+        return len(keysels)
+
+    def _same_geometry(self, other):
+        if not isinstance(other, IBLTSHA):
+            raise XLFilterError("not an IBLTSHA: %s" % type(other).__name__)
+        if (self._mm, self._kk, self._key_bytes) != \
+                (other.m, other.k, other.key_bytes):
+            raise XLFilterError("table geometries differ")
+
+    def _copy_state(self):
+        """ Return a copy of the cells and key count. """
+        try:
+            self._lock.acquire()
+            return (array('l', self._counts), list(self._key_sums),
+                    array('Q', self._hash_sums), self._key_count)
+        finally:
+            self._lock.release()
+
+    def subtract(self, other):
+        """
+        Return a new table representing this table's keys less other's.
+        Keys held by both peers cancel; decode() the result to find the
+        keys held by only one.
+        """
+        self._same_geometry(other)
+        counts, key_sums, hash_sums, key_count = self._copy_state()
+        o_counts, o_key_sums, o_hash_sums, o_key_count = other._copy_state()
+        diff = IBLTSHA(self._mm, self._kk, self._key_bytes)
+        for cell in range(len(counts)):
+            diff._counts[cell] = counts[cell] - o_counts[cell]
+            diff._key_sums[cell] = key_sums[cell] ^ o_key_sums[cell]
+            diff._hash_sums[cell] = hash_sums[cell] ^ o_hash_sums[cell]
+        diff._key_count = key_count - o_key_count
+        return diff
+
+    def __sub__(self, other):
+        return self.subtract(other)
+
+    def decode(self):
+        """
+        Recover the keys in the table by peeling: repeatedly find a cell
+        holding exactly one key, report the key, and remove it from all
+        of its cells.  The table itself is not changed.
+
+        @return (present, absent), lists of keys with net counts of +1
+                and -1; after subtract(), keys held only by this peer
+                and keys held only by the other
+        @raise XLFilterError if the table cannot be fully decoded,
+                usually because it is too small for the difference
+        """
+        counts, key_sums, hash_sums, _ = self._copy_state()
+        key_bytes, m, k = self._key_bytes, self._mm, self._kk
+        present, absent = [], []
+
+        # a pure cell holds one key, inserted or removed
+        def is_pure(cell):
+            return counts[cell] in (1, -1) and hash_sums[cell] == \
+                _check_hash(key_sums[cell].to_bytes(key_bytes, 'little'))
+
+        pending = [cell for cell in range(len(counts)) if is_pure(cell)]
+        while pending:
+            cell = pending.pop()
+            if not is_pure(cell):
+                continue
+            sign = counts[cell]
+            key = key_sums[cell].to_bytes(key_bytes, 'little')
+            (present if sign == 1 else absent).append(key)
+
+            key_val = key_sums[cell]
+            check = hash_sums[cell]
+            bits = KeySelector(key, self).filter_bits
+            for j in range(k):
+                other = (j << m) | bits[j]
+                counts[other] -= sign
+                key_sums[other] ^= key_val
+                hash_sums[other] ^= check
+                if is_pure(other):
+                    pending.append(other)
+
+        for cell in range(len(counts)):
+            if counts[cell] or key_sums[cell] or hash_sums[cell]:
+                raise XLFilterError(
+                    "could not decode table; %d keys recovered" % (
+                        len(present) + len(absent)))
+        return present, absent
+
+    # SERIALIZATION -------------------------------------------------
+
+    def to_bytes(self):
+        """
+        Serialize the table: the common filter header, then for all
+        cells the counts as little-endian 32-bit signed ints, then the
+        key sums, each key_bytes long, then the 8-byte check hash sums.
+        """
+        counts, key_sums, hash_sums, key_count = self._copy_state()
+        counts = array('i', counts)
+        if sys.byteorder == 'big':
+            counts.byteswap()
+            hash_sums.byteswap()
+        key_bytes = self._key_bytes
+        return b''.join([
+            pack_filter_header(KIND_IBLT, self._mm, self._kk, key_bytes,
+                               key_count & 0xffffffffffffffff),
+            counts.tobytes(),
+            b''.join(val.to_bytes(key_bytes, 'little') for val in key_sums),
+            hash_sums.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Create a table from the serialization made by to_bytes(). """
+        m, k, key_bytes, key_count, body = unpack_filter_header(
+            data, KIND_IBLT)
+        table = cls(m, k, key_bytes)
+        if table.k != k:
+            raise XLFilterError("serialized k %d is impossible for m %d" % (
+                k, m))
+        cells = k << m
+        if len(body) != cells * (4 + key_bytes + CHECK_BYTES):
+            raise XLFilterError("serialized table has wrong length")
+        counts = array('i')
+        counts.frombytes(body[:4 * cells])
+        sums = body[4 * cells:(4 + key_bytes) * cells]
+        hash_sums = array('Q')
+        hash_sums.frombytes(body[(4 + key_bytes) * cells:])
+        if sys.byteorder == 'big':
+            counts.byteswap()
+            hash_sums.byteswap()
+        table._counts = array('l', counts)
+        table._key_sums = [
+            int.from_bytes(sums[ndx:ndx + key_bytes], 'little')
+            for ndx in range(0, len(sums), key_bytes)]
+        table._hash_sums = hash_sums
+        if key_count >= 1 << 63:
+            key_count -= 1 << 64
+        table._key_count = key_count
+        return table
@@ -0,0 +1,143 @@
+# xlcrypto_py/src/xlcrypto/filters/keyed.py
+
+""" Front end letting SHA-digest filters hold keys of any length. """
+
+import hashlib
+import sys
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import KeySelector
+
+if sys.version_info < (3, 6):
+    from pyblake2 import blake2b
+else:
+    blake2b = hashlib.blake2b
+
+__all__ = ['HashedKeyFilter', 'MAX_DIGEST_BYTES']
+
+# the longest digest blake2b can produce
+MAX_DIGEST_BYTES = 64
+
+
+class HashedKeyFilter(object):
+    """
+    Wraps a filter whose keys are fixed-length digests so that it will
+    accept keys of any length: URLs, object names, and so on.
+
+    Each key is first digested with blake2b, with the digest size set to
+    the filter's key_bytes; without a secret and for 32-byte keys this
+    is the XLBLAKE2B_256 digest.  The standard library has no faster
+    non-cryptographic hash, and blake2b costs less per key than the
+    KeySelector built from it.  Given a secret, the digest is keyed, so
+    that nobody without it can choose keys which collide in the filter.
+
+    The hash state is set up once and copied for each key, which saves
+    most of the per-key cost of the parameter block, particularly when
+    the digest is keyed.
+
+    str keys are encoded as UTF-8.  Thread-safety is that of the filter
+    wrapped.
+    """
+
+    def __init__(self, fltr, secret=b''):
+        """
+        @param fltr    filter with m, k, key_bytes and insert/is_member
+        @param secret  optional blake2b key of up to 64 bytes
+        """
+        if fltr is None:
+            raise XLFilterError("filter may not be None")
+        key_bytes = fltr.key_bytes
+        if key_bytes > MAX_DIGEST_BYTES:
+            raise XLFilterError(
+                "filter key_bytes %d exceeds the %d-byte blake2b limit" % (
+                    key_bytes, MAX_DIGEST_BYTES))
+        secret = bytes(secret)
+        if len(secret) > MAX_DIGEST_BYTES:
+            raise XLFilterError("secret may not exceed %d bytes" %
+                                MAX_DIGEST_BYTES)
+        self._fltr = fltr
+        self._key_bytes = key_bytes
+        self._template = blake2b(digest_size=key_bytes, key=secret)
+
+    @property
+    def filter(self):
+        """ Return the filter wrapped. """
+        return self._fltr
+
+    def __len__(self):
+        return len(self._fltr)
+
+    # DIGESTS #######################################################
+
+    def digest(self, key):
+        """ Return the filter key for a key of any length. """
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        hasher = self._template.copy()
+        hasher.update(key)
+        return hasher.digest()
+
+    def digest_many(self, keys):
+        """ Return the filter keys for a list of keys of any length. """
+        copy = self._template.copy
+        digests = []
+        append = digests.append
+        for key in keys:
+            if isinstance(key, str):
+                key = key.encode('utf-8')
+            hasher = copy()
+            hasher.update(key)
+            append(hasher.digest())
+        return digests
+
+    def selector(self, key):
+        """ Return the KeySelector for a key of any length. """
+        return KeySelector(self.digest(key), self._fltr)
+
+    def selectors(self, keys):
+        """ Return KeySelectors for a list of keys of any length. """
+        fltr = self._fltr
+        return [KeySelector(digest, fltr) for digest in self.digest_many(keys)]
+
+    # FILTER OPERATIONS #############################################
+
+    def insert(self, key):
+        """ Add a key of any length to the filter. """
+        self._fltr.insert(self.selector(key))
+
+    def insert_many(self, keys):
+        """
+        Add a batch of keys of any length to the filter.
+
+        @return the number of keys inserted
+        """
+        return self._fltr.insert_many(self.selectors(keys))
+
+    def is_member(self, key):
+        """ Whether a key of any length may be in the filter. """
+        return self._fltr.is_member(self.selector(key))
+
+    def is_member_many(self, keys):
+        """
+        Test a batch of keys of any length for membership.
+
+        @return list of booleans, True where the key may be present
+        """
+        return self._fltr.is_member_many(self.selectors(keys))
+
+    def remove(self, key):
+        """ Remove a key from the filter, which must be a CountingBloom. """
+        if not hasattr(self._fltr, 'remove'):
+            raise XLFilterError("filter does not support removal")
+        self._fltr.remove(self.selector(key))
+
+    def remove_many(self, keys):
+        """
+        Remove a batch of keys from the filter, which must be a
+        CountingBloom.
+
+        @return the number of keys removed
+        """
+        if not hasattr(self._fltr, 'remove_many'):
+            raise XLFilterError("filter does not support removal")
+        return self._fltr.remove_many(self.selectors(keys))
@@ -0,0 +1,282 @@
+# xlcrypto_py/src/xlcrypto/filters/parallel.py
+
+"""
+A Bloom filter split into shards by digest, and a multi-process build
+of one from a large list of packed digests.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector
+
+__all__ = ['ShardedBloomSHA', 'build_parallel', 'MAX_SHARD_BITS']
+
+# shards are chosen by the top bits of the last byte of the digest
+MAX_SHARD_BITS = 8
+
+# bytes of packed digests read at a time
+CHUNK_BYTES = 1 << 24
+
+
+class ShardedBloomSHA(object):
+    """
+    A Bloom filter made of 2**shard_bits BloomSHAs, each of 2**m bits.
+    A key goes into the shard given by the top shard_bits bits of its
+    last byte.  KeySelectors slice digests from the first byte up, so
+    provided that k * m + shard_bits does not exceed the key length in
+    bits, the shard does not depend on any bits used within it, and the
+    false positive rate is that of a single 2**(m + shard_bits)-bit
+    filter.  k is reduced if necessary to make this so.
+
+    As m, k, and key_bytes are those of the shards, KeySelectors are
+    built as for a BloomSHA:
+        fltr.insert(KeySelector(key, fltr))
+
+    Because shards share nothing, they can be built independently, in
+    separate processes: see build_parallel().
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, m=20, k=8, key_bytes=20, shard_bits=4, word=False):
+        """
+        @param m          log2 of the number of bits in each shard
+        @param k          number of hash functions
+        @param key_bytes  length in bytes of acceptable keys
+        @param shard_bits log2 of the number of shards
+        @param word       use WordBloomSHA rather than BloomSHA for shards
+        """
+        shard_bits = int(shard_bits)
+        if shard_bits < 0 or shard_bits > MAX_SHARD_BITS:
+            raise XLFilterError("shard_bits = %d but must be 0 to %d" % (
+                shard_bits, MAX_SHARD_BITS))
+        cls = WordBloomSHA if word else BloomSHA
+        proto = cls(m, k, key_bytes)        # validates the parameters
+        k = proto.k
+        if k * proto.m + shard_bits > proto.key_bytes * 8:
+            k = (proto.key_bytes * 8 - shard_bits) // proto.m
+        self._mm, self._kk, self._key_bytes = proto.m, k, proto.key_bytes
+        self._shard_bits = shard_bits
+        self._shift = 8 - shard_bits
+        self._shards = [cls(self._mm, k, self._key_bytes)
+                        for _ in range(1 << shard_bits)]
+
+    @property
+    def m(self):
+        """ Return log2 of the number of bits in each shard. """
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return the number of hash functions. """
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Return the length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    @property
+    def shard_bits(self):
+        """ Return log2 of the number of shards. """
+        return self._shard_bits
+
+    @property
+    def shards(self):
+        """ Return a copy of the list of shards. """
+        return list(self._shards)
+
+    @property
+    def capacity(self):
+        """ Return the total number of bits in all shards. """
+        return len(self._shards) << self._mm
+
+    def __len__(self):
+        """ Return the number of keys inserted into all shards. """
+        return sum(len(shard) for shard in self._shards)
+
+    def false_positives(self, n=0):
+        """
+        @param n number of set members
+        @return approximate False positive rate
+        """
+        if n == 0:
+            n = len(self)
+        return self._shards[0].false_positives(n / len(self._shards))
+
+    def popcount(self):
+        """ Return the number of bits set in all shards. """
+        return sum(shard.popcount() for shard in self._shards)
+
+    def clear(self):
+        """ Clear every shard. """
+        for shard in self._shards:
+            shard.clear()
+
+    def shard_of(self, key):
+        """ Return the index of the shard holding a key. """
+        return key[-1] >> self._shift if self._shard_bits else 0
+
+    def _group(self, keysels):
+        """ Group KeySelectors by shard: {ndx: [(position, keysel), ...]} """
+        groups = {}
+        for pos, keysel in enumerate(keysels):
+            if keysel is None:
+                raise XLFilterError("KeySelector may not be None")
+            groups.setdefault(self.shard_of(keysel.key), []).append(
+                (pos, keysel))
+        return groups
+
+    def insert(self, keysel):
+        """ Add a key to the set. """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        self._shards[self.shard_of(keysel.key)].insert(keysel)
+
+    def insert_many(self, keysels, sort=False):
+        """
+        Add a batch of keys, one call per shard.
+
+        @return the number of keys inserted
+        """
+        keysels = list(keysels)
+        for ndx, group in self._group(keysels).items():
+            self._shards[ndx].insert_many([ksel for _, ksel in group], sort)
+        return len(keysels)
+
+    def is_member(self, keysel):
+        """ Whether a key may be in the set. """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        return self._shards[self.shard_of(keysel.key)].is_member(keysel)
+
+    def is_member_many(self, keysels, sort=False):
+        """
+        Test a batch of keys for membership, one call per shard.
+
+        @return list of booleans, True where the key may be present
+        """
+        keysels = list(keysels)
+        results = [False] * len(keysels)
+        for ndx, group in self._group(keysels).items():
+            found = self._shards[ndx].is_member_many(
+                [ksel for _, ksel in group], sort)
+            for (pos, _), present in zip(group, found):
+                results[pos] = present
+        return results
+
+    def partition(self, packed):
+        """
+        Split packed digests by shard.  build_parallel() does not need
+        this: each of its workers picks out its own shard's digests.
+
+        @param packed  bytes-like, a whole number of keys long
+        @return        list of bytearrays, one per shard
+        """
+        key_bytes = self._key_bytes
+        if len(packed) % key_bytes:
+            raise XLFilterError(
+                "packed keys: length %d is not a multiple of %d" % (
+                    len(packed), key_bytes))
+        buckets = [bytearray() for _ in self._shards]
+        if not self._shard_bits:
+            buckets[0] += packed
+            return buckets
+        shift = self._shift
+        for end in range(key_bytes, len(packed) + 1, key_bytes):
+            buckets[packed[end - 1] >> shift] += packed[end - key_bytes:end]
+        return buckets
+
+# ===================================================================
+
+
+def _shard_keys(chunk, key_bytes, shard, shard_bits):
+    """
+    Return the digests in a chunk of packed digests which belong to a
+    shard.  Only those digests are visited at Python level.
+    """
+    starts = range(0, len(chunk), key_bytes)
+    if shard_bits:
+        shift = 8 - shard_bits
+        wanted = bytes(1 if val >> shift == shard else 0
+                       for val in range(256))
+        starts = compress(starts, chunk[key_bytes - 1::key_bytes].translate(
+            wanted))
+    return [chunk[start:start + key_bytes] for start in starts]
+
+
+def _build_shard(path, shard, shard_bits, m, k, key_bytes, word):
+    """
+    Build one shard in a worker process, reading all of the packed
+    digests in a file and keeping those which belong to the shard.
+    Returns the shard serialized.
+    """
+    fltr = (WordBloomSHA if word else BloomSHA)(m, k, key_bytes)
+    chunk_bytes = max(1, CHUNK_BYTES // key_bytes) * key_bytes
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_bytes)
+            if not chunk:
+                break
+            fltr.insert_many(
+                [KeySelector(key, fltr)
+                 for key in _shard_keys(chunk, key_bytes, shard, shard_bits)])
+    return fltr.to_bytes()
+
+
+def build_parallel(source, m=20, k=8, key_bytes=20, shard_bits=4,
+                   word=False, workers=None, tmpdir=None):
+    """
+    Build a ShardedBloomSHA from packed digests, one shard per task in
+    a pool of processes.
+
+    This process does no work per digest: it writes the input to a
+    temporary file in tmpdir, copying a binary file in chunks, and
+    each task reads the whole file and keeps only its own shard's
+    digests.  Memory use does not grow with the input, beyond that of
+    a bytes-like source itself.
+
+    @param source     bytes-like packed digests, or a binary file of them
+    @param m          log2 of the number of bits in each shard
+    @param k          number of hash functions
+    @param key_bytes  length in bytes of each digest
+    @param shard_bits log2 of the number of shards
+    @param word       use WordBloomSHA for shards
+    @param workers    number of processes; defaults to the CPU count
+    @param tmpdir     directory for the temporary file
+    @return           the ShardedBloomSHA built
+    """
+    result = ShardedBloomSHA(m, k, key_bytes, shard_bits, word)
+    cls = WordBloomSHA if word else BloomSHA
+    params = (result.m, result.k, result.key_bytes, word)
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as scratch:
+        path = os.path.join(scratch, 'digests')
+        with open(path, 'wb') as file:
+            if hasattr(source, 'read'):
+                total = 0
+                while True:
+                    chunk = source.read(CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    file.write(chunk)
+                    total += len(chunk)
+            else:
+                file.write(source)
+                total = len(source)
+        if total % result.key_bytes:
+            raise XLFilterError(
+                "%d bytes left over after the last digest" %
+                (total % result.key_bytes))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_build_shard, path, ndx,
+                                   result.shard_bits, *params)
+                       for ndx in range(len(result._shards))]
+            for ndx, future in enumerate(futures):
+                result._shards[ndx] = cls.from_bytes(future.result())
+    return result
@@ -0,0 +1,493 @@
+# xlcrypto_py/src/xlcrypto/filters/service.py
+
+"""
+An asyncio service sharing named filters with other processes on the
+same host over a Unix-domain socket, and a matching client.
+"""
+
+import asyncio
+import os
+import struct
+from collections import deque, namedtuple
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import CountingBloom, KeySelector
+
+__all__ = ['FilterServer', 'FilterClient', 'FilterInfo',
+           'REQUEST', 'RESPONSE', 'INFO',
+           'OP_INFO', 'OP_INSERT', 'OP_QUERY', 'OP_REMOVE',
+           'STATUS_OK', 'STATUS_ERROR']
+
+# A request is a header, the filter name in UTF-8, then count keys of
+# key_bytes each, packed end to end.  Header fields: request id, opcode,
+# length of name, key_bytes, count.
+REQUEST = struct.Struct('<IBBHI')
+
+# A response is a header then body_len bytes of body.  Header fields:
+# request id, status, body_len.  Responses on a connection are sent in
+# the order in which the requests were received.
+RESPONSE = struct.Struct('<IBI')
+
+# body of the response to OP_INFO: m, k, key_bytes, key_count, and 1
+# if the filter supports removal
+INFO = struct.Struct('<BBHQB')
+
+OP_INFO = 0
+OP_INSERT = 1       # response body: '<I' number of keys inserted
+OP_QUERY = 2        # response body: one byte per key, 1 if maybe present
+OP_REMOVE = 3       # response body: '<I' number of keys removed
+
+STATUS_OK = 0
+STATUS_ERROR = 1    # response body is a UTF-8 message
+
+COUNT = struct.Struct('<I')
+
+# default limit on keys in a single request
+MAX_BATCH = 1 << 16
+
+# longest key accepted in a request not matched against a filter's
+# key_bytes, as for an unknown filter
+MAX_KEY_BYTES = 64
+
+# bytes read at a time when discarding the keys of a refused request
+DISCARD_CHUNK = 1 << 16
+
+# the server pauses for the client once this much output is queued
+WRITE_HIGH_WATER = 1 << 20
+
+# asyncio.get_running_loop() is new in Python 3.7
+_running_loop = getattr(asyncio, 'get_running_loop',
+                        asyncio.get_event_loop)
+
+FilterInfo = namedtuple('FilterInfo', ['m', 'k', 'key_bytes', 'key_count',
+                                       'removable'])
+
+
+def _encode_name(name):
+    raw = name.encode('utf-8')
+    if not raw or len(raw) > 255:
+        raise XLFilterError(
+            "filter name must be 1 to 255 bytes long in UTF-8: %r" % name)
+    return raw
+
+
+class FilterServer(object):
+    """
+    Serve named BloomSHA and CountingBloom filters over a Unix-domain
+    socket.
+
+    Each request carries a batch of keys, so the cost of a round trip
+    and of the event loop is spread over the whole batch, which is
+    handed to the filter's bulk insert_many(), is_member_many(), or
+    remove_many() method.  Clients may pipeline: send many requests
+    before reading any responses.  Requests on one connection are
+    handled in order; requests on different connections may run at
+    the same time.
+
+    Batches are carried out in an executor, so that the event loop
+    goes on reading and writing other connections meanwhile.  Filters
+    are used through their own thread-safe methods, so they can also
+    be shared with threads in the serving process.
+    """
+
+    def __init__(self, path, filters=None, max_batch=MAX_BATCH,
+                 executor=None):
+        """
+        @param path       path of the Unix-domain socket
+        @param filters    optional dict mapping names to filters
+        @param max_batch  largest number of keys accepted in a request
+        @param executor   concurrent.futures executor to carry out
+                          batches; defaults to the event loop's
+        """
+        self._path = path
+        self._filters = {}
+        self._max_batch = int(max_batch)
+        self._executor = executor
+        self._server = None
+        for name, fltr in (filters or {}).items():
+            self.add_filter(name, fltr)
+
+    @property
+    def path(self):
+        """ Return the path of the Unix-domain socket. """
+        return self._path
+
+    @property
+    def names(self):
+        """ Return a sorted list of the names of the filters served. """
+        return sorted(self._filters)
+
+    def add_filter(self, name, fltr):
+        """ Serve a filter under the name given, replacing any other. """
+        _encode_name(name)
+        if fltr is None:
+            raise XLFilterError("filter may not be None")
+        self._filters[name] = fltr
+
+    def remove_filter(self, name):
+        """ Stop serving the named filter, returning it. """
+        try:
+            return self._filters.pop(name)
+        except KeyError:
+            raise XLFilterError("no filter named '%s'" % name)
+
+    async def start(self):
+        """ Start listening on the socket. """
+        if not hasattr(asyncio, 'start_unix_server'):
+            raise XLFilterError(
+                "Unix-domain sockets are not available on this platform")
+        if self._server is not None:
+            raise XLFilterError("server is already running")
+        self._server = await asyncio.start_unix_server(self._serve,
+                                                       path=self._path)
+
+    async def close(self):
+        """ Stop listening and remove the socket. """
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+    async def _serve(self, reader, writer):
+        """ Handle the requests arriving on one connection. """
+        try:
+            while True:
+                try:
+                    head = await reader.readexactly(REQUEST.size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                req_id, opcode, name_len, key_bytes, count = \
+                    REQUEST.unpack(head)
+                if count > self._max_batch:
+                    # the rest of the stream can't be trusted to resync
+                    writer.write(self._error(
+                        req_id, "batch of %d keys exceeds limit of %d" % (
+                            count, self._max_batch)))
+                    break
+                try:
+                    raw_name = await reader.readexactly(name_len)
+                    response, resync = await self._receive(
+                        reader, req_id, opcode, raw_name, key_bytes, count)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                writer.write(response)
+                if not resync:
+                    break
+                if writer.transport.get_write_buffer_size() > \
+                        WRITE_HIGH_WATER:
+                    await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            if hasattr(writer, 'wait_closed'):     # new in Python 3.7
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+    async def _receive(self, reader, req_id, opcode, raw_name, key_bytes,
+                       count):
+        """
+        Read the keys of a request and carry it out, returning the
+        response and whether the connection can go on.  Keys of the
+        wrong length for the filter named are read and discarded a
+        chunk at a time, and the response is an error.  Keys longer
+        than any the server accepts are not read at all: the response
+        is an error, after which the stream can't be resynchronized.
+        """
+        fltr = self._filters.get(raw_name.decode('utf-8', 'replace'))
+        max_key_bytes = MAX_KEY_BYTES
+        if fltr is not None:
+            max_key_bytes = max(max_key_bytes, fltr.key_bytes)
+        if count and key_bytes > max_key_bytes:
+            return self._error(req_id, "%d-byte keys exceed limit of %d" % (
+                key_bytes, max_key_bytes)), False
+        body_len = key_bytes * count
+        if fltr is not None and count and key_bytes != fltr.key_bytes:
+            while body_len:
+                chunk = min(body_len, DISCARD_CHUNK)
+                await reader.readexactly(chunk)
+                body_len -= chunk
+            return self._error(req_id, "filter '%s' takes %d-byte keys" % (
+                raw_name.decode('utf-8'), fltr.key_bytes)), True
+        packed = await reader.readexactly(body_len)
+        response = await _running_loop().run_in_executor(
+            self._executor, self._handle, req_id, opcode, raw_name,
+            key_bytes, count, packed)
+        return response, True
+
+    def _error(self, req_id, msg):
+        body = msg.encode('utf-8')
+        return RESPONSE.pack(req_id, STATUS_ERROR, len(body)) + body
+
+    def _handle(self, req_id, opcode, raw_name, key_bytes, count, packed):
+        """ Carry out a single request, returning the response. """
+        try:
+            name = raw_name.decode('utf-8')
+        except UnicodeDecodeError:
+            return self._error(req_id, "filter name is not UTF-8")
+        fltr = self._filters.get(name)
+        if fltr is None:
+            return self._error(req_id, "no filter named '%s'" % name)
+        removable = isinstance(fltr, CountingBloom)
+
+        if opcode == OP_INFO:
+            body = INFO.pack(fltr.m, fltr.k, fltr.key_bytes, len(fltr),
+                             int(removable))
+            return RESPONSE.pack(req_id, STATUS_OK, len(body)) + body
+        if opcode not in (OP_INSERT, OP_QUERY, OP_REMOVE):
+            return self._error(req_id, "unknown opcode %d" % opcode)
+        if opcode == OP_REMOVE and not removable:
+            return self._error(
+                req_id, "filter '%s' does not support removal" % name)
+        if key_bytes != fltr.key_bytes:
+            return self._error(req_id, "filter '%s' takes %d-byte keys" % (
+                name, fltr.key_bytes))
+
+        try:
+            keysels = [KeySelector(packed[ndx:ndx + key_bytes], fltr)
+                       for ndx in range(0, count * key_bytes, key_bytes)]
+            if opcode == OP_QUERY:
+                body = bytes(fltr.is_member_many(keysels))
+            elif opcode == OP_INSERT:
+                body = COUNT.pack(fltr.insert_many(keysels))
+            else:
+                body = COUNT.pack(fltr.remove_many(keysels))
+        except XLFilterError as exc:
+            return self._error(req_id, str(exc))
+        return RESPONSE.pack(req_id, STATUS_OK, len(body)) + body
+
+# ===================================================================
+
+
+class _Connection(object):
+    """
+    One pipelined connection to a FilterServer.  Requests are written
+    as soon as they are made; a reader task matches responses, which
+    arrive in order, to the futures waiting for them.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._waiting = deque()         # (request id, future), oldest first
+        self._next_id = 0
+        self._failure = None
+        self._task = asyncio.ensure_future(self._read_responses())
+
+    def request(self, opcode, raw_name, key_bytes, count, packed):
+        """ Send a request, returning a future for (status, body). """
+        if self._failure is not None:
+            raise self._failure
+        req_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        future = _running_loop().create_future()
+        self._waiting.append((req_id, future))
+        self._writer.write(REQUEST.pack(req_id, opcode, len(raw_name),
+                                        key_bytes, count) + raw_name + packed)
+        return future
+
+    @property
+    def failed(self):
+        """ Whether the connection has been lost or closed. """
+        return self._failure is not None
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                head = await self._reader.readexactly(RESPONSE.size)
+                req_id, status, body_len = RESPONSE.unpack(head)
+                body = await self._reader.readexactly(body_len)
+                if not self._waiting:
+                    raise XLFilterError("unexpected response %d" % req_id)
+                expected, future = self._waiting.popleft()
+                if req_id != expected:
+                    raise XLFilterError(
+                        "response %d out of order, expected %d" % (
+                            req_id, expected))
+                if not future.cancelled():
+                    future.set_result((status, body))
+        except asyncio.CancelledError:
+            self._failure = XLFilterError("connection closed")
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            self._failure = XLFilterError("connection lost: %s" % exc)
+        except XLFilterError as exc:
+            self._failure = exc
+        while self._waiting:
+            _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(self._failure)
+
+    async def close(self):
+        self._writer.close()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if hasattr(self._writer, 'wait_closed'):   # new in Python 3.7
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class FilterClient(object):
+    """
+    A client for FilterServer holding a pool of pipelined connections.
+
+    Keys are sent in batches of up to max_batch.  A large call is split
+    into batches which are spread across the pool and all sent before
+    any response is awaited, and concurrent calls from different tasks
+    share the pool in the same way.
+    """
+
+    def __init__(self, path, pool_size=4, max_batch=4096):
+        """
+        @param path       path of the server's Unix-domain socket
+        @param pool_size  number of connections to open
+        @param max_batch  largest number of keys sent in one request
+        """
+        pool_size = int(pool_size)
+        if pool_size < 1:
+            raise XLFilterError("pool_size must be positive")
+        max_batch = int(max_batch)
+        if max_batch < 1:
+            raise XLFilterError("max_batch must be positive")
+        self._path = path
+        self._pool_size = pool_size
+        self._max_batch = max_batch
+        self._pool = []
+        self._next = 0
+
+    async def connect(self):
+        """ Open the pool of connections. """
+        if not hasattr(asyncio, 'open_unix_connection'):
+            raise XLFilterError(
+                "Unix-domain sockets are not available on this platform")
+        while len(self._pool) < self._pool_size:
+            self._pool.append(await self._open())
+
+    async def close(self):
+        """ Close every connection in the pool. """
+        pool, self._pool = self._pool, []
+        for conn in pool:
+            await conn.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+    async def _open(self):
+        reader, writer = await asyncio.open_unix_connection(self._path)
+        return _Connection(reader, writer)
+
+    async def _connection(self):
+        """
+        Return the next connection in the pool, first replacing it if
+        it has failed.  Requests already made on a failed connection
+        fail; later ones go to its replacement.
+        """
+        if not self._pool:
+            raise XLFilterError("client is not connected")
+        ndx = self._next % len(self._pool)
+        self._next += 1
+        conn = self._pool[ndx]
+        if conn.failed:
+            fresh = await self._open()
+            if conn not in self._pool:
+                # another task replaced it first, or the client closed
+                await fresh.close()
+                return await self._connection()
+            self._pool[self._pool.index(conn)] = fresh
+            await conn.close()
+            conn = fresh
+        return conn
+
+    @staticmethod
+    def _check(status, body):
+        if status != STATUS_OK:
+            raise XLFilterError(body.decode('utf-8', 'replace'))
+        return body
+
+    async def _batched(self, opcode, name, keys):
+        """ Send keys in pipelined batches, returning the bodies. """
+        raw_name = _encode_name(name)
+        keys = list(keys)
+        if not keys:
+            return []
+        key_bytes = len(keys[0])
+        futures = []
+        used = set()
+        for start in range(0, len(keys), self._max_batch):
+            batch = keys[start:start + self._max_batch]
+            packed = b''.join(batch)
+            if len(packed) != key_bytes * len(batch):
+                raise XLFilterError("keys must all be %d bytes long" %
+                                    key_bytes)
+            conn = await self._connection()
+            used.add(conn)
+            futures.append(conn.request(opcode, raw_name, key_bytes,
+                                        len(batch), packed))
+        for conn in used:
+            await conn.drain()
+        results = await asyncio.gather(*futures)
+        return [self._check(status, body) for status, body in results]
+
+    async def info(self, name):
+        """ Return a FilterInfo describing the named filter. """
+        conn = await self._connection()
+        future = conn.request(OP_INFO, _encode_name(name), 0, 0, b'')
+        await conn.drain()
+        status, body = await future
+        return FilterInfo(*INFO.unpack(self._check(status, body)))
+
+    async def insert(self, name, keys):
+        """
+        Add keys to the named filter.
+
+        @param keys  iterable of keys, all the same length
+        @return      the number of keys inserted
+        """
+        bodies = await self._batched(OP_INSERT, name, keys)
+        return sum(COUNT.unpack(body)[0] for body in bodies)
+
+    async def query(self, name, keys):
+        """
+        Test keys for membership in the named filter.
+
+        @return list of booleans, True where the key may be present
+        """
+        bodies = await self._batched(OP_QUERY, name, keys)
+        return [bool(flag) for body in bodies for flag in body]
+
+    async def remove(self, name, keys):
+        """
+        Remove keys from the named filter, which must be a CountingBloom.
+
+        @return the number of keys removed
+        """
+        bodies = await self._batched(OP_REMOVE, name, keys)
+        return sum(COUNT.unpack(body)[0] for body in bodies)
@@ -0,0 +1,424 @@
+# xlcrypto_py/src/xlcrypto/filters/stress.py
+
+"""
+Concurrency stress and throughput harness for BloomSHA, WordBloomSHA,
+and CountingBloom.
+
+Run from the command line as
+    python3 -m xlcrypto.filters.stress [--kind counting] [--threads 8]
+        [--processes 2] [--ops 20000] [--seed 42] [--clear-rate 0.001]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock, Thread
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (BloomSHA, WordBloomSHA, CountingBloom,
+                              KeySelector)
+
+__all__ = ['TimedLock', 'StressReport', 'run_stress', 'main', 'KINDS']
+
+KINDS = {'bloom': BloomSHA, 'word': WordBloomSHA, 'counting': CountingBloom}
+
+StressReport = namedtuple('StressReport', [
+    'kind', 'threads', 'processes', 'seed', 'ops', 'seconds', 'ops_per_sec',
+    'clears', 'lock_waits', 'violations', 'deadlocked'])
+
+
+class TimedLock(object):
+    """
+    A drop-in replacement for threading.Lock which records how long each
+    acquire() waited.  Samples are appended without locking, which is
+    safe under the GIL.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.waits = []                 # seconds spent in each acquire()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        got = self._lock.acquire(blocking, timeout)
+        self.waits.append(time.perf_counter() - start)
+        return got
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+    def percentiles(self, points=(50, 90, 99, 100)):
+        """ Return {point: wait in microseconds} over all samples. """
+        waits = sorted(self.waits)
+        if not waits:
+            return {}
+        last = len(waits) - 1
+        return dict((point, waits[last * point // 100] * 1e6)
+                    for point in points)
+
+
+def _make_keys(rng, count, key_bytes):
+    return [rng.getrandbits(8 * key_bytes).to_bytes(key_bytes, 'little')
+            for _ in range(count)]
+
+
+class _Epoch(object):
+    """
+    Counts clears, seqlock-style: odd while a clear is in progress.
+    A thread's retained keys are only expected to be present if the
+    count was even and unchanged from before they were last inserted
+    until after they were checked.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def clear(self, fltr):
+        try:
+            self._lock.acquire()
+            self.value += 1
+            fltr.clear()
+            self.value += 1
+        finally:
+            self._lock.release()
+
+    def remove(self, fltr, keys, my_epoch, batched):
+        """
+        Remove a thread's churn keys, holding off clears meanwhile, but
+        only if there has been no clear since my_epoch: the keys would
+        then be absent, and removing them would corrupt the counters.
+        Returns whether the keys were removed.
+        """
+        try:
+            self._lock.acquire()
+            if self.value != my_epoch:
+                return False
+            if batched:
+                fltr.remove_many(KeySelector(key, fltr) for key in keys)
+            else:
+                for key in keys:
+                    fltr.remove(KeySelector(key, fltr))
+            return True
+        finally:
+            self._lock.release()
+
+
+def _thread_worker(fltr, ndx, seed, ops, retained, batch, clear_rate,
+                   epoch, out):
+    """
+    One stress thread.  Inserts its own retained keys, which are never
+    removed, then runs a seeded mix of inserts, queries, removes (of
+    its own churn keys, for CountingBloom), and clears, checking that
+    its retained keys are never reported absent.  Appends
+    (ops, clears, live churn keys, violations) to out.
+    """
+    rng = random.Random(seed * 1000003 + ndx)
+    key_bytes = fltr.key_bytes
+    removable = hasattr(fltr, 'remove_many')
+    keep = _make_keys(rng, retained, key_bytes)
+    churn = []
+    violations = []
+    done = clears = 0
+    my_epoch = -1
+    try:
+        while done < ops:
+            now = epoch.value
+            if now != my_epoch and not now & 1:
+                # first pass, or someone cleared: put our keys back, and
+                # forget churn keys, as removing keys which are absent
+                # but test positive would corrupt the counters
+                fltr.insert_many(KeySelector(key, fltr) for key in keep)
+                my_epoch = now
+                churn = []
+                done += len(keep)
+
+            choice = rng.random()
+            if choice < clear_rate:
+                epoch.clear(fltr)
+                churn = []
+                clears += 1
+                done += 1
+            elif choice < 0.35:
+                keys = _make_keys(rng, batch, key_bytes)
+                if rng.random() < 0.5:
+                    fltr.insert_many(KeySelector(key, fltr) for key in keys)
+                else:
+                    for key in keys:
+                        fltr.insert(KeySelector(key, fltr))
+                churn.extend(keys)
+                done += batch
+            elif choice < 0.6 and removable and churn:
+                count = min(batch, len(churn))
+                keys, churn = churn[:count], churn[count:]
+                if not epoch.remove(fltr, keys, my_epoch,
+                                    rng.random() < 0.5):
+                    churn = []          # cleared since we checked
+                done += count
+            else:
+                sample = rng.sample(keep, min(batch, len(keep)))
+                before = epoch.value
+                if rng.random() < 0.5:
+                    found = fltr.is_member_many(
+                        KeySelector(key, fltr) for key in sample)
+                else:
+                    found = [fltr.is_member(KeySelector(key, fltr))
+                             for key in sample]
+                after = epoch.value
+                if before == after == my_epoch:
+                    for key, present in zip(sample, found):
+                        if not present:
+                            violations.append(
+                                "thread %d: false negative for %s" % (
+                                    ndx, key.hex()))
+                done += len(sample)
+    except Exception as exc:            # report rather than die silently
+        violations.append("thread %d: %s: %s" % (
+            ndx, type(exc).__name__, exc))
+    out.append((done, clears, keep + churn, violations))
+
+
+def _process_worker(sock, name, ndx, seed, ops, retained, batch,
+                    key_bytes, removable):
+    """
+    One stress process, a client of a FilterServer.  As a thread worker,
+    but without clears.  Returns (ops, live keys, violations).
+    """
+    from xlcrypto.filters.service import FilterClient
+
+    rng = random.Random(seed * 1000003 + 500009 + ndx)
+    keep = _make_keys(rng, retained, key_bytes)
+
+    async def hammer():
+        churn = []
+        violations = []
+        done = 0
+        async with FilterClient(sock, pool_size=2, max_batch=batch) as client:
+            await client.insert(name, keep)
+            done += len(keep)
+            while done < ops:
+                choice = rng.random()
+                if choice < 0.35:
+                    keys = _make_keys(rng, batch, key_bytes)
+                    await client.insert(name, keys)
+                    churn.extend(keys)
+                    done += batch
+                elif choice < 0.6 and removable and churn:
+                    count = min(batch, len(churn))
+                    keys, churn = churn[:count], churn[count:]
+                    await client.remove(name, keys)
+                    done += count
+                else:
+                    sample = rng.sample(keep, min(batch, len(keep)))
+                    found = await client.query(name, sample)
+                    for key, present in zip(sample, found):
+                        if not present:
+                            violations.append(
+                                "process %d: false negative for %s" % (
+                                    ndx, key.hex()))
+                    done += len(sample)
+        return done, keep + churn, violations
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(hammer())
+    finally:
+        loop.close()
+
+
+def _check_counters(fltr, live_keys, violations):
+    """
+    With everything quiet, check that each filter bit is set exactly
+    where its counter is non-zero, and, if the set of live keys is
+    known, that the counters and key count match a fresh rebuild.
+    """
+    counters = fltr._counters
+    body = fltr._body()
+    for bit in range(fltr.capacity):
+        is_set = (body[bit >> 3] >> (bit & 7)) & 1
+        if bool(is_set) != bool(counters.value(bit)):
+            violations.append("bit %d is %d but its counter is %d" % (
+                bit, is_set, counters.value(bit)))
+            break
+    if live_keys is None:
+        return
+    fresh = CountingBloom(fltr.m, fltr.k, fltr.key_bytes)
+    fresh.insert_many(KeySelector(key, fresh) for key in live_keys)
+    if fresh._counters._counters != counters._counters:
+        violations.append("counters differ from a rebuild of live keys")
+    if len(fresh) != len(fltr):
+        violations.append("key count %d but %d keys are live" % (
+            len(fltr), len(fresh)))
+
+
+def run_stress(kind='counting', threads=8, processes=0, ops=20000, seed=42,
+               m=18, k=8, key_bytes=20, retained=64, batch=32,
+               clear_rate=0.0, timeout=300.0):
+    """
+    Hammer one filter from many threads, and optionally from worker
+    processes through a FilterServer, then check invariants.
+
+    Each worker's sequence of operations is fixed by the seed; the
+    interleaving of workers of course is not.
+
+    Invariants checked:
+      * no false negatives: keys a worker inserted and never removed
+        are always found, unless a clear intervened
+      * for CountingBloom, a filter bit is set exactly where its
+        counter is non-zero; without clears, counters and key count
+        also match a rebuild from the keys that should be present
+      * no deadlock: every worker finishes within timeout seconds
+
+    @param kind        'bloom', 'word', or 'counting'
+    @param threads     number of threads in this process
+    @param processes   number of client processes
+    @param ops         key operations per worker
+    @param retained    keys each worker inserts and never removes
+    @param batch       keys per batch operation
+    @param clear_rate  probability that a thread operation is a clear
+    @param timeout     seconds to wait before declaring deadlock
+    @return            a StressReport; lock_waits maps lock names to
+                       {percentile: microseconds}
+    """
+    if kind not in KINDS:
+        raise XLFilterError("unknown filter kind '%s'" % kind)
+    if processes and clear_rate:
+        # processes can't see the clear count, so can't check for
+        # false negatives across clears
+        raise XLFilterError("clears can't be combined with processes")
+    fltr = KINDS[kind](m, k, key_bytes)
+    removable = hasattr(fltr, 'remove_many')
+    locks = {'_lock': TimedLock()}
+    fltr._lock = locks['_lock']
+    if hasattr(fltr, '_cb_lock'):
+        locks['_cb_lock'] = TimedLock()
+        fltr._cb_lock = locks['_cb_lock']
+
+    epoch = _Epoch()
+    results = []
+    workers = [Thread(target=_thread_worker, daemon=True,
+                      args=(fltr, ndx, seed, ops, retained, batch,
+                            clear_rate, epoch, results))
+               for ndx in range(threads)]
+
+    server = loop = loop_thread = scratch = None
+    futures = []
+    pool = None
+    start = time.perf_counter()
+    try:
+        if processes:
+            from xlcrypto.filters.service import FilterServer
+            scratch = tempfile.mkdtemp(prefix='xlstress')
+            sock = os.path.join(scratch, 'stress.sock')
+            server = FilterServer(sock, {'stress': fltr})
+            loop = asyncio.new_event_loop()
+            loop_thread = Thread(target=loop.run_forever, daemon=True)
+            loop_thread.start()
+            asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+            pool = ProcessPoolExecutor(max_workers=processes,
+                                       mp_context=get_context('spawn'))
+            futures = [pool.submit(_process_worker, sock, 'stress', ndx,
+                                   seed, ops, retained, batch, key_bytes,
+                                   removable)
+                       for ndx in range(processes)]
+            start = time.perf_counter()     # not counting process startup
+
+        for worker in workers:
+            worker.start()
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        proc_results = [future.result(max(0.0, deadline - time.monotonic()))
+                        for future in futures]
+        seconds = time.perf_counter() - start
+    finally:
+        if server is not None:
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+            os.rmdir(scratch)
+        if pool is not None:
+            pool.shutdown()
+
+    deadlocked = any(worker.is_alive() for worker in workers)
+    violations = []
+    total = clears = 0
+    live_keys = []
+    for done, cleared, live, problems in results:
+        total += done
+        clears += cleared
+        live_keys.extend(live)
+        violations.extend(problems)
+    for done, live, problems in proc_results:
+        total += done
+        live_keys.extend(live)
+        violations.extend(problems)
+    if deadlocked:
+        violations.append("threads still running after %.0f s" % timeout)
+    elif kind == 'counting':
+        _check_counters(fltr, None if clears else live_keys, violations)
+
+    return StressReport(
+        kind=kind, threads=threads, processes=processes, seed=seed,
+        ops=total, seconds=seconds,
+        ops_per_sec=total / seconds if seconds else 0.0,
+        clears=clears,
+        lock_waits=dict((name, lock.percentiles())
+                        for name, lock in locks.items()),
+        violations=violations, deadlocked=deadlocked)
+
+
+def main(argv=None):
+    """ Run the harness from the command line, printing a report. """
+    parser = ArgumentParser(description='stress-test xlcrypto filters')
+    parser.add_argument('--kind', choices=sorted(KINDS), default='counting')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=0)
+    parser.add_argument('--ops', type=int, default=20000,
+                        help='key operations per worker')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('-m', type=int, default=18)
+    parser.add_argument('-k', type=int, default=8)
+    parser.add_argument('--clear-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    args = parser.parse_args(argv)
+
+    report = run_stress(args.kind, args.threads, args.processes, args.ops,
+                        args.seed, m=args.m, k=args.k,
+                        clear_rate=args.clear_rate, timeout=args.timeout)
+    print("%s: %d threads, %d processes, seed %d" % (
+        report.kind, report.threads, report.processes, report.seed))
+    print("    %d ops in %.2f s: %.0f ops/s, %d clears" % (
+        report.ops, report.seconds, report.ops_per_sec, report.clears))
+    for name, waits in sorted(report.lock_waits.items()):
+        print("    %-9s wait us: %s" % (name, '  '.join(
+            "p%d %.1f" % (point, usec) for point, usec in sorted(
+                waits.items()))))
+    for problem in report.violations[:20]:
+        print("    VIOLATION: %s" % problem)
+    if len(report.violations) > 20:
+        print("    ... %d more" % (len(report.violations) - 20))
+    return 1 if report.violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
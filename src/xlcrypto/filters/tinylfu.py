@@ -0,0 +1,206 @@
+# xlcrypto_py/src/xlcrypto/filters/tinylfu.py
+
+""" TinyLFU-style aging frequency sketch for cache admission. """
+
+from threading import Lock
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, NibbleCounters
+
+__all__ = ['FrequencySketch', ]
+
+
+class FrequencySketch(object):
+    """
+    Approximate, aging access frequencies for SHA digests, intended to
+    decide whether a new key should be admitted to a cache at the cost
+    of evicting another (the TinyLFU admission policy).
+
+    Frequencies are kept in NibbleCounters, one 4-bit counter for each
+    of 2**m positions; as in BloomSHA, a key selects k positions using
+    a KeySelector and its frequency is the smallest of its k counters.
+    Only the smallest of a key's counters are incremented when it is
+    seen.  After sample_size keys have been recorded every counter is
+    halved, so that the sketch tracks recent popularity and counters do
+    not remain saturated.
+
+    In front of the counters is a doorkeeper, a BloomSHA of the same
+    geometry: the first sighting of a key in each sample period only sets
+    its doorkeeper bits, so the many keys seen just once never reach
+    the counters.  The doorkeeper is cleared whenever counters are halved.
+
+    The whole occupies 5 * 2**(m - 3) bytes.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, m=16, k=4, key_bytes=20, sample_size=None,
+                 doorkeeper=True):
+        """
+        @param m           log2 of the number of counters
+        @param k           number of counters per key
+        @param key_bytes   length in bytes of acceptable keys
+        @param sample_size keys recorded between halvings; defaults to
+                           ten times the number of counters divided by 4,
+                           suiting a cache of about 2**(m - 2) entries
+        @param doorkeeper  whether to filter first sightings of keys
+        """
+        # the BloomSHA constructor validates the parameters
+        fltr = BloomSHA(m, k, key_bytes)
+        self._mm, self._kk, self._key_bytes = fltr.m, fltr.k, fltr.key_bytes
+        self._doorkeeper = fltr if doorkeeper else None
+
+        if sample_size is None:
+            sample_size = 10 << (self._mm - 2)
+        sample_size = int(sample_size)
+        if sample_size <= 0:
+            raise XLFilterError("sample size must be positive")
+        self._sample_size = sample_size
+
+        self._counters = NibbleCounters(self._mm)
+        self._additions = 0         # keys recorded since last halving
+        self._resets = 0
+        self._lock = Lock()
+
+    @property
+    def m(self):
+        """ Return m, log2 of the number of counters. """
+        return self._mm
+
+    @property
+    def k(self):
+        """ Return k, the number of counters per key. """
+        return self._kk
+
+    @property
+    def key_bytes(self):
+        """ Length in bytes of acceptable keys. """
+        return self._key_bytes
+
+    @property
+    def sample_size(self):
+        """ Number of keys recorded between halvings of the counters. """
+        return self._sample_size
+
+    @property
+    def resets(self):
+        """ Number of times the counters have been halved. """
+        return self._resets
+
+    def _check(self, keysel):
+        """ Reject a missing KeySelector or one for another geometry. """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        if keysel.m != self._mm or keysel.k != self._kk:
+            raise XLFilterError(
+                "KeySelector is for m=%d, k=%d but sketch has m=%d, k=%d" %
+                (keysel.m, keysel.k, self._mm, self._kk))
+
+    def _do_record(self, keysel):
+        """ Record one sighting of a key, unsynchronized. """
+        if self._doorkeeper is not None and \
+                not self._doorkeeper.is_member(keysel):
+            self._doorkeeper.insert(keysel)
+        else:
+            counters = self._counters
+            bits = keysel.filter_bits
+            values = [counters.value(bit) for bit in bits]
+            least = min(values)
+            if least < 0xf:
+                for ndx, bit in enumerate(bits):
+                    if values[ndx] == least:
+                        counters.inc(bit)
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._do_reset()
+
+    def _do_reset(self):
+        """ Age the sketch, unsynchronized. """
+        self._counters.halve()
+        if self._doorkeeper is not None:
+            self._doorkeeper.clear()
+        self._additions //= 2
+        self._resets += 1
+
+    def _do_frequency(self, keysel):
+        counters = self._counters
+        freq = min(counters.value(bit) for bit in keysel.filter_bits)
+        if self._doorkeeper is not None and \
+                self._doorkeeper.is_member(keysel):
+            freq += 1
+        return freq
+
+    def record(self, keysel):
+        """
+        Record that a key has been seen.
+
+        @param keysel  KeySelector for the key (SHA digest)
+        """
+        self._check(keysel)
+        try:
+            self._lock.acquire()
+            self._do_record(keysel)
+        finally:
+            self._lock.release()
+
+    def record_many(self, keysels):
+        """ Record sightings of a batch of keys, taking the lock once. """
+        keysels = list(keysels)
+        for keysel in keysels:
+            self._check(keysel)
+        try:
+            self._lock.acquire()
+            for keysel in keysels:
+                self._do_record(keysel)
+        finally:
+            self._lock.release()
+
+    def frequency(self, keysel):
+        """
+        Return the estimated recent frequency of a key, at most 16.
+
+        @param keysel  KeySelector for the key (SHA digest)
+        """
+        self._check(keysel)
+        try:
+            self._lock.acquire()
+            return self._do_frequency(keysel)
+        finally:
+            self._lock.release()
+
+    def admit(self, candidate, victim):
+        """
+        Whether a cache should admit a candidate key, evicting the victim
+        to make room.  The candidate is admitted only if it has been seen
+        more often recently than the victim.
+
+        @param candidate  KeySelector for the key seeking admission
+        @param victim     KeySelector for the key which would be evicted
+        """
+        self._check(candidate)
+        self._check(victim)
+        try:
+            self._lock.acquire()
+            return self._do_frequency(candidate) > \
+                self._do_frequency(victim)
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """ Age the sketch now, halving all counters. """
+        try:
+            self._lock.acquire()
+            self._do_reset()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Forget everything. """
+        try:
+            self._lock.acquire()
+            self._counters.clear()
+            if self._doorkeeper is not None:
+                self._doorkeeper.clear()
+            self._additions = 0
+        finally:
+            self._lock.release()
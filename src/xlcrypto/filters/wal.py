@@ -0,0 +1,487 @@
+# xlcrypto_py/src/xlcrypto/filters/wal.py
+
+"""
+Crash-safe CountingBloom: a write-ahead log with group commit plus
+background checkpoints.
+"""
+
+import os
+import struct
+from threading import Event, Lock, Thread
+from time import monotonic
+from zlib import crc32
+
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (CountingBloom, KeySelector, KIND_COUNTING,
+                              FILTER_HEADER, pack_filter_header,
+                              unpack_filter_header)
+
+__all__ = ['DurableCountingBloom', 'WAL_FRAME', 'CHECKPOINT_TRAILER']
+
+# each group of records is written as one frame: record count, CRC32
+# of the records, then the records themselves
+WAL_FRAME = struct.Struct('<II')
+
+# a checkpoint ends with the number of the first WAL segment not
+# reflected in it and the CRC32 of everything before the trailer
+CHECKPOINT_TRAILER = struct.Struct('<QI')
+
+OP_INSERT = ord('I')
+OP_REMOVE = ord('R')
+OP_CLEAR = ord('C')
+
+CHECKPOINT_NAME = 'checkpoint'
+SEGMENT_PREFIX = 'wal.'
+
+
+def _fsync_dir(path):
+    """ Make a rename or unlink in the directory durable, where possible. """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return                              # eg, Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class DurableCountingBloom(CountingBloom):
+    """
+    A CountingBloom which survives crashes.
+
+    State is kept in a directory.  Every insert, remove, and clear is
+    appended to a write-ahead log (WAL) as a record of one opcode byte
+    followed by the key.  Records are buffered and written in frames,
+    each with its own CRC32, and a single fsync() covers every record
+    in the frame (group commit).  A frame is written when group_commit
+    records are waiting, every sync_interval seconds, and whenever
+    sync() is called; an operation is durable once a frame holding it
+    has been written.
+
+    Every checkpoint_interval seconds a background thread writes a
+    checkpoint: the filter and its counters as of a single instant,
+    followed by the number of the first WAL segment which is not
+    reflected in it.  Writers are held up only while a copy-on-write
+    snapshot is taken and a new WAL segment started; the checkpoint
+    itself is streamed to disk a page at a time while writers continue.
+    Once it has been renamed into place, older segments are deleted.
+
+    On opening, the latest checkpoint is loaded and the WAL replayed on
+    top of it, so restart time is bounded by the checkpoint interval
+    rather than by the size of the set.  Replay stops at the first torn
+    or corrupt frame, which is cut off.
+
+    Locks are taken in the order _io_lock, _wal_lock, _cb_lock, _lock.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, path, m=20, k=8, key_bytes=20, group_commit=256,
+                 sync_interval=0.05, checkpoint_interval=60.0):
+        """
+        Open the filter kept in the directory given, creating it if
+        necessary.  m, k, and key_bytes must match any existing state.
+
+        @param path                directory holding checkpoint and WAL
+        @param m                   log2 of the number of filter bits
+        @param k                   number of 'hash functions'
+        @param key_bytes           length in bytes of acceptable keys
+        @param group_commit        records per frame which force a write
+        @param sync_interval       seconds between background writes
+        @param checkpoint_interval seconds between checkpoints, or None
+        """
+        super().__init__(m, k, key_bytes)
+        group_commit = int(group_commit)
+        if group_commit < 1:
+            raise XLFilterError(
+                "group_commit = %d but must be positive" % group_commit)
+        if sync_interval is None or sync_interval <= 0:
+            raise XLFilterError("sync_interval must be positive")
+        if checkpoint_interval is not None and checkpoint_interval <= 0:
+            raise XLFilterError("checkpoint_interval must be positive")
+
+        self._path = path
+        self._group_commit = group_commit
+        self._sync_interval = sync_interval
+        self._checkpoint_interval = checkpoint_interval
+        self._record_bytes = 1 + self._key_bytes
+
+        self._io_lock = Lock()          # serializes writes to disk
+        self._wal_lock = Lock()         # orders operations with the log
+        self._pending = []              # records not yet written
+        self._segment = None            # open WAL segment
+        self._segment_seq = 0
+        self._failure = None            # exception from background thread
+        self._closed = False
+
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name='xlcrypto-wal')
+        self._thread.start()
+
+    # PROPERTIES ####################################################
+
+    @property
+    def path(self):
+        """ Return the directory holding the checkpoint and WAL. """
+        return self._path
+
+    @property
+    def segment_seq(self):
+        """ Return the number of the WAL segment being written. """
+        return self._segment_seq
+
+    # FILE NAMES ####################################################
+
+    def _segment_path(self, seq):
+        return os.path.join(self._path, '%s%08d' % (SEGMENT_PREFIX, seq))
+
+    def _segments(self):
+        """ Return the sorted numbers of the WAL segments on disk. """
+        seqs = []
+        for name in os.listdir(self._path):
+            if name.startswith(SEGMENT_PREFIX):
+                suffix = name[len(SEGMENT_PREFIX):]
+                if suffix.isdigit():
+                    seqs.append(int(suffix))
+        return sorted(seqs)
+
+    # RECOVERY ######################################################
+
+    def _recover(self):
+        """ Load the latest checkpoint and replay the WAL on top of it. """
+        tmp = os.path.join(self._path, CHECKPOINT_NAME + '.tmp')
+        if os.path.exists(tmp):
+            os.unlink(tmp)                  # interrupted checkpoint
+        first_seq = 0
+        ckpt = os.path.join(self._path, CHECKPOINT_NAME)
+        if os.path.exists(ckpt):
+            with open(ckpt, 'rb') as file:
+                first_seq = self._load_checkpoint(file.read())
+
+        seqs = [seq for seq in self._segments() if seq >= first_seq]
+        for ndx, seq in enumerate(seqs):
+            if not self._replay(self._segment_path(seq)):
+                # the log ends at a torn frame; nothing after it counts
+                for later in seqs[ndx + 1:]:
+                    os.unlink(self._segment_path(later))
+                seqs = seqs[:ndx + 1]
+                break
+        self._segment_seq = seqs[-1] + 1 if seqs else first_seq
+        self._segment = open(self._segment_path(self._segment_seq), 'ab')
+        _fsync_dir(self._path)
+
+    def _load_checkpoint(self, data):
+        """
+        Load filter and counters from a checkpoint.
+
+        @return the number of the first WAL segment to replay
+        """
+        if len(data) < FILTER_HEADER.size + CHECKPOINT_TRAILER.size:
+            raise XLFilterError("checkpoint is too short")
+        split = len(data) - CHECKPOINT_TRAILER.size
+        first_seq, crc = CHECKPOINT_TRAILER.unpack_from(data, split)
+        if crc32(memoryview(data)[:split]) != crc:
+            raise XLFilterError("checkpoint is corrupt")
+        m, k, key_bytes, key_count, body = unpack_filter_header(
+            memoryview(data)[:split], KIND_COUNTING)
+        if (m, k, key_bytes) != (self._mm, self._kk, self._key_bytes):
+            raise XLFilterError(
+                "checkpoint has m=%d, k=%d, key_bytes=%d; expected %d, %d, %d"
+                % (m, k, key_bytes, self._mm, self._kk, self._key_bytes))
+        filter_bytes = len(self._filter)
+        counter_bytes = len(self._counters._counters)
+        if len(body) != filter_bytes + counter_bytes:
+            raise XLFilterError("checkpoint has wrong length")
+        self._filter[:] = body[:filter_bytes]
+        self._counters._counters[:] = body[filter_bytes:]
+        self._key_count = key_count
+        return first_seq
+
+    def _replay(self, seg_path):
+        """
+        Apply the operations logged in a WAL segment.  A torn or corrupt
+        frame is cut off, together with anything following it.
+
+        @return True if the whole segment was intact
+        """
+        record_bytes = self._record_bytes
+        key_bytes = self._key_bytes
+        with open(seg_path, 'rb') as file:
+            data = file.read()
+        offset = 0
+        while offset < len(data):
+            if len(data) - offset < WAL_FRAME.size:
+                break
+            count, crc = WAL_FRAME.unpack_from(data, offset)
+            start = offset + WAL_FRAME.size
+            end = start + count * record_bytes
+            if end > len(data) or crc32(data[start:end]) != crc:
+                break
+            for rec in range(start, end, record_bytes):
+                opcode = data[rec]
+                if opcode == OP_CLEAR:
+                    CountingBloom.clear(self)
+                    continue
+                keysel = KeySelector(data[rec + 1:rec + 1 + key_bytes], self)
+                if opcode == OP_INSERT:
+                    CountingBloom.insert(self, keysel)
+                elif opcode == OP_REMOVE:
+                    CountingBloom.remove(self, keysel)
+                else:
+                    raise XLFilterError(
+                        "unknown WAL opcode %d in %s" % (opcode, seg_path))
+            offset = end
+        if offset == len(data):
+            return True
+        with open(seg_path, 'r+b') as file:
+            file.truncate(offset)
+            os.fsync(file.fileno())
+        return False
+
+    # LOGGING #######################################################
+
+    def _check_open(self):
+        if self._failure is not None:
+            raise XLFilterError(
+                "WAL background thread failed: %s" % self._failure)
+        if self._closed:
+            raise XLFilterError("filter has been closed")
+
+    def _log(self, opcode, key):
+        """ Queue a record.  Caller holds _wal_lock. """
+        self._pending.append(bytes([opcode]) + key)
+
+    def _maybe_flush(self):
+        """ Write a frame if enough records are waiting.  No locks held. """
+        if len(self._pending) >= self._group_commit:
+            self._flush()
+
+    def _write_frame(self, file, records):
+        """ Write records as a single frame and fsync.  Holds _io_lock. """
+        if records:
+            payload = b''.join(records)
+            file.write(WAL_FRAME.pack(len(records), crc32(payload)) + payload)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _flush(self):
+        """ Write any waiting records to the WAL. """
+        try:
+            self._io_lock.acquire()
+            try:
+                self._wal_lock.acquire()
+                records, self._pending = self._pending, []
+            finally:
+                self._wal_lock.release()
+            self._write_frame(self._segment, records)
+        finally:
+            self._io_lock.release()
+
+    def sync(self):
+        """ Make every operation completed so far durable. """
+        self._check_open()
+        self._flush()
+
+    # OPERATIONS ####################################################
+
+    def insert(self, keysel):
+        """
+        Add a key to the set, logging the insertion.
+
+        @param keysel  KeySelector for the key to be added
+        """
+        if keysel is None:
+            raise XLFilterError("KeySelector may not be None")
+        self._check_open()
+        try:
+            self._wal_lock.acquire()
+            super().insert(keysel)
+            self._log(OP_INSERT, keysel.key)
+        finally:
+            self._wal_lock.release()
+        self._maybe_flush()
+
+    def insert_many(self, keysels, sort=False):
+        """
+        Add a batch of keys to the set, logging the insertions.
+        See CountingBloom.insert_many().
+
+        @return the number of keys inserted
+        """
+        keysels = list(keysels)
+        self._check_open()
+        try:
+            self._wal_lock.acquire()
+            count = super().insert_many(keysels, sort)
+            for keysel in keysels:
+                self._log(OP_INSERT, keysel.key)
+        finally:
+            self._wal_lock.release()
+        self._maybe_flush()
+        return count
+
+    def remove(self, keysel):
+        """
+        Remove a key from the set, logging the removal.  Nothing is
+        logged if the key is not a member.
+
+        @param keysel  KeySelector for the key to be removed
+        """
+        self._check_open()
+        try:
+            self._wal_lock.acquire()
+            if self.is_member(keysel):
+                super().remove(keysel)
+                self._log(OP_REMOVE, keysel.key)
+        finally:
+            self._wal_lock.release()
+        self._maybe_flush()
+
+    def remove_many(self, keysels):
+        """
+        Remove a batch of keys from the set, logging the removals of
+        those which were members.
+
+        @return the number of keys removed
+        """
+        keysels = list(keysels)
+        if None in keysels:
+            raise XLFilterError("KeySelector may not be None")
+        self._check_open()
+        try:
+            self._wal_lock.acquire()
+            present = [keysel for keysel in keysels if self.is_member(keysel)]
+            removed = super().remove_many(present)
+            for keysel in present:
+                self._log(OP_REMOVE, keysel.key)
+        finally:
+            self._wal_lock.release()
+        self._maybe_flush()
+        return removed
+
+    def clear(self):
+        """ Clear the filter and its counters, logging the fact. """
+        self._check_open()
+        try:
+            self._wal_lock.acquire()
+            super().clear()
+            self._log(OP_CLEAR, bytes(self._key_bytes))
+        finally:
+            self._wal_lock.release()
+        self._maybe_flush()
+
+    # CHECKPOINTS ###################################################
+
+    def checkpoint(self):
+        """
+        Write a checkpoint and delete the WAL segments it makes
+        redundant.  Writers are held up only while snapshots are taken.
+        """
+        self._check_open()
+        self._checkpoint()
+
+    def _checkpoint(self):
+        try:
+            self._io_lock.acquire()
+            try:
+                self._wal_lock.acquire()
+                # everything logged so far belongs to the old segment
+                records, self._pending = self._pending, []
+                fsnap = self.snapshot()
+                try:
+                    self._cb_lock.acquire()
+                    csnap = self._counters.snapshot()
+                finally:
+                    self._cb_lock.release()
+                old_segment = self._segment
+                self._segment_seq += 1
+                first_seq = self._segment_seq
+            finally:
+                self._wal_lock.release()
+
+            try:
+                self._write_frame(old_segment, records)
+                old_segment.close()
+                self._segment = open(self._segment_path(first_seq), 'ab')
+                self._write_checkpoint(fsnap, csnap, first_seq)
+            finally:
+                fsnap.release()
+                try:
+                    self._cb_lock.acquire()
+                    self._counters.detach(csnap)
+                finally:
+                    self._cb_lock.release()
+            for seq in self._segments():
+                if seq < first_seq:
+                    os.unlink(self._segment_path(seq))
+            _fsync_dir(self._path)
+        finally:
+            self._io_lock.release()
+
+    def _write_checkpoint(self, fsnap, csnap, first_seq):
+        """ Stream snapshots to a new checkpoint file, then rename it. """
+        tmp = os.path.join(self._path, CHECKPOINT_NAME + '.tmp')
+        with open(tmp, 'wb') as file:
+            chunk = pack_filter_header(KIND_COUNTING, self._mm, self._kk,
+                                       self._key_bytes, len(fsnap))
+            crc = crc32(chunk)
+            file.write(chunk)
+            for snap in (fsnap, csnap):
+                for chunk in snap.pages():
+                    crc = crc32(chunk, crc)
+                    file.write(chunk)
+            file.write(CHECKPOINT_TRAILER.pack(first_seq, crc))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, os.path.join(self._path, CHECKPOINT_NAME))
+
+    # BACKGROUND THREAD #############################################
+
+    def _run(self):
+        interval = self._checkpoint_interval
+        due = None if interval is None else monotonic() + interval
+        while not self._stop.wait(self._sync_interval):
+            try:
+                self._flush()
+                if due is not None and monotonic() >= due:
+                    self._checkpoint()
+                    due = monotonic() + interval
+            except Exception as exc:
+                self._failure = exc
+                return
+
+    # LIFE CYCLE ####################################################
+
+    def close(self, checkpoint=True):
+        """
+        Stop the background thread, make everything durable, and close
+        the WAL.  If checkpoint is True, also write a final checkpoint,
+        so that the next open need replay nothing.
+        """
+        if self._closed:
+            return
+        self._stop.set()
+        self._thread.join()
+        try:
+            if self._failure is None:
+                if checkpoint:
+                    self._checkpoint()
+                else:
+                    self._flush()
+        finally:
+            self._closed = True
+            self._segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -1,17 +1,32 @@
 # xlcrypto_py/src/xlcrypto/hash
 
+import asyncio
 import hashlib
+import hmac
+import mmap
+import os
+import sqlite3
 import sys
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from xlattice import SHA1_BIN_LEN, SHA2_BIN_LEN, SHA3_BIN_LEN, BLAKE2B_BIN_LEN
-from xlcrypto import XLHash
+from xlattice import (SHA1_BIN_LEN, SHA2_BIN_LEN, SHA3_BIN_LEN,
+                      BLAKE2B_BIN_LEN, HashTypes, check_hashtype)
+from xlcrypto import (XLCryptoError, XLHash, HASH_CHUNK_SIZE,
+                      HASH_MMAP_THRESHOLD)
 
 if sys.version_info < (3, 6):
     from pyblake2 import blake2b
+    _blake2b = blake2b
 
     # pylint:disable=unused-import
     import sha3                     # pysha3    - monkey-patches hashhlib
     # assert sha3                   # suppress warnings
+else:
+    _blake2b = hashlib.blake2b
 
 
 class XLSHA1(XLHash):
@@ -32,6 +47,12 @@ class XLSHA1(XLHash):
         """ Return a fixed-length hex digest, a string. """
         return self._hash.hexdigest()
 
+    def copy(self):
+        """ Return a copy of the hash in its current state. """
+        clone = self.__class__.__new__(self.__class__)
+        clone._hash = self._hash.copy()
+        return clone
+
     # these are actually class attributes
 
     def digest_size(self):
@@ -67,6 +88,12 @@ class XLSHA2(XLHash):
         """ Return a fixed-length hex digest, a string. """
         return self._hash.hexdigest()
 
+    def copy(self):
+        """ Return a copy of the hash in its current state. """
+        clone = self.__class__.__new__(self.__class__)
+        clone._hash = self._hash.copy()
+        return clone
+
     # these are actually class attributes
 
     def digest_size(self):
@@ -102,6 +129,12 @@ class XLSHA3(XLHash):
         """ Return a fixed-length hex digest, a string. """
         return self._hash.hexdigest()
 
+    def copy(self):
+        """ Return a copy of the hash in its current state. """
+        clone = self.__class__.__new__(self.__class__)
+        clone._hash = self._hash.copy()
+        return clone
+
     # these are actually class attributes
 
     def digest_size(self):
@@ -122,13 +155,15 @@ class XLSHA3(XLHash):
 class XLBLAKE2B_256(XLHash):
     """
     Implementation of the blake2b hash algorithm with a 32-byte/256-bit digest.
+    Given a key of up to 64 bytes, the digest is blake2b's keyed MAC.
     """
 
-    def __init__(self, data=b''):
+    def __init__(self, data=b'', key=b''):
         if sys.version_info >= (3, 6):
-            self._hash = hashlib.blake2b(data, digest_size=BLAKE2B_BIN_LEN)
+            self._hash = hashlib.blake2b(data, digest_size=BLAKE2B_BIN_LEN,
+                                         key=key)
         else:
-            self._hash = blake2b(data, digest_size=BLAKE2B_BIN_LEN)
+            self._hash = blake2b(data, digest_size=BLAKE2B_BIN_LEN, key=key)
 
     def update(self, data):
         """ Add data to the internal hash. """
@@ -142,6 +177,12 @@ class XLBLAKE2B_256(XLHash):
         """ Return a fixed-length hex digest, a string. """
         return self._hash.hexdigest()
 
+    def copy(self):
+        """ Return a copy of the hash in its current state. """
+        clone = self.__class__.__new__(self.__class__)
+        clone._hash = self._hash.copy()
+        return clone
+
     # these are actually class attributes
 
     def digest_size(self):
@@ -157,3 +198,919 @@ class XLBLAKE2B_256(XLHash):
     def lib_func(cls):
         """ The implementing library function. """
         return hashlib.blake2b
+
+
+# ===================================================================
+
+# the XLHash class implementing each hash type
+HASH_CLASSES = {
+    HashTypes.SHA1: XLSHA1,
+    HashTypes.SHA2: XLSHA2,
+    HashTypes.SHA3: XLSHA3,
+    HashTypes.BLAKE2B: XLBLAKE2B_256,
+}
+
+
+def get_hash_class(hashtype):
+    """ Return the XLHash class implementing a HashTypes value. """
+    check_hashtype(hashtype)
+    return HASH_CLASSES[hashtype]
+
+
+class PrefixTemplate(object):
+    """
+    Hashes many messages which share a prefix, such as a protocol
+    header, a salt, or a key.  The prefix is hashed once, when the
+    template is made; each message then starts from a copy of that
+    state, so the compression rounds for every complete block of the
+    prefix are not repeated.
+    """
+
+    def __init__(self, hashtype=HashTypes.SHA2, prefix=b''):
+        """
+        @param hashtype  HashTypes value
+        @param prefix    bytes-like common to all messages
+        """
+        self._state = get_hash_class(hashtype)(prefix)
+
+    def new(self, data=b''):
+        """ Return an XLHash holding the prefix followed by data. """
+        xlh = self._state.copy()
+        if data:
+            xlh.update(data)
+        return xlh
+
+    def digest(self, data):
+        """ Return the binary digest of the prefix followed by data. """
+        xlh = self._state.copy()
+        xlh.update(data)
+        return xlh.digest()
+
+    def hexdigest(self, data):
+        """ Return the hex digest of the prefix followed by data. """
+        return self.digest(data).hex()
+
+    def digest_many(self, messages):
+        """ Return the digests of the prefix followed by each message. """
+        # work directly on the hashlib object, skipping the wrapper
+        copy = self._state._hash.copy
+        digests = []
+        for data in messages:
+            hasher = copy()
+            hasher.update(data)
+            digests.append(hasher.digest())
+        return digests
+
+
+def digest_many(hashtype, messages, offsets=None, as_array=False):
+    """
+    Digest many small messages, returning the digests packed end to end
+    in a single bytes object, ready for example for split_keys() or
+    build_parallel() in xlcrypto.filters.
+
+    Each message is hashed by a copy of one prepared hashlib object, so
+    none of the per-message cost of the XLHash wrapper is paid.
+
+    @param hashtype  HashTypes value
+    @param messages  iterable of bytes-like messages, or if offsets is
+                     given a single contiguous bytes-like buffer
+    @param offsets   optional sequence of N + 1 non-decreasing offsets
+                     into messages: message i is [offsets[i]:offsets[i+1]]
+    @param as_array  if True, return an N x digest_size NumPy uint8 array
+    """
+    proto = get_hash_class(hashtype)()._hash
+    copy = proto.copy
+    digests = []
+    append = digests.append
+    if offsets is None:
+        for data in messages:
+            hasher = copy()
+            hasher.update(data)
+            append(hasher.digest())
+    else:
+        # slicing small messages out of bytes is cheaper than making a
+        # memoryview of each
+        if not isinstance(messages, bytes):
+            messages = memoryview(messages).cast('B').tobytes()
+        offsets = list(offsets)
+        if offsets and (offsets[0] < 0 or offsets[-1] > len(messages)):
+            raise XLCryptoError("offsets run outside the buffer")
+        start = offsets[0] if offsets else 0
+        for end in offsets[1:]:
+            if end < start:
+                raise XLCryptoError("offsets must not decrease")
+            hasher = copy()
+            hasher.update(messages[start:end])
+            append(hasher.digest())
+            start = end
+    packed = b''.join(digests)
+    if not as_array:
+        return packed
+    try:
+        import numpy
+    except ImportError:
+        raise XLCryptoError("as_array requires NumPy")
+    return numpy.frombuffer(packed, dtype=numpy.uint8).reshape(
+        -1, proto.digest_size)
+
+
+def hash_fileobj(fileobj, hashtype=HashTypes.SHA2,
+                 chunk_size=HASH_CHUNK_SIZE):
+    """
+    Return the binary digest of the rest of a binary file object, read
+    into a single reused buffer.
+    """
+    return get_hash_class(hashtype).hash_fileobj(fileobj, chunk_size)
+
+
+def hash_file(path, hashtype=HashTypes.SHA2, chunk_size=HASH_CHUNK_SIZE,
+              mmap_threshold=HASH_MMAP_THRESHOLD):
+    """
+    Return the binary digest of the file at path.  See XLHash.hash_file().
+    """
+    return get_hash_class(hashtype).hash_file(path, chunk_size,
+                                              mmap_threshold)
+
+# what hash_files() yields for each file: error is None, or the OSError
+# raised while hashing the file, in which case digest is None
+HashResult = namedtuple('HashResult', ['path', 'digest', 'error'])
+
+
+def _hash_one(cls, path, chunk_size, mmap_threshold):
+    try:
+        return HashResult(path, cls.hash_file(path, chunk_size,
+                                              mmap_threshold), None)
+    except OSError as exc:
+        return HashResult(path, None, exc)
+
+
+def hash_files(paths, hashtype=HashTypes.SHA2, workers=None, ordered=False,
+               max_pending=None, raise_errors=False,
+               chunk_size=HASH_CHUNK_SIZE,
+               mmap_threshold=HASH_MMAP_THRESHOLD):
+    """
+    Hash many files using a pool of threads, generating a HashResult
+    for each.  hashlib releases the GIL while hashing and the GIL is
+    not held during reads, so the threads keep disks and cores busy.
+
+    paths may be any iterable, including a generator walking a file
+    system: it is consumed only as fast as files are hashed.  No more
+    than max_pending files are in progress or waiting to be yielded at
+    any time, which bounds memory use.
+
+    @param paths         iterable of file paths
+    @param hashtype      HashTypes value
+    @param workers       number of threads; by default CPU count + 4,
+                         at most 32, since small files are I/O bound
+    @param ordered       if True, results come in the order of paths;
+                         otherwise in order of completion
+    @param max_pending   files in flight; by default 4 * workers
+    @param raise_errors  if True, an OSError is raised rather than
+                         returned in the result
+    """
+    cls = get_hash_class(hashtype)
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    if max_pending is None:
+        max_pending = 4 * workers
+    if workers < 1 or max_pending < 1:
+        raise XLCryptoError("workers and max_pending must be positive")
+    paths = iter(paths)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                for path in paths:
+                    pending.append(pool.submit(_hash_one, cls, path,
+                                               chunk_size, mmap_threshold))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                for future in done:
+                    result = future.result()
+                    if raise_errors and result.error is not None:
+                        raise result.error
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+# ===================================================================
+
+# DigestCache won't store digests of files modified this recently, as
+# a change within the timestamp granularity could go unnoticed
+RACY_NS = 2 * 10 ** 9
+
+
+class DigestCache(object):
+    """
+    A persistent cache of file digests, kept in an SQLite database and
+    keyed by file identity: device, inode, size, modification time in
+    nanoseconds, and hash type.  A file whose identity is unchanged is
+    not read again.
+
+    Entries are evicted least recently used first once there are more
+    than max_entries.  To keep lookups cheap, an entry's last-used time
+    is only rewritten when it is more than touch_interval seconds old.
+
+    Each thread has its own connection, and SQLite's locking makes the
+    cache safe to share between threads and processes.  The database
+    is in WAL mode and is not synced on every commit, so a crash may
+    lose the latest entries, but never yields a wrong digest.
+    """
+
+    def __init__(self, path, max_entries=1 << 20, touch_interval=60.0,
+                 timeout=30.0):
+        """
+        @param path            SQLite database file, created if absent
+        @param max_entries     number of entries kept
+        @param touch_interval  seconds between updates of last-used times
+        @param timeout         seconds to wait for a locked database
+        """
+        if max_entries < 1:
+            raise XLCryptoError("max_entries must be positive")
+        self._path = path
+        self._max_entries = int(max_entries)
+        self._touch_interval = touch_interval
+        self._timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()       # guards the fields below
+        self._conns = []
+        self._stores = 0
+        self.hits = 0
+        self.misses = 0
+        conn = self._conn()
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS digests (
+                                dev INTEGER NOT NULL,
+                                ino INTEGER NOT NULL,
+                                hashtype INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                mtime_ns INTEGER NOT NULL,
+                                digest BLOB NOT NULL,
+                                used REAL NOT NULL,
+                                PRIMARY KEY (dev, ino, hashtype))""")
+            conn.execute("""CREATE INDEX IF NOT EXISTS digests_used
+                                ON digests (used)""")
+
+    def _conn(self):
+        """ Return this thread's connection, opening it if need be. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=self._timeout,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            try:
+                self._lock.acquire()
+                self._conns.append(conn)
+            finally:
+                self._lock.release()
+        return conn
+
+    def __len__(self):
+        return self._conn().execute(
+            "SELECT count(*) FROM digests").fetchone()[0]
+
+    def lookup(self, path, hashtype=HashTypes.SHA2, stat=None):
+        """
+        Return the cached digest of the file at path, or None if there
+        is none for the file as it is now.
+
+        @param stat  optional os.stat() result for the file
+        """
+        if stat is None:
+            stat = os.stat(path)
+        conn = self._conn()
+        row = conn.execute(
+            """SELECT size, mtime_ns, digest, used FROM digests
+                WHERE dev = ? AND ino = ? AND hashtype = ?""",
+            (stat.st_dev, stat.st_ino, int(hashtype))).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, digest, used = row
+        key = (stat.st_dev, stat.st_ino, int(hashtype))
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            with conn:
+                conn.execute("""DELETE FROM digests
+                                 WHERE dev = ? AND ino = ? AND hashtype = ?""",
+                             key)
+            return None
+        now = time.time()
+        if now - used > self._touch_interval:
+            with conn:
+                conn.execute("""UPDATE digests SET used = ?
+                                 WHERE dev = ? AND ino = ? AND hashtype = ?""",
+                             (now, ) + key)
+        return digest
+
+    def store(self, path, digest, hashtype=HashTypes.SHA2, stat=None):
+        """
+        Cache the digest of the file at path, unless the file was
+        modified too recently for its timestamp to be trusted.
+
+        @return True if the digest was stored
+        """
+        if stat is None:
+            stat = os.stat(path)
+        if time.time() * 1e9 - stat.st_mtime_ns < RACY_NS:
+            return False
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO digests
+                    (dev, ino, hashtype, size, mtime_ns, digest, used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (stat.st_dev, stat.st_ino, int(hashtype), stat.st_size,
+                 stat.st_mtime_ns, bytes(digest), time.time()))
+        try:
+            self._lock.acquire()
+            self._stores += 1
+            check = self._stores % max(1, self._max_entries // 16) == 0
+        finally:
+            self._lock.release()
+        if check:
+            self.evict()
+        return True
+
+    def evict(self):
+        """ Drop least recently used entries beyond max_entries. """
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """DELETE FROM digests WHERE rowid IN (
+                       SELECT rowid FROM digests ORDER BY used
+                        LIMIT max(0, (SELECT count(*) FROM digests) - ?))""",
+                (self._max_entries, ))
+
+    def hash_file(self, path, hashtype=HashTypes.SHA2,
+                  chunk_size=HASH_CHUNK_SIZE,
+                  mmap_threshold=HASH_MMAP_THRESHOLD):
+        """
+        Return the binary digest of the file at path, from the cache if
+        the file is unchanged, otherwise by reading it and caching the
+        result.  See XLHash.hash_file().
+        """
+        stat = os.stat(path)
+        digest = self.lookup(path, hashtype, stat)
+        try:
+            self._lock.acquire()
+            if digest is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._lock.release()
+        if digest is not None:
+            return digest
+        digest = get_hash_class(hashtype).hash_file(path, chunk_size,
+                                                    mmap_threshold)
+        after = os.stat(path)
+        # don't cache what may be a mixture of old and new contents
+        if (after.st_size, after.st_mtime_ns) == (stat.st_size,
+                                                  stat.st_mtime_ns):
+            self.store(path, digest, hashtype, after)
+        return digest
+
+    def invalidate(self, path=None, hashtype=None):
+        """
+        Forget cached digests: those of the file at path, or all of
+        them if path is None; for one hash type, or all if hashtype is
+        None.
+        """
+        where, params = [], []
+        if path is not None:
+            stat = os.stat(path)
+            where.append("dev = ? AND ino = ?")
+            params.extend((stat.st_dev, stat.st_ino))
+        if hashtype is not None:
+            where.append("hashtype = ?")
+            params.append(int(hashtype))
+        sql = "DELETE FROM digests"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        conn = self._conn()
+        with conn:
+            conn.execute(sql, params)
+
+    def close(self):
+        """ Close every connection opened by the cache. """
+        try:
+            self._lock.acquire()
+            conns, self._conns = self._conns, []
+        finally:
+            self._lock.release()
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+# hashlib releases the GIL for updates of more than 2047 bytes, but
+# handing an update to another thread only pays for much larger ones
+MIN_THREAD_BYTES = 1 << 16
+
+
+class XLMultiHash(object):
+    """
+    Computes digests using several hash algorithms in a single pass
+    over the data: each chunk passed to update() is fed to every
+    algorithm selected.
+
+    If threads is True, large updates are fed to the algorithms in
+    parallel, one thread per algorithm, which hashlib permits as it
+    releases the GIL while hashing.  Call close() when done to release
+    the threads.
+    """
+
+    def __init__(self, hashtypes=None, data=b'', threads=False):
+        """
+        @param hashtypes  iterable of HashTypes values; all by default
+        @param data       optional bytes-like initial data
+        @param threads    whether to hash large updates in parallel
+        """
+        if hashtypes is None:
+            hashtypes = sorted(HASH_CLASSES)
+        self._hashes = []
+        for hashtype in hashtypes:
+            cls = get_hash_class(hashtype)
+            if any(isinstance(xlh, cls) for xlh in self._hashes):
+                raise XLCryptoError("hash type %s selected twice" % hashtype)
+            self._hashes.append(cls())
+        if not self._hashes:
+            raise XLCryptoError("no hash types selected")
+        self._pool = None
+        if threads and len(self._hashes) > 1:
+            self._pool = ThreadPoolExecutor(
+                max_workers=len(self._hashes) - 1)
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """ Add data to every internal hash. """
+        if self._pool is None or len(data) < MIN_THREAD_BYTES:
+            for xlh in self._hashes:
+                xlh.update(data)
+            return
+        # the data must not change until every thread is done with it
+        futures = [self._pool.submit(xlh.update, data)
+                   for xlh in self._hashes[1:]]
+        self._hashes[0].update(data)
+        for future in futures:
+            future.result()
+
+    def update_from(self, fileobj, chunk_size=HASH_CHUNK_SIZE):
+        """
+        Read a binary file object to the end, adding what is read to
+        every internal hash.  The file is read once, into one buffer.
+
+        @return the number of bytes read
+        """
+        if chunk_size < 1:
+            raise XLCryptoError("chunk_size must be positive")
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        total = 0
+        while True:
+            count = fileobj.readinto(buf)
+            if not count:
+                break
+            self.update(view[:count])
+            total += count
+        return total
+
+    def hash_names(self):
+        """ Return the names of the hashes selected, in order. """
+        return [xlh.hash_name() for xlh in self._hashes]
+
+    def digests(self):
+        """ Return a dict mapping hash_name() to binary digest. """
+        return dict((xlh.hash_name(), xlh.digest()) for xlh in self._hashes)
+
+    def hexdigests(self):
+        """ Return a dict mapping hash_name() to hex digest. """
+        return dict((xlh.hash_name(), xlh.hexdigest())
+                    for xlh in self._hashes)
+
+    def close(self):
+        """ Release the threads, if any.  Digests remain available. """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+# ===================================================================
+
+# BLAKE2 stores leaf_size in a 32-bit field
+MAX_LEAF_SIZE = (1 << 32) - 1
+
+# XLTreeHash domain separation for hashes without tree parameters
+TREE_LEAF_PREFIX = b'\x00'
+TREE_NODE_PREFIX = b'\x01'
+
+
+class XLTreeHash(object):
+    """
+    A Merkle tree hash: the data is split into leaves of leaf_size bytes,
+    which are hashed in parallel, and the leaf digests are combined
+    pairwise, level by level, into a single root digest.
+
+    For BLAKE2B each node is hashed with the BLAKE2 tree parameters:
+    fanout 2, unlimited depth, the leaf size, node offset and depth, and
+    last_node set on the last node of each level.  For the other hash
+    types a leaf is hashed with a 0x00 prefix and an interior node with
+    a 0x01 prefix, so that an interior node can't pass for a leaf.  A
+    node which is the last on its level and has no partner is hashed
+    alone to make its parent.  Empty data is a single empty leaf.
+
+    Leaf digests are kept, so a changed range can be re-verified by
+    rehashing only its leaves, and proof() gives the sibling digests
+    that show a leaf belongs under the root.
+
+    hashlib releases the GIL while hashing, so leaves are hashed in a
+    pool of threads.  Call close() when done to release them.
+    """
+
+    def __init__(self, hashtype=HashTypes.BLAKE2B, leaf_size=1 << 20,
+                 workers=None):
+        """
+        @param hashtype   HashTypes value
+        @param leaf_size  bytes in each leaf but the last
+        @param workers    threads hashing leaves; by default the CPU count
+        """
+        self._cls = get_hash_class(hashtype)
+        self._blake = hashtype == HashTypes.BLAKE2B
+        leaf_size = int(leaf_size)
+        if leaf_size < 1 or leaf_size > MAX_LEAF_SIZE:
+            raise XLCryptoError("leaf_size must be between 1 and %d" %
+                                MAX_LEAF_SIZE)
+        self._hashtype = hashtype
+        self._leaf_size = leaf_size
+        self._workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._leaves = []           # futures, oldest first, then digests
+        self._buf = bytearray()     # data not yet in a complete leaf
+
+    @property
+    def leaf_size(self):
+        """ Return the number of bytes in each leaf but the last. """
+        return self._leaf_size
+
+    def hash_name(self):
+        """ Return a name for the tree hash. """
+        return "tree_%s_%d" % (self._cls.hash_name(), self._leaf_size)
+
+    # HASHING NODES #################################################
+
+    def _hash_leaf(self, data, offset, last):
+        if self._blake:
+            return _blake2b(data, digest_size=BLAKE2B_BIN_LEN, fanout=2,
+                            depth=255, leaf_size=self._leaf_size,
+                            node_offset=offset, node_depth=0,
+                            inner_size=BLAKE2B_BIN_LEN,
+                            last_node=last).digest()
+        xlh = self._cls(TREE_LEAF_PREFIX)
+        xlh.update(data)
+        return xlh.digest()
+
+    def _hash_node(self, children, depth, offset, last):
+        if self._blake:
+            hasher = _blake2b(digest_size=BLAKE2B_BIN_LEN, fanout=2,
+                              depth=255, leaf_size=self._leaf_size,
+                              node_offset=offset, node_depth=depth,
+                              inner_size=BLAKE2B_BIN_LEN, last_node=last)
+        else:
+            hasher = self._cls(TREE_NODE_PREFIX)
+        for child in children:
+            hasher.update(child)
+        return hasher.digest()
+
+    def _parent_level(self, level, depth):
+        """ Combine the digests on one level into the level above. """
+        last = (len(level) - 1) // 2
+        return [self._hash_node(level[ndx:ndx + 2], depth, ndx // 2,
+                                ndx // 2 == last)
+                for ndx in range(0, len(level), 2)]
+
+    # ADDING DATA ###################################################
+
+    def _submit(self, data, offset):
+        """ Hash a complete leaf which is known not to be the last. """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._workers)
+        # bound the data held by leaves waiting for a thread
+        waiting = [leaf for leaf in self._leaves[-2 * self._workers:]
+                   if not isinstance(leaf, bytes)]
+        if len(waiting) >= 2 * self._workers:
+            waiting[0].result()
+        self._leaves.append(self._pool.submit(self._hash_leaf, data,
+                                              offset, False))
+
+    def update(self, data):
+        """
+        Add data.  A leaf is only hashed once data beyond it arrives,
+        as the last leaf is hashed differently.
+        """
+        self._buf += data
+        leaf_size = self._leaf_size
+        if len(self._buf) > leaf_size:
+            usable = (len(self._buf) - 1) // leaf_size * leaf_size
+            for start in range(0, usable, leaf_size):
+                self._submit(bytes(self._buf[start:start + leaf_size]),
+                             len(self._leaves))
+            del self._buf[:usable]
+
+    def leaf_digests(self):
+        """ Return the list of leaf digests, including the last leaf. """
+        leaves = self._leaves
+        for ndx, leaf in enumerate(leaves):
+            if not isinstance(leaf, bytes):
+                leaves[ndx] = leaf.result()
+        return leaves + [self._hash_leaf(bytes(self._buf), len(leaves),
+                                         True)]
+
+    def levels(self):
+        """ Return the tree as a list of levels, leaves first, root last. """
+        levels = [self.leaf_digests()]
+        while len(levels[-1]) > 1:
+            levels.append(self._parent_level(levels[-1], len(levels)))
+        return levels
+
+    def digest(self):
+        """
+        Return the root digest.  More data may be added afterwards.
+        """
+        return self.levels()[-1][0]
+
+    def hexdigest(self):
+        """ Return the root digest in hex. """
+        return self.digest().hex()
+
+    def digest_size(self):
+        """ Return digest size in bytes, an integer value. """
+        return len(self._cls().digest())
+
+    # PROOFS ########################################################
+
+    def proof(self, index):
+        """
+        Return the digests needed to prove that leaf index belongs
+        under the root: for each level from the leaves up, the digest
+        of the node's partner, or None if it has none.
+        """
+        levels = self.levels()
+        if index < 0 or index >= len(levels[0]):
+            raise IndexError("no leaf %d" % index)
+        path = []
+        for level in levels[:-1]:
+            partner = index ^ 1
+            path.append(level[partner] if partner < len(level) else None)
+            index >>= 1
+        return path
+
+    def verify_leaf(self, data, index, leaf_count, proof, root):
+        """
+        Check that data is leaf index of a tree of leaf_count leaves
+        with the root given, using a proof from proof().  The tree
+        hashing the data need not be this one, but must have the same
+        hash type and leaf size.
+        """
+        if index < 0 or index >= leaf_count:
+            return False
+        node = self._hash_leaf(data, index, index == leaf_count - 1)
+        width = leaf_count
+        for depth, partner in enumerate(proof, 1):
+            if width <= 1:
+                return False
+            if (partner is None) != ((index ^ 1) >= width):
+                return False
+            pair = [node] if partner is None else (
+                [partner, node] if index & 1 else [node, partner])
+            index >>= 1
+            width = (width + 1) // 2
+            node = self._hash_node(pair, depth, index, index == width - 1)
+        return width == 1 and hmac.compare_digest(node, root)
+
+    # FILES #########################################################
+
+    @classmethod
+    def hash_file(cls, path, hashtype=HashTypes.BLAKE2B, leaf_size=1 << 20,
+                  workers=None):
+        """
+        Return an XLTreeHash of the file at path, mapped into memory so
+        that leaves are hashed in parallel without copying.
+        """
+        tree = cls(hashtype, leaf_size, workers)
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size <= leaf_size:
+                tree.update(file.read())
+                return tree
+            with mmap.mmap(file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    tail = (size - 1) // leaf_size * leaf_size
+                    with ThreadPoolExecutor(
+                            max_workers=tree._workers) as pool:
+                        futures = [
+                            pool.submit(tree._hash_leaf,
+                                        view[start:start + leaf_size],
+                                        start // leaf_size, False)
+                            for start in range(0, tail, leaf_size)]
+                        tree._leaves = [future.result()
+                                        for future in futures]
+                    tree._buf = bytearray(view[tail:])
+                finally:
+                    view.release()
+        return tree
+
+    def close(self):
+        """ Release the threads, if any.  Digests remain available. """
+        if self._pool is not None:
+            self.leaf_digests()
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+# ===================================================================
+
+# updates smaller than this are cheaper inline than in a thread
+ASYNC_INLINE_BYTES = 1 << 16
+
+# asyncio.get_running_loop() is new in Python 3.7
+_running_loop = getattr(asyncio, 'get_running_loop',
+                        asyncio.get_event_loop)
+
+
+class AsyncHasher(object):
+    """
+    Hashes for asyncio code without blocking the event loop.  Updates
+    of at least threshold bytes are run in a thread pool, where hashlib
+    releases the GIL, so several hashes proceed in parallel while the
+    loop goes on serving; smaller updates are run inline, as handing
+    them to a thread costs more than hashing them.  Files are always
+    read in the pool.
+
+    A semaphore limits the number of updates in the pool at any time,
+    so that a burst of large requests cannot queue up unbounded work.
+    It is created on first use, and a hasher must only be used from
+    one event loop.
+    """
+
+    def __init__(self, max_concurrency=None, threshold=ASYNC_INLINE_BYTES,
+                 executor=None, chunk_size=HASH_CHUNK_SIZE):
+        """
+        @param max_concurrency  updates run at once; defaults to CPU count
+        @param threshold        smallest update run in the pool
+        @param executor         concurrent.futures executor; by default
+                                the event loop's
+        @param chunk_size       bytes read from files at a time
+        """
+        if max_concurrency is None:
+            max_concurrency = os.cpu_count() or 1
+        if max_concurrency < 1:
+            raise XLCryptoError("max_concurrency must be positive")
+        self._max_concurrency = max_concurrency
+        self._threshold = threshold
+        self._executor = executor
+        self._chunk_size = chunk_size
+        self._sem = None
+
+    @property
+    def max_concurrency(self):
+        """ Return the number of updates which may be run at once. """
+        return self._max_concurrency
+
+    @property
+    def threshold(self):
+        """ Return the size of the smallest update run in the pool. """
+        return self._threshold
+
+    async def _run(self, func, *args):
+        """ Run func(*args) in the pool once the semaphore allows. """
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self._max_concurrency)
+        async with self._sem:
+            return await _running_loop().run_in_executor(
+                self._executor, func, *args)
+
+    async def update(self, xlh, data):
+        """ Add data to an XLHash, in the pool if it is large. """
+        if len(data) < self._threshold:
+            xlh.update(data)
+        else:
+            await self._run(xlh.update, data)
+
+    async def hash_bytes(self, data, hashtype=HashTypes.SHA2):
+        """ Return the binary digest of a bytes-like object. """
+        cls = get_hash_class(hashtype)
+        if len(data) < self._threshold:
+            xlh = cls()
+            xlh.update(data)
+            return xlh.digest()
+        return await self._run(_digest_bytes, cls, data)
+
+    async def hash_file(self, path, hashtype=HashTypes.SHA2,
+                        mmap_threshold=HASH_MMAP_THRESHOLD):
+        """ Return the binary digest of the file at path. """
+        return await self._run(get_hash_class(hashtype).hash_file, path,
+                               self._chunk_size, mmap_threshold)
+
+    async def hash_stream(self, stream, hashtype=HashTypes.SHA2):
+        """
+        Return the binary digest of the chunks of bytes yielded by an
+        async iterable, such as a request body.  Small chunks are
+        gathered until there are threshold bytes to hash, and the next
+        chunk is awaited while the last is hashed.
+        """
+        threshold = self._threshold
+        xlh = get_hash_class(hashtype)()
+        buf = bytearray()
+        pending = None
+        async for chunk in stream:
+            if buf or len(chunk) < threshold:
+                buf += chunk
+                if len(buf) < threshold:
+                    continue
+                data, buf = buf, bytearray()
+            else:
+                data = chunk
+            if pending is not None:
+                await pending
+            pending = asyncio.ensure_future(self._run(xlh.update, data))
+        if pending is not None:
+            await pending
+        xlh.update(buf)
+        return xlh.digest()
+
+
+def _digest_bytes(cls, data):
+    xlh = cls()
+    xlh.update(data)
+    return xlh.digest()
+
+
+# the AsyncHasher used by the module functions, one per event loop
+_ASYNC_HASHERS = weakref.WeakKeyDictionary()
+
+
+def _async_hasher():
+    loop = _running_loop()
+    hasher = _ASYNC_HASHERS.get(loop)
+    if hasher is None:
+        hasher = _ASYNC_HASHERS[loop] = AsyncHasher()
+    return hasher
+
+
+async def ahash_bytes(data, hashtype=HashTypes.SHA2):
+    """
+    Return the binary digest of a bytes-like object without blocking
+    the event loop; see AsyncHasher.
+    """
+    return await _async_hasher().hash_bytes(data, hashtype)
+
+
+async def ahash_file(path, hashtype=HashTypes.SHA2):
+    """
+    Return the binary digest of the file at path without blocking the
+    event loop; see AsyncHasher.
+    """
+    return await _async_hasher().hash_file(path, hashtype)
+
+
+async def ahash_stream(stream, hashtype=HashTypes.SHA2):
+    """
+    Return the binary digest of the chunks of bytes yielded by an async
+    iterable without blocking the event loop; see AsyncHasher.
+    """
+    return await _async_hasher().hash_stream(stream, hashtype)
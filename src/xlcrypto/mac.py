@@ -0,0 +1,150 @@
+# xlcrypto_py/src/xlcrypto/mac.py
+
+"""
+Message authentication codes over the XLHash algorithms: HMAC (RFC 2104)
+for SHA1, SHA2, and SHA3, and blake2b's own keyed mode for BLAKE2B.
+
+Setting up HMAC for a key costs two compression calls, as much as the
+MAC of a short message.  A MAC object does this once per key, caching
+the keyed hash states and copying them for each message.  Copying a
+standard library HMAC copies both states in C, which is faster than
+any arrangement of XLHash objects, so HMACs are built on the hashlib
+function of the XLHash class.
+"""
+
+import hmac
+import threading
+from collections import OrderedDict
+
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import XLBLAKE2B_256, get_hash_class
+
+__all__ = ['MAC', 'MAX_BLAKE2B_KEY_BYTES']
+
+# the longest key blake2b accepts
+MAX_BLAKE2B_KEY_BYTES = 64
+
+
+class _HMACState(object):
+    """ An HMAC with its inner and outer hash states keyed. """
+
+    def __init__(self, cls, key):
+        self._template = hmac.new(key, digestmod=cls.lib_func())
+
+    def mac(self, msg):
+        mac = self._template.copy()
+        mac.update(msg)
+        return mac.digest()
+
+
+class _Blake2State(object):
+    """ A keyed blake2b hash state. """
+
+    def __init__(self, key):
+        if len(key) > MAX_BLAKE2B_KEY_BYTES:
+            raise XLCryptoError("blake2b key may not exceed %d bytes" %
+                                MAX_BLAKE2B_KEY_BYTES)
+        self._template = XLBLAKE2B_256(key=key)
+
+    def mac(self, msg):
+        xlh = self._template.copy()
+        xlh.update(msg)
+        return xlh.digest()
+
+
+class MAC(object):
+    """
+    Computes and verifies MACs with one hash algorithm for any number
+    of keys.  The keyed states of the max_keys keys most recently used
+    are kept, the least recently used being dropped to make room.
+
+    Tags are checked with hmac.compare_digest(), in time independent of
+    where they differ.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, hashtype=HashTypes.SHA2, max_keys=1024):
+        """
+        @param hashtype  HashTypes value; BLAKE2B uses keyed blake2b
+        @param max_keys  number of keyed states cached
+        """
+        if max_keys < 1:
+            raise XLCryptoError("max_keys must be positive")
+        self._cls = get_hash_class(hashtype)
+        self._hashtype = hashtype
+        self._max_keys = max_keys
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hashtype(self):
+        """ Return the HashTypes value of the algorithm used. """
+        return self._hashtype
+
+    def __len__(self):
+        """ Return the number of keys whose states are cached. """
+        return len(self._states)
+
+    def clear(self):
+        """ Drop every cached keyed state. """
+        try:
+            self._lock.acquire()
+            self._states.clear()
+        finally:
+            self._lock.release()
+
+    def _state(self, key):
+        """ Return the keyed state for a key, creating it if need be. """
+        key = bytes(key)
+        try:
+            self._lock.acquire()
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+                return state
+        finally:
+            self._lock.release()
+        # the states never change, so a duplicate built by a racing
+        # thread does no harm
+        if self._hashtype == HashTypes.BLAKE2B:
+            state = _Blake2State(key)
+        else:
+            state = _HMACState(self._cls, key)
+        try:
+            self._lock.acquire()
+            self._states[key] = state
+            if len(self._states) > self._max_keys:
+                self._states.popitem(last=False)
+        finally:
+            self._lock.release()
+        return state
+
+    def mac(self, key, msg):
+        """ Return the binary MAC of a bytes-like message. """
+        return self._state(key).mac(msg)
+
+    def verify(self, key, msg, tag):
+        """ Whether tag is the MAC of the message. """
+        return hmac.compare_digest(self._state(key).mac(msg), tag)
+
+    def mac_many(self, key, msgs):
+        """ Return the list of MACs of a batch of messages. """
+        mac = self._state(key).mac
+        return [mac(msg) for msg in msgs]
+
+    def verify_many(self, key, msgs, tags):
+        """
+        Check a batch of messages against their tags, every one being
+        checked whatever the outcome for the others.
+
+        @return list of booleans, True where the tag is correct
+        """
+        mac = self._state(key).mac
+        compare = hmac.compare_digest
+        msgs, tags = list(msgs), list(tags)
+        if len(msgs) != len(tags):
+            raise XLCryptoError("%d messages but %d tags" % (
+                len(msgs), len(tags)))
+        return [compare(mac(msg), tag) for msg, tag in zip(msgs, tags)]
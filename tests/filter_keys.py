@@ -0,0 +1,38 @@
+# xlcrypto_py/filter_keys.py
+
+""" Keys shared by the filter tests. """
+
+import time
+from hashlib import sha1, sha256
+
+from rnglib import SimpleRNG
+
+RNG = SimpleRNG(time.time())
+
+
+def make_keys(count, key_bytes=20):
+    """
+    Return a list of count distinct quasi-random keys, each key_bytes
+    long.  Filters take offsets from the low-order bits of the key, so
+    every byte is random; duplicates are simply drawn again.
+    """
+    keys, seen = [], set()
+    while len(keys) < count:
+        key = bytes(RNG.some_bytes(key_bytes))
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys
+
+
+def make_digest_keys(count, key_bytes=20, salt=None):
+    """
+    Return a list of count distinct SHA digests, SHA1 if key_bytes is
+    20 and SHA256 otherwise.  With a fixed salt the keys are the same
+    on every run.
+    """
+    hash_func = sha1 if key_bytes == 20 else sha256
+    if salt is None:
+        salt = bytes(RNG.some_bytes(16))
+    return [hash_func(salt + i.to_bytes(4, 'little')).digest()
+            for i in range(count)]
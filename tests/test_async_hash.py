@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_async_hash.py
+
+""" Test hashing from asyncio code. """
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import (AsyncHasher, ahash_bytes, ahash_file,
+                           ahash_stream)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """ A thread pool recording how many tasks ever ran at once. """
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+        self.tasks = 0
+
+    def submit(self, func, *args, **kwargs):
+        def wrapped():
+            with self.lock:
+                self.running += 1
+                self.tasks += 1
+                self.most = max(self.most, self.running)
+            try:
+                time.sleep(0.01)
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+        return super().submit(wrapped)
+
+
+async def chunks(data, size):
+    """ Yield data size bytes at a time, as a network body would. """
+    for ndx in range(0, len(data), size):
+        await asyncio.sleep(0)
+        yield data[ndx:ndx + size]
+
+
+class TestAsyncHash(unittest.TestCase):
+    """ Test hashing from asyncio code. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_digests(self):
+        """ Every entry point gives the hashlib digest, at any size. """
+        data = bytes(self.rng.some_bytes(300000))
+        expected = hashlib.sha256(data).digest()
+        for size in (0, 100, 70000, len(data)):
+            self.assertEqual(self.run_async(ahash_bytes(data[:size])),
+                             hashlib.sha256(data[:size]).digest())
+        self.assertEqual(
+            self.run_async(ahash_bytes(data, HashTypes.SHA1)),
+            hashlib.sha1(data).digest())
+        for size in (1, 1000, 40000, 100000, 400000):
+            self.assertEqual(
+                self.run_async(ahash_stream(chunks(data, size))), expected)
+
+        tmp = tempfile.mkdtemp(prefix='xlahash')
+        try:
+            path = os.path.join(tmp, 'data')
+            with open(path, 'wb') as file:
+                file.write(data)
+            self.assertEqual(self.run_async(ahash_file(path)), expected)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_threshold_and_limit(self):
+        """ Small updates stay inline; large ones share a bounded pool. """
+        pool = CountingExecutor(8)
+        try:
+            hasher = AsyncHasher(max_concurrency=2, threshold=1000,
+                                 executor=pool)
+            small = [bytes(self.rng.some_bytes(100)) for _ in range(10)]
+            large = [bytes(self.rng.some_bytes(5000)) for _ in range(10)]
+
+            async def hash_all(items):
+                return await asyncio.gather(
+                    *[hasher.hash_bytes(item) for item in items])
+
+            self.assertEqual(
+                self.run_async(hash_all(small)),
+                [hashlib.sha256(item).digest() for item in small])
+            self.assertEqual(pool.tasks, 0)
+            self.assertEqual(
+                self.run_async(hash_all(large)),
+                [hashlib.sha256(item).digest() for item in large])
+            self.assertEqual(pool.tasks, 10)
+            self.assertEqual(pool.most, 2)
+        finally:
+            pool.shutdown()
+        self.assertRaises(XLCryptoError, AsyncHasher, 0)
+
+    def test_loop_responsive(self):
+        """ The event loop keeps running while a large body is hashed. """
+        data = bytes(32 << 20)
+        ticks = []
+
+        async def ticker(done):
+            while not done.is_set():
+                ticks.append(time.time())
+                await asyncio.sleep(0.001)
+
+        async def main():
+            done = asyncio.Event()
+            tick_task = asyncio.ensure_future(ticker(done))
+            await asyncio.sleep(0)
+            digest = await ahash_bytes(data)
+            done.set()
+            await tick_task
+            return digest
+
+        self.assertEqual(self.run_async(main()),
+                         hashlib.sha256(data).digest())
+        self.assertTrue(len(ticks) > 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_bloom_bank.py
+
+""" Exercise banks of bit-sliced Bloom filters. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector
+from xlcrypto.filters.bank import BloomBank
+
+
+class TestBloomBank(unittest.TestCase):
+    """ Exercise banks of bit-sliced Bloom filters. """
+
+    def test_param_exceptions(self):
+        """ Unacceptable constructor parameters are caught. """
+        for args in [(0,), (4, 0), (4, 16, 0), (4, 16, 8, 0)]:
+            try:
+                BloomBank(*args)
+                self.fail("accepted parameters %s" % (args,))
+            except XLFilterError:
+                pass
+        bank = BloomBank(3, 16, 8, 20)
+        try:
+            bank.insert(3, KeySelector(make_keys(1)[0], bank))
+            self.fail("accepted out of range filter index")
+        except XLFilterError:
+            pass
+        try:
+            bank.load(0, BloomSHA(17, 8, 20))
+            self.fail("loaded filter of different geometry")
+        except XLFilterError:
+            pass
+
+    def test_selector_geometry(self):
+        """ Selectors built for another geometry are rejected. """
+        bank = BloomBank(3, 10, 4, 20)
+        key = make_keys(1)[0]
+        for other in (BloomSHA(12, 4, 20), BloomSHA(10, 3, 20)):
+            keysel = KeySelector(key, other)
+            self.assertRaises(XLFilterError, bank.insert, 0, keysel)
+            self.assertRaises(XLFilterError, bank.query, keysel)
+            self.assertRaises(XLFilterError, bank.query_many, [keysel])
+        self.assertEqual(bank.query(KeySelector(key, bank)), 0)
+
+    def test_bank(self):
+        """ The bank answers as its filters would, all at once. """
+        count, m, k = 37, 14, 6
+        filters = []
+        keys = []
+        for ndx in range(count):
+            cls = WordBloomSHA if ndx % 2 else BloomSHA
+            fltr = cls(m, k, 20)
+            fltr_keys = make_keys(10 + ndx)
+            fltr.insert_many([KeySelector(key, fltr) for key in fltr_keys])
+            filters.append(fltr)
+            keys.append(fltr_keys)
+
+        bank = BloomBank.from_filters(filters)
+        self.assertEqual(bank.count, count)
+        probes = [key for fltr_keys in keys for key in fltr_keys] + \
+            make_keys(100)
+        keysels = [KeySelector(key, bank) for key in probes]
+        masks = bank.query_many(keysels)
+        for ndx, keysel in enumerate(keysels):
+            expected = 0
+            for fndx, fltr in enumerate(filters):
+                if fltr.is_member(keysel):
+                    expected |= 1 << fndx
+            self.assertEqual(masks[ndx], expected)
+            self.assertEqual(bank.query(keysel), expected)
+        self.assertTrue(5 in bank.holders(KeySelector(keys[5][0], bank)))
+
+        for ndx, fltr in enumerate(filters):
+            copy = bank.extract(ndx)
+            self.assertTrue(copy == fltr)
+            self.assertEqual(len(copy), len(fltr))
+            self.assertEqual(bank.key_count(ndx), len(fltr))
+
+    def test_insert_and_clear(self):
+        """ Keys may be added to and cleared from individual filters. """
+        bank = BloomBank(9, 16, 8, 20)
+        keys = make_keys(50)
+        for key in keys:
+            bank.insert(8, KeySelector(key, bank))
+        for key in keys:
+            self.assertEqual(bank.query(KeySelector(key, bank)), 1 << 8)
+        self.assertEqual(bank.key_count(8), 50)
+        bank.clear_filter(8)
+        for key in keys:
+            self.assertEqual(bank.query(KeySelector(key, bank)), 0)
+        self.assertEqual(bank.extract(8).popcount(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_bloom_batch.py
+
+""" Exercise the batch insert and query paths of BloomSHA filters. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (BloomSHA, WordBloomSHA, CountingBloom,
+                              KeySelector)
+
+
+class TestBloomBatch(unittest.TestCase):
+    """ Exercise the batch insert and query paths of BloomSHA filters. """
+
+    def do_test_batch(self, cls, m, k, sort):
+        """ Batch paths agree with the single-key paths. """
+        keys = make_keys(512)
+        absent = make_keys(512)
+        single = cls(m, k, 20)
+        batch = cls(m, k, 20)
+        for key in keys:
+            single.insert(KeySelector(key, single))
+        count = batch.insert_many(
+            [KeySelector(key, batch) for key in keys], sort=sort)
+        self.assertEqual(count, len(keys))
+        self.assertEqual(len(batch), len(keys))
+        self.assertTrue(single == batch)
+
+        # interleave present and absent keys; order must be preserved
+        probe_keys = []
+        for ndx in range(len(keys)):
+            probe_keys.append(keys[ndx])
+            probe_keys.append(absent[ndx])
+        keysels = [KeySelector(key, batch) for key in probe_keys]
+        results = batch.is_member_many(keysels, sort=sort)
+        self.assertEqual(len(results), len(probe_keys))
+        for ndx, keysel in enumerate(keysels):
+            self.assertEqual(results[ndx], single.is_member(keysel))
+            if ndx % 2 == 0:
+                self.assertTrue(results[ndx])
+
+    def test_batch(self):
+        """ Test both storage engines, sorted and unsorted. """
+        for cls in (BloomSHA, WordBloomSHA, CountingBloom):
+            for sort in (False, True):
+                self.do_test_batch(cls, 20, 8, sort)
+                self.do_test_batch(cls, 12, 8, sort)     # many collisions
+
+    def test_counting_batch(self):
+        """ Keys inserted in a batch into a CountingBloom can be removed. """
+        for sort in (False, True):
+            fltr = CountingBloom(16, 8, 20)
+            keys = make_keys(64)
+            fltr.insert_many([KeySelector(key, fltr) for key in keys], sort)
+            for key in keys:
+                fltr.remove(KeySelector(key, fltr))
+            self.assertEqual(len(fltr), 0)
+            self.assertEqual(fltr.popcount(), 0)
+
+    def test_empty_and_none(self):
+        """ Empty batches are harmless; None selectors are rejected. """
+        fltr = BloomSHA(16, 8, 20)
+        self.assertEqual(fltr.insert_many([], sort=True), 0)
+        self.assertEqual(fltr.is_member_many([], sort=True), [])
+        try:
+            fltr.insert_many([None])
+            self.fail("accepted None KeySelector")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_bloom_cli.py
+
+""" Exercise the xlcrypto-bloom command line tool. """
+
+import base64
+import binascii
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, KeySelector
+from xlcrypto.filters.cli import main, read_keys
+
+
+class TestBloomCLI(unittest.TestCase):
+    """ Exercise the xlcrypto-bloom command line tool. """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='xlcli')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        """ Write a file in the test directory, returning its path. """
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def run_main(self, *argv):
+        """ Run the tool, returning (exit status, stdout). """
+        out = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(io.StringIO()):
+            status = main(list(argv))
+        return status, out.getvalue()
+
+    def test_read_keys(self):
+        """ Each input format decodes to the same keys, chunk sizes aside. """
+        for key_bytes in (20, 24):
+            keys = make_keys(500, key_bytes)
+            hex_path = self.write('keys.hex', b'\n'.join(
+                binascii.hexlify(key) for key in keys) + b'\n')
+            b64_path = self.write('keys.b64', b' \r\n'.join(
+                base64.b64encode(key) for key in keys))
+            raw_path = self.write('keys.raw', b''.join(keys))
+            for fmt, path in (('hex', hex_path), ('base64', b64_path),
+                              ('raw', raw_path)):
+                for chunk_bytes in (77, 1 << 20):
+                    got = []
+                    for batch in read_keys([path], fmt, key_bytes,
+                                           chunk_bytes):
+                        got.extend(batch)
+                    self.assertEqual(got, keys)
+
+        bad = self.write('bad.hex', b'00' * 20 + b'\n' + b'zz' * 20 + b'\n')
+        try:
+            list(read_keys([bad], 'hex', 20))
+            self.fail("accepted bad hex")
+        except XLFilterError:
+            pass
+        # token lengths that are wrong one by one but right in total
+        mixed = self.write('mixed.hex', b'00' * 19 + b'\n' + b'00' * 21 +
+                           b'\n')
+        try:
+            list(read_keys([mixed], 'hex', 20))
+            self.fail("accepted hex tokens of mixed lengths")
+        except XLFilterError:
+            pass
+        mixed = self.write('mixed.b64', base64.b64encode(bytes(18)) + b' ' +
+                           base64.b64encode(bytes(24)) + b'\n')
+        try:
+            list(read_keys([mixed], 'base64', 21))
+            self.fail("accepted base64 tokens of mixed lengths")
+        except XLFilterError:
+            pass
+        short = self.write('short.raw', bytes(30))
+        try:
+            list(read_keys([short], 'raw', 20))
+            self.fail("accepted partial raw digest")
+        except XLFilterError:
+            pass
+
+    def test_build_query_merge(self):
+        """ Build two filters, query them, merge them, and describe them. """
+        keys = make_keys(400)
+        left_in = self.write('left.hex', b'\n'.join(
+            binascii.hexlify(key) for key in keys[:200]))
+        right_in = self.write('right.raw', b''.join(keys[200:]))
+        left = os.path.join(self.dir, 'left.bf')
+        right = os.path.join(self.dir, 'right.bf')
+        merged = os.path.join(self.dir, 'merged.bf')
+
+        self.assertEqual(self.run_main('build', '-o', left, '-m', '16',
+                                       left_in)[0], 0)
+        self.assertEqual(self.run_main('build', '-o', right, '-m', '16',
+                                       '-w', '-f', 'raw', right_in)[0], 0)
+        self.assertEqual(self.run_main('merge', '-o', merged, left,
+                                       right)[0], 0)
+        with open(merged, 'rb') as file:
+            fltr = BloomSHA.from_bytes(file.read())
+        self.assertEqual(len(fltr), 400)
+        for key in keys:
+            self.assertTrue(fltr.is_member(KeySelector(key, fltr)))
+
+        all_in = self.write('all.hex', b'\n'.join(
+            binascii.hexlify(key) for key in keys))
+        status, out = self.run_main('query', left, all_in)
+        self.assertEqual(status, 0)
+        found = set(out.split())
+        for key in keys[:200]:
+            self.assertTrue(binascii.hexlify(key).decode() in found)
+        status, out = self.run_main('query', '--absent', left, all_in)
+        self.assertEqual(len(found) + len(out.split()), 400)
+
+        status, out = self.run_main('stats', merged)
+        self.assertEqual(status, 0)
+        self.assertTrue('keys       400' in out)
+
+        # errors are reported, not raised
+        status, _ = self.run_main('query', '-b', '32', left, all_in)
+        self.assertEqual(status, 1)
+        status, _ = self.run_main('stats', all_in)
+        self.assertEqual(status, 1)
+
+        # a failed write leaves no temporary file behind
+        target = os.path.join(self.dir, 'adir')
+        os.mkdir(target)                # can't be replaced by a file
+        status, _ = self.run_main('build', '-o', target, all_in)
+        self.assertEqual(status, 1)
+        self.assertFalse(os.path.exists(target + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
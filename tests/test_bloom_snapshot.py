@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_bloom_snapshot.py
+
+""" Exercise read-only point-in-time snapshots of BloomSHA filters. """
+
+import unittest
+from threading import Thread
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (BloomSHA, WordBloomSHA, CountingBloom,
+                              KeySelector)
+
+
+class TestBloomSnapshot(unittest.TestCase):
+    """ Exercise read-only point-in-time snapshots of BloomSHA filters. """
+
+    def do_test_point_in_time(self, cls):
+        """ A snapshot does not see keys inserted after it was taken. """
+        fltr = cls(20, 8, 20)
+        old_keys = make_keys(64)
+        new_keys = make_keys(64)
+        for key in old_keys:
+            fltr.insert(KeySelector(key, fltr))
+        before = fltr.to_bytes()
+
+        snap = fltr.snapshot()
+        self.assertEqual(len(snap), 64)
+        self.assertEqual((snap.m, snap.k, snap.key_bytes), (20, 8, 20))
+        for key in new_keys:
+            fltr.insert(KeySelector(key, fltr))
+        self.assertEqual(len(fltr), 128)
+        self.assertEqual(len(snap), 64)
+
+        for key in old_keys:
+            self.assertTrue(snap.is_member(KeySelector(key, fltr)))
+        for key in new_keys:
+            keysel = KeySelector(key, fltr)
+            self.assertTrue(fltr.is_member(keysel))
+            self.assertFalse(snap.is_member(keysel))
+        self.assertEqual(snap.to_bytes(), before)
+
+        # the snapshot survives the filter being cleared
+        fltr.clear()
+        self.assertEqual(snap.to_bytes(), before)
+        copy = BloomSHA.from_bytes(snap.to_bytes())
+        self.assertEqual(len(copy), 64)
+
+        snap.release()
+        self.assertEqual(len(fltr._views), 0)
+        try:
+            snap.is_member(KeySelector(old_keys[0], fltr))
+            self.fail("released snapshot is still usable")
+        except XLFilterError:
+            pass
+
+    def test_point_in_time(self):
+        """ Snapshots of either storage engine are point-in-time views. """
+        self.do_test_point_in_time(BloomSHA)
+        self.do_test_point_in_time(WordBloomSHA)
+
+    def test_counting_remove(self):
+        """ Removing keys from a CountingBloom leaves snapshots intact. """
+        fltr = CountingBloom(16, 8, 20)
+        keys = make_keys(32)
+        for key in keys:
+            fltr.insert(KeySelector(key, fltr))
+        with fltr.snapshot() as snap:
+            for key in keys:
+                fltr.remove(KeySelector(key, fltr))
+            self.assertEqual(len(fltr), 0)
+            self.assertEqual(fltr.popcount(), 0)
+            for key in keys:
+                self.assertTrue(snap.is_member(KeySelector(key, fltr)))
+        self.assertEqual(len(fltr._views), 0)
+
+    def test_concurrent_writer(self):
+        """ Readers see a stable view while another thread inserts. """
+        fltr = BloomSHA(18, 8, 20)
+        old_keys = make_keys(256)
+        new_keys = make_keys(2048)
+        for key in old_keys:
+            fltr.insert(KeySelector(key, fltr))
+        snap = fltr.snapshot()
+        expected = snap.to_bytes()
+
+        def writer():
+            for key in new_keys:
+                fltr.insert(KeySelector(key, fltr))
+
+        thread = Thread(target=writer)
+        thread.start()
+        while thread.is_alive():
+            for key in old_keys[:16]:
+                self.assertTrue(snap.is_member(KeySelector(key, fltr)))
+            self.assertEqual(snap.to_bytes(), expected)
+        thread.join()
+        self.assertEqual(snap.to_bytes(), expected)
+        self.assertEqual(len(fltr), 256 + 2048)
+
+    def test_release(self):
+        """ Every use of a released snapshot raises XLFilterError. """
+        fltr = WordBloomSHA(16, 8, 20)
+        keys = make_keys(64)
+        for key in keys:
+            fltr.insert(KeySelector(key, fltr))
+        snap = fltr.snapshot()
+        chunks = snap.pages()
+        next(chunks)
+        snap.release()
+        snap.release()                      # harmless
+        keysel = KeySelector(keys[0], fltr)
+        for func in [lambda: snap.is_member(keysel), snap.to_bytes,
+                     lambda: next(chunks), lambda: len(snap),
+                     snap.false_positives, lambda: snap.m,
+                     lambda: snap.k, lambda: snap.key_bytes,
+                     lambda: snap.capacity]:
+            try:
+                func()
+                self.fail("released snapshot is still usable")
+            except XLFilterError as exc:
+                self.assertEqual(str(exc), "snapshot released")
+
+    def test_release_while_reading(self):
+        """ Releasing a snapshot that others are reading is safe. """
+        fltr = BloomSHA(18, 8, 20)
+        keys = make_keys(256)
+        for key in keys:
+            fltr.insert(KeySelector(key, fltr))
+        keysels = [KeySelector(key, fltr) for key in keys]
+        errors = []
+
+        def reader(snap):
+            try:
+                while True:
+                    for keysel in keysels:
+                        if not snap.is_member(keysel):
+                            errors.append("key lost")
+            except XLFilterError:
+                pass
+            except Exception as exc:        # pylint: disable=broad-except
+                errors.append(exc)
+
+        for _ in range(8):
+            snap = fltr.snapshot()
+            threads = [Thread(target=reader, args=(snap,))
+                       for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            fltr.insert(KeySelector(make_keys(1)[0], fltr))
+            snap.release()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(fltr._views), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_bloom_wal.py
+
+""" Exercise the write-ahead log and checkpoints of DurableCountingBloom. """
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import CountingBloom, KeySelector
+from xlcrypto.filters.wal import DurableCountingBloom, CHECKPOINT_TRAILER
+
+
+class TestBloomWAL(unittest.TestCase):
+    """
+    Exercise the write-ahead log and checkpoints of DurableCountingBloom.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='xlwal')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def open(self, **kwargs):
+        """ Open the test directory with a small filter. """
+        kwargs.setdefault('checkpoint_interval', None)
+        return DurableCountingBloom(self.path, 16, 8, 20, **kwargs)
+
+    def crash(self, fltr):
+        """ Abandon a filter as a crash would, after syncing the WAL. """
+        fltr.sync()
+        fltr._stop.set()
+        fltr._thread.join()
+        fltr._segment.close()
+
+    def expected(self, keys, removed):
+        """ Build in memory the filter that recovery should produce. """
+        fltr = CountingBloom(16, 8, 20)
+        for key in keys:
+            fltr.insert(KeySelector(key, fltr))
+        for key in removed:
+            fltr.remove(KeySelector(key, fltr))
+        return fltr
+
+    def check_same(self, fltr, expected):
+        """ Filter bits, counters, and key count all match. """
+        self.assertEqual(fltr.to_bytes(), expected.to_bytes())
+        self.assertEqual(fltr._counters._counters,
+                         expected._counters._counters)
+
+    def test_replay_wal(self):
+        """ With no checkpoint, recovery replays the whole WAL. """
+        keys = make_keys(300)
+        fltr = self.open(group_commit=16)
+        for key in keys[:200]:
+            fltr.insert(KeySelector(key, fltr))
+        fltr.insert_many(KeySelector(key, fltr) for key in keys[200:])
+        for key in keys[:50]:
+            fltr.remove(KeySelector(key, fltr))
+        self.crash(fltr)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.path, 'checkpoint')))
+
+        fltr = self.open()
+        self.check_same(fltr, self.expected(keys, keys[:50]))
+        self.assertEqual(len(fltr), 250)
+        fltr.close()
+
+    def test_checkpoint_then_replay(self):
+        """ Recovery loads the checkpoint and replays only later segments. """
+        keys = make_keys(200)
+        fltr = self.open()
+        for key in keys[:100]:
+            fltr.insert(KeySelector(key, fltr))
+        fltr.checkpoint()
+        self.assertEqual(fltr._segments(), [fltr.segment_seq])
+        for key in keys[100:]:
+            fltr.insert(KeySelector(key, fltr))
+        fltr.remove(KeySelector(keys[0], fltr))
+        self.crash(fltr)
+
+        fltr = self.open()
+        self.check_same(fltr, self.expected(keys, keys[:1]))
+        fltr.clear()
+        fltr.close()                        # final checkpoint
+
+        fltr = self.open()
+        self.assertEqual(len(fltr), 0)
+        self.assertEqual(fltr.popcount(), 0)
+        fltr.close(checkpoint=False)
+
+    def test_torn_frame(self):
+        """ A partly written frame at the end of the WAL is cut off. """
+        keys = make_keys(40)
+        fltr = self.open(group_commit=1000)
+        for key in keys[:30]:
+            fltr.insert(KeySelector(key, fltr))
+        fltr.sync()
+        for key in keys[30:]:
+            fltr.insert(KeySelector(key, fltr))
+        seg_path = fltr._segment_path(fltr.segment_seq)
+        self.crash(fltr)
+
+        size = os.path.getsize(seg_path)
+        with open(seg_path, 'r+b') as file:
+            file.truncate(size - 5)
+        fltr = self.open()
+        self.check_same(fltr, self.expected(keys[:30], []))
+        fltr.close()
+
+    def test_bad_checkpoint(self):
+        """ A corrupt checkpoint or mismatched geometry is rejected. """
+        fltr = self.open()
+        for key in make_keys(10):
+            fltr.insert(KeySelector(key, fltr))
+        fltr.close()
+        try:
+            DurableCountingBloom(self.path, 17, 8, 20)
+            self.fail("opened checkpoint with the wrong geometry")
+        except XLFilterError:
+            pass
+
+        ckpt = os.path.join(self.path, 'checkpoint')
+        with open(ckpt, 'r+b') as file:
+            file.seek(-(CHECKPOINT_TRAILER.size + 1), os.SEEK_END)
+            byte = file.read(1)
+            file.seek(-1, os.SEEK_CUR)
+            file.write(bytes([byte[0] ^ 1]))
+        try:
+            self.open()
+            self.fail("opened corrupt checkpoint")
+        except XLFilterError:
+            pass
+
+    def test_background_checkpoint(self):
+        """ The background thread checkpoints while writers continue. """
+        keys = make_keys(2000)
+        fltr = self.open(sync_interval=0.01, checkpoint_interval=0.02)
+        for key in keys:
+            fltr.insert(KeySelector(key, fltr))
+        deadline = time.time() + 5
+        while fltr.segment_seq == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(fltr.segment_seq > 0)
+        self.crash(fltr)
+
+        fltr = self.open()
+        self.check_same(fltr, self.expected(keys, []))
+        fltr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_count_min.py
+
+""" Exercise the count-min sketch over SHA digests. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import KeySelector
+from xlcrypto.filters.count_min import CountMinSHA
+
+
+class TestCountMinSHA(unittest.TestCase):
+    """ Exercise the count-min sketch over SHA digests. """
+
+    def test_param_exceptions(self):
+        """ Unacceptable constructor parameters are caught. """
+        for args in [(0,), (16, 0), (16, 4, 0), (16, 4, 20, 12)]:
+            try:
+                CountMinSHA(*args)
+                self.fail("accepted parameters %s" % (args,))
+            except XLFilterError:
+                pass
+        sketch = CountMinSHA(16, 16, 20)        # k reduced to fit the key
+        self.assertEqual(sketch.k, 10)
+
+    def test_selector_geometry(self):
+        """ Selectors built for another geometry are rejected. """
+        sketch = CountMinSHA(10, 4, 20)
+        key = make_keys(1)[0]
+        for other in (CountMinSHA(12, 4, 20), CountMinSHA(10, 3, 20)):
+            keysel = KeySelector(key, other)
+            self.assertRaises(XLFilterError, sketch.add, keysel)
+            self.assertRaises(XLFilterError, sketch.estimate, keysel)
+        sketch.add(KeySelector(key, sketch))
+
+    def do_test_counts(self, conservative):
+        """ Estimates are never below the true counts. """
+        sketch = CountMinSHA(10, 4, 20, counter_bits=16,
+                             conservative=conservative)
+        keys = make_keys(256)
+        expected = {}
+        for ndx, key in enumerate(keys):
+            keysel = KeySelector(key, sketch)
+            count = 1 + ndx % 7
+            sketch.add(keysel, count)
+            expected[key] = count
+        self.assertEqual(sketch.total, sum(expected.values()))
+
+        keysels = [KeySelector(key, sketch) for key in keys]
+        estimates = sketch.estimate_many(keysels)
+        overcount = 0
+        for ndx, key in enumerate(keys):
+            self.assertEqual(estimates[ndx], sketch.estimate(keysels[ndx]))
+            self.assertTrue(estimates[ndx] >= expected[key])
+            overcount += estimates[ndx] - expected[key]
+        return overcount
+
+    def test_counts(self):
+        """ Conservative update overcounts no more than plain update. """
+        plain = self.do_test_counts(False)
+        conservative = self.do_test_counts(True)
+        self.assertTrue(conservative <= plain)
+
+    def test_saturation(self):
+        """ Counters saturate rather than overflow. """
+        sketch = CountMinSHA(8, 2, 20, counter_bits=8)
+        keysel = KeySelector(make_keys(1)[0], sketch)
+        self.assertEqual(sketch.add(keysel, 200), 200)
+        self.assertEqual(sketch.add(keysel, 200), 255)
+        self.assertEqual(sketch.estimate(keysel), 255)
+
+    def test_bulk_and_merge(self):
+        """ Merged sketches count the union of their streams. """
+        keys = make_keys(64)
+        left = CountMinSHA(12, 4, 20)
+        right = CountMinSHA(12, 4, 20)
+        keysels = [KeySelector(key, left) for key in keys]
+        self.assertEqual(left.add_many(keysels, 3), 64)
+        right.add_many(keysels[:32], 2)
+        left.merge(right)
+        self.assertEqual(left.total, 64 * 3 + 32 * 2)
+        estimates = left.estimate_many(keysels)
+        for ndx in range(64):
+            self.assertTrue(estimates[ndx] >= (5 if ndx < 32 else 3))
+
+        try:
+            left.merge(CountMinSHA(12, 4, 20, counter_bits=8))
+            self.fail("merged sketches of different geometry")
+        except XLFilterError:
+            pass
+
+        copy = CountMinSHA.from_bytes(left.to_bytes())
+        self.assertEqual(copy.total, left.total)
+        self.assertEqual(copy.estimate_many(keysels), estimates)
+
+        left.clear()
+        self.assertEqual(left.total, 0)
+        self.assertEqual(left.estimate(keysels[0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
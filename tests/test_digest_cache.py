@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_digest_cache.py
+
+""" Test the persistent cache of file digests. """
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import DigestCache
+
+
+class TestDigestCache(unittest.TestCase):
+    """ Test the persistent cache of file digests. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+        self.dir = tempfile.mkdtemp(prefix='xldcache')
+        self.db_path = os.path.join(self.dir, 'digests.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, data, age=10):
+        """ Write a file last modified age seconds ago. """
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        then = time.time() - age
+        os.utime(path, (then, then))
+        return path
+
+    def rewrite(self, path, data):
+        """ Replace a file's contents, keeping its size and mtime. """
+        stat = os.stat(path)
+        with open(path, 'r+b') as file:
+            file.write(data)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def test_hit_and_miss(self):
+        """ An unchanged file is not read again; a changed one is. """
+        data = bytes(self.rng.some_bytes(4096))
+        path = self.make_file('a', data)
+        with DigestCache(self.db_path) as cache:
+            self.assertEqual(cache.hash_file(path, HashTypes.SHA2),
+                             hashlib.sha256(data).digest())
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(len(cache), 1)
+
+            # same identity, different contents: the cache answers
+            self.rewrite(path, bytes(4096))
+            self.assertEqual(cache.hash_file(path, HashTypes.SHA2),
+                             hashlib.sha256(data).digest())
+            self.assertEqual(cache.hits, 1)
+
+            # each hash type is cached separately
+            self.assertEqual(cache.hash_file(path, HashTypes.SHA1),
+                             hashlib.sha1(bytes(4096)).digest())
+            self.assertEqual(len(cache), 2)
+
+            # a new mtime makes the entry stale
+            then = time.time() - 5
+            os.utime(path, (then, then))
+            self.assertEqual(cache.hash_file(path, HashTypes.SHA2),
+                             hashlib.sha256(bytes(4096)).digest())
+            self.assertEqual(cache.misses, 3)
+
+        # the cache persists
+        with DigestCache(self.db_path) as cache:
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.hash_file(path, HashTypes.SHA2),
+                             hashlib.sha256(bytes(4096)).digest())
+            self.assertEqual(cache.hits, 1)
+
+    def test_recent_files(self):
+        """ Files modified within the timestamp granularity are not cached. """
+        path = self.make_file('new', b'abc', age=0)
+        with DigestCache(self.db_path) as cache:
+            self.assertEqual(cache.hash_file(path),
+                             hashlib.sha256(b'abc').digest())
+            self.assertEqual(len(cache), 0)
+            self.assertFalse(cache.store(path, b'x' * 32))
+        self.assertRaises(XLCryptoError, DigestCache, self.db_path, 0)
+
+    def test_invalidate(self):
+        """ Entries can be dropped by file, by hash type, or all at once. """
+        paths = [self.make_file('f%d' % ndx, b'%d' % ndx) for ndx in range(4)]
+        with DigestCache(self.db_path) as cache:
+            for path in paths:
+                cache.hash_file(path, HashTypes.SHA1)
+                cache.hash_file(path, HashTypes.SHA2)
+            self.assertEqual(len(cache), 8)
+            cache.invalidate(paths[0])
+            self.assertEqual(len(cache), 6)
+            self.assertIsNone(cache.lookup(paths[0], HashTypes.SHA1))
+            cache.invalidate(hashtype=HashTypes.SHA1)
+            self.assertEqual(len(cache), 3)
+            cache.invalidate()
+            self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        """ The least recently used entries go first. """
+        paths = [self.make_file('f%02d' % ndx, b'%d' % ndx)
+                 for ndx in range(24)]
+        with DigestCache(self.db_path, max_entries=16,
+                         touch_interval=0) as cache:
+            for path in paths[:16]:
+                cache.hash_file(path)
+            cache.hash_file(paths[0])       # recently used again
+            for path in paths[16:]:
+                cache.hash_file(path)
+            cache.evict()
+            self.assertEqual(len(cache), 16)
+            self.assertIsNotNone(cache.lookup(paths[0]))
+            self.assertIsNotNone(cache.lookup(paths[-1]))
+            self.assertIsNone(cache.lookup(paths[1]))
+            self.assertIsNone(cache.lookup(paths[8]))
+            self.assertIsNotNone(cache.lookup(paths[9]))
+
+    def test_threads(self):
+        """ Threads may share a cache. """
+        paths = [self.make_file('f%02d' % ndx,
+                                bytes(self.rng.some_bytes(1000)))
+                 for ndx in range(20)]
+        expected = {}
+        for path in paths:
+            with open(path, 'rb') as file:
+                expected[path] = hashlib.sha256(file.read()).digest()
+        errors = []
+        with DigestCache(self.db_path) as cache:
+
+            def work():
+                try:
+                    for _ in range(3):
+                        for path in paths:
+                            if cache.hash_file(path) != expected[path]:
+                                errors.append(path)
+                except Exception as exc:
+                    errors.append(exc)
+
+            threads = [threading.Thread(target=work) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(len(cache), 20)
+            self.assertEqual(cache.hits + cache.misses, 240)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_digest_many.py
+
+""" Test batch digests of many small messages. """
+
+import hashlib
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import digest_many, XLSHA1, XLSHA3, XLBLAKE2B_256
+
+
+class TestDigestMany(unittest.TestCase):
+    """ Test batch digests of many small messages. """
+
+    def setUp(self):
+        rng = SimpleRNG()
+        self.messages = [bytes(rng.some_bytes(rng.next_int16(100)))
+                         for _ in range(200)]
+
+    def test_messages(self):
+        """ Digests are packed end to end in message order. """
+        for hashtype, cls in ((HashTypes.SHA1, XLSHA1),
+                              (HashTypes.SHA3, XLSHA3),
+                              (HashTypes.BLAKE2B, XLBLAKE2B_256)):
+            expected = b''.join(cls(msg).digest() for msg in self.messages)
+            self.assertEqual(digest_many(hashtype, self.messages), expected)
+            self.assertEqual(digest_many(hashtype, iter(self.messages)),
+                             expected)
+        self.assertEqual(digest_many(HashTypes.SHA2, []), b'')
+
+    def test_offsets(self):
+        """ A packed buffer with offsets gives the same digests. """
+        packed = b''.join(self.messages)
+        offsets = [0]
+        for msg in self.messages:
+            offsets.append(offsets[-1] + len(msg))
+        expected = b''.join(hashlib.sha256(msg).digest()
+                            for msg in self.messages)
+        self.assertEqual(digest_many(HashTypes.SHA2, packed, offsets),
+                         expected)
+        self.assertEqual(
+            digest_many(HashTypes.SHA2, bytearray(packed), offsets),
+            expected)
+        self.assertRaises(XLCryptoError, digest_many, HashTypes.SHA2, packed,
+                          [0, len(packed) + 1])
+        self.assertRaises(XLCryptoError, digest_many, HashTypes.SHA2, packed,
+                          [0, 5, 4])
+
+    def test_array(self):
+        """ With NumPy, digests can come back as a 2-D array. """
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        array = digest_many(HashTypes.SHA1, self.messages, as_array=True)
+        self.assertEqual(array.shape, (200, 20))
+        self.assertEqual(array.dtype, numpy.uint8)
+        self.assertEqual(bytes(array[3]),
+                         hashlib.sha1(self.messages[3]).digest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_filter_service.py
+
+""" Exercise the asyncio filter service and its pooled client. """
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, CountingBloom, KeySelector
+from xlcrypto.filters.service import (FilterServer, FilterClient, REQUEST,
+                                      RESPONSE, OP_QUERY, STATUS_ERROR)
+
+
+class TestFilterService(unittest.TestCase):
+    """ Exercise the asyncio filter service and its pooled client. """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='xlsvc')
+        self.sock = os.path.join(self.dir, 'filters.sock')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.dir)
+
+    def run_with_server(self, filters, body):
+        """ Run the coroutine function body(client) against a server. """
+        async def main():
+            async with FilterServer(self.sock, filters):
+                async with FilterClient(self.sock, pool_size=3,
+                                        max_batch=100) as client:
+                    await body(client)
+        self.loop.run_until_complete(main())
+        self.assertFalse(os.path.exists(self.sock))
+
+    def test_insert_query_remove(self):
+        """ Batched operations match the filters they are applied to. """
+        bloom = BloomSHA(16, 8, 20)
+        counting = CountingBloom(16, 8, 20)
+        keys = make_keys(1000)
+        others = make_keys(50, 32)
+
+        async def body(client):
+            self.assertEqual(await client.insert('plain', keys), 1000)
+            self.assertEqual(await client.insert('counting', keys), 1000)
+            self.assertEqual(await client.query('plain', keys), [True] * 1000)
+
+            info = await client.info('counting')
+            self.assertEqual((info.m, info.k, info.key_bytes, info.key_count,
+                              info.removable), (16, 8, 20, 1000, 1))
+
+            self.assertEqual(await client.remove('counting', keys[:400]), 400)
+            self.assertEqual(len(counting), 600)
+            found = await client.query('counting', keys[400:])
+            self.assertEqual(found, [True] * 600)
+
+            # concurrent callers share the pool
+            results = await asyncio.gather(
+                client.query('plain', keys[:300]),
+                client.query('counting', keys[400:700]))
+            self.assertEqual(results, [[True] * 300] * 2)
+
+            for coro in (client.remove('plain', keys[:1]),
+                         client.query('missing', keys[:1]),
+                         client.query('plain', others)):
+                try:
+                    await coro
+                    self.fail("server accepted a bad request")
+                except XLFilterError:
+                    pass
+            # the connections survive errors
+            self.assertEqual(await client.query('plain', keys[:5]),
+                             [True] * 5)
+
+        self.run_with_server({'plain': bloom, 'counting': counting}, body)
+        self.assertEqual(len(bloom), 1000)
+        for key in keys:
+            self.assertTrue(bloom.is_member(KeySelector(key, bloom)))
+
+    def test_batch_limit(self):
+        """ The server refuses oversized batches. """
+        server = FilterServer(self.sock, {'plain': BloomSHA(16, 8, 20)},
+                              max_batch=10)
+
+        async def main():
+            async with server:
+                async with FilterClient(self.sock, pool_size=1,
+                                        max_batch=20) as client:
+                    try:
+                        await client.insert('plain', make_keys(20))
+                        self.fail("server accepted an oversized batch")
+                    except XLFilterError:
+                        pass
+        self.loop.run_until_complete(main())
+
+    def test_oversized_keys(self):
+        """ Keys too long to accept are refused before they are read. """
+        server = FilterServer(self.sock, {'plain': BloomSHA(16, 8, 20)},
+                              max_batch=100)
+
+        async def main():
+            async with server:
+                for name in (b'plain', b'missing'):
+                    reader, writer = await asyncio.open_unix_connection(
+                        self.sock)
+                    # announce 6.5 MB of keys but send none of them
+                    writer.write(REQUEST.pack(7, OP_QUERY, len(name),
+                                              65535, 100) + name)
+                    head = await asyncio.wait_for(
+                        reader.readexactly(RESPONSE.size), 5)
+                    req_id, status, body_len = RESPONSE.unpack(head)
+                    self.assertEqual((req_id, status), (7, STATUS_ERROR))
+                    await reader.readexactly(body_len)
+                    # and the server hangs up
+                    self.assertEqual(await reader.read(), b'')
+                    writer.close()
+        self.loop.run_until_complete(main())
+
+    def test_reconnect(self):
+        """ Connections lost are replaced. """
+        keys = make_keys(300)        # a batch for each connection
+
+        async def body(client):
+            self.assertEqual(await client.insert('plain', keys), 300)
+            for conn in client._pool:
+                conn._writer.transport.abort()
+            await asyncio.sleep(0.05)
+            self.assertTrue(all(conn.failed for conn in client._pool))
+            self.assertEqual(await client.query('plain', keys), [True] * 300)
+            self.assertFalse(any(conn.failed for conn in client._pool))
+
+        self.run_with_server({'plain': BloomSHA(16, 8, 20)}, body)
+
+    def test_slow_batch(self):
+        """ A slow batch does not hold up requests on other connections. """
+        release = threading.Event()
+
+        class SlowBloom(BloomSHA):
+            """ A BloomSHA whose batch inserts wait to be released. """
+
+            def insert_many(self, keysels, sort=False):
+                release.wait(10)
+                return super().insert_many(keysels, sort)
+
+        keys = make_keys(10)
+
+        async def body(client):
+            slow = asyncio.ensure_future(client.insert('slow', keys))
+            try:
+                await asyncio.sleep(0.05)
+                self.assertEqual(await client.insert('fast', keys), 10)
+                self.assertFalse(slow.done())
+            finally:
+                release.set()
+            self.assertEqual(await slow, 10)
+
+        self.run_with_server({'slow': SlowBloom(16, 8, 20),
+                              'fast': BloomSHA(16, 8, 20)}, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
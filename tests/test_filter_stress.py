@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_filter_stress.py
+
+""" Run short, seeded concurrency stress tests against the filters. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import CountingBloom, KeySelector
+from xlcrypto.filters.stress import TimedLock, run_stress, _Epoch
+
+
+class TestFilterStress(unittest.TestCase):
+    """ Run short, seeded concurrency stress tests against the filters. """
+
+    def check(self, report):
+        """ The run completed with no invariant violated. """
+        self.assertFalse(report.deadlocked)
+        self.assertEqual(report.violations, [])
+        self.assertTrue(report.ops > 0)
+        self.assertTrue(report.ops_per_sec > 0)
+
+    def test_timed_lock(self):
+        """ TimedLock records a wait for each acquisition. """
+        lock = TimedLock()
+        with lock:
+            self.assertTrue(lock.locked())
+        self.assertFalse(lock.acquire(False) is False)
+        lock.release()
+        self.assertEqual(len(lock.waits), 2)
+        self.assertEqual(sorted(lock.percentiles()), [50, 90, 99, 100])
+
+    def test_threads(self):
+        """ Every kind of filter survives concurrent threads. """
+        for kind in ('bloom', 'word', 'counting'):
+            report = run_stress(kind, threads=4, ops=1500, seed=7, m=16,
+                                timeout=60)
+            self.check(report)
+            self.assertEqual(report.clears, 0)
+            self.assertTrue('_lock' in report.lock_waits)
+        self.assertTrue('_cb_lock' in report.lock_waits)
+
+    def test_clears(self):
+        """ Clearing concurrently with other operations can't deadlock. """
+        report = run_stress('counting', threads=4, ops=1500, seed=11, m=16,
+                            clear_rate=0.02, timeout=60)
+        self.check(report)
+        self.assertTrue(report.clears > 0)
+
+    def test_epoch_remove(self):
+        """ Churn keys are not removed once the filter has been cleared. """
+        fltr = CountingBloom(12, 4, 20)
+        epoch = _Epoch()
+        keys = make_keys(8)
+        fltr.insert_many(KeySelector(key, fltr) for key in keys)
+        self.assertTrue(epoch.remove(fltr, keys[:4], 0, True))
+        self.assertTrue(epoch.remove(fltr, keys[4:6], 0, False))
+        self.assertEqual(len(fltr), 2)
+        epoch.clear(fltr)
+        fltr.insert_many(KeySelector(key, fltr) for key in keys[6:])
+        # cleared since epoch 0, so the keys may no longer be present
+        self.assertFalse(epoch.remove(fltr, keys[6:], 0, True))
+        self.assertEqual(len(fltr), 2)
+        self.assertTrue(epoch.remove(fltr, keys[6:], 2, True))
+        self.assertEqual(len(fltr), 0)
+
+    def test_processes(self):
+        """ Threads and client processes share one filter. """
+        report = run_stress('counting', threads=2, processes=2, ops=1000,
+                            seed=3, m=16, timeout=120)
+        self.check(report)
+        try:
+            run_stress('counting', processes=1, clear_rate=0.1)
+            self.fail("accepted clears with processes")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
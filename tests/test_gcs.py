@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_gcs.py
+
+""" Exercise Golomb-coded sets of SHA digests. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters.gcs import GolombCodedSetSHA
+
+
+class TestGolombCodedSet(unittest.TestCase):
+    """ Exercise Golomb-coded sets of SHA digests. """
+
+    def test_param_exceptions(self):
+        """ Unacceptable constructor parameters are caught. """
+        for kwargs in [{'key_bytes': 4}, {'p': 0}, {'p': 33},
+                       {'index_interval': -1}]:
+            try:
+                GolombCodedSetSHA(b'', **kwargs)
+                self.fail("accepted %s" % kwargs)
+            except XLFilterError:
+                pass
+        try:
+            GolombCodedSetSHA(bytes(30), key_bytes=20)
+            self.fail("accepted a partial key")
+        except XLFilterError:
+            pass
+
+    def test_empty(self):
+        """ An empty set has no members. """
+        gcs = GolombCodedSetSHA(b'', 20)
+        self.assertEqual(len(gcs), 0)
+        key = make_keys(1)[0]
+        self.assertFalse(gcs.is_member(key))
+        self.assertEqual(gcs.is_member_many([key]), [False])
+        copy = GolombCodedSetSHA.from_bytes(gcs.to_bytes())
+        self.assertFalse(copy.is_member(key))
+
+    def do_test_membership(self, key_bytes, count, p, index_interval):
+        """ Members are found; few non-members are. """
+        keys = make_keys(count, key_bytes)
+        absent = make_keys(count, key_bytes)
+        gcs = GolombCodedSetSHA(b''.join(keys), key_bytes, p, index_interval)
+        self.assertEqual(len(gcs), count)
+        for key in keys:
+            self.assertTrue(gcs.is_member(key))
+        false_pos = sum(1 for key in absent if gcs.is_member(key))
+        self.assertTrue(false_pos <= 4 + 4 * count * gcs.false_positives())
+
+        probes = []
+        for ndx in range(count):
+            probes.append(keys[ndx])
+            probes.append(absent[ndx])
+        expected = [gcs.is_member(key) for key in probes]
+        self.assertEqual(gcs.is_member_many(probes), expected)
+        self.assertEqual(gcs.is_member_many(b''.join(probes)), expected)
+
+        # serialization drops the index; loading rebuilds it
+        for interval in (0, 16):
+            copy = GolombCodedSetSHA.from_bytes(gcs.to_bytes(), interval)
+            self.assertEqual(copy.to_bytes(), gcs.to_bytes())
+            self.assertEqual(copy.is_member_many(probes), expected)
+        return gcs
+
+    def test_membership(self):
+        """ Test with and without an index. """
+        self.do_test_membership(20, 300, 20, 0)
+        self.do_test_membership(20, 1000, 20, 64)
+        self.do_test_membership(32, 1000, 10, 7)
+        self.do_test_membership(20, 3, 8, 1)
+
+    def test_stream_layout(self):
+        """ Codes are written most significant bit first. """
+        # fingerprints 1, 9 and 10 in 0..3 * 2**2 - 1
+        keys = [((fpr << 64) // 12 + 1).to_bytes(8, 'little') + bytes(12)
+                for fpr in (9, 1, 10)]
+        gcs = GolombCodedSetSHA(b''.join(keys), 20, 2, 1)
+        # deltas 1, 8, 1 code as 0 01, 11 0 00, 0 01
+        self.assertEqual(gcs.to_bytes()[-2:], bytes([0b00111000, 0b00100000]))
+        self.assertEqual(gcs._bit_count, 11)
+        self.assertEqual([fpr for fpr, _ in gcs._decode()], [1, 9, 10])
+        self.assertEqual(gcs._index_offsets, [0, 3, 8])
+        self.assertTrue(all(gcs.is_member_many(keys)))
+
+    def test_compact(self):
+        """ The coded set is smaller than a BloomSHA of the same rate. """
+        count, p = 4096, 16
+        gcs = self.do_test_membership(20, count, p, 64)
+        # a BloomSHA with a false positive rate of 2**-16
+        bloom_bits = 1.44 * p * count
+        self.assertTrue(gcs.size * 8 < bloom_bits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_hash_copy.py
+
+""" Test copying of hash states and prefix templates. """
+
+import hashlib
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto.hash import (XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256,
+                           PrefixTemplate)
+
+
+class TestHashCopy(unittest.TestCase):
+    """ Test copying of hash states and prefix templates. """
+
+    def setUp(self):
+        self.rng = SimpleRNG()
+
+    def test_copy(self):
+        """ A copy continues independently from the same state. """
+        prefix = bytes(self.rng.some_bytes(300))
+        for cls in (XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256):
+            xlh = cls(prefix)
+            clone = xlh.copy()
+            self.assertTrue(isinstance(clone, cls))
+            self.assertEqual(clone.digest(), xlh.digest())
+            clone.update(b'abc')
+            xlh.update(b'xyz')
+            self.assertEqual(clone.digest(), cls(prefix + b'abc').digest())
+            self.assertEqual(xlh.digest(), cls(prefix + b'xyz').digest())
+
+    def test_template(self):
+        """ Templates digest the prefix followed by each message. """
+        prefix = bytes(self.rng.some_bytes(200))
+        messages = [bytes(self.rng.some_bytes(n)) for n in range(0, 80, 7)]
+        tmpl = PrefixTemplate(HashTypes.SHA2, prefix)
+        expected = [hashlib.sha256(prefix + msg).digest() for msg in messages]
+        self.assertEqual(tmpl.digest_many(messages), expected)
+        self.assertEqual([tmpl.digest(msg) for msg in messages], expected)
+        self.assertEqual(tmpl.hexdigest(messages[1]), expected[1].hex())
+
+        xlh = tmpl.new(b'abc')
+        self.assertTrue(isinstance(xlh, XLSHA2))
+        xlh.update(b'def')
+        self.assertEqual(xlh.digest(),
+                         hashlib.sha256(prefix + b'abcdef').digest())
+        # the template itself is unchanged
+        self.assertEqual(tmpl.new().digest(), hashlib.sha256(prefix).digest())
+
+        blake = PrefixTemplate(HashTypes.BLAKE2B, b'salt')
+        self.assertEqual(blake.digest(b'msg'),
+                         XLBLAKE2B_256(b'saltmsg').digest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_hash_file.py
+
+""" Test hashing of files and file objects. """
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import (XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256,
+                           hash_file, hash_fileobj)
+
+
+class TestHashFile(unittest.TestCase):
+    """ Test hashing of files and file objects. """
+
+    def setUp(self):
+        self.rng = SimpleRNG()
+        self.dir = tempfile.mkdtemp(prefix='xlhash')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        """ Write a file in the test directory, returning its path. """
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_classes(self):
+        """ Every class hashes files as it hashes bytes. """
+        data = bytes(self.rng.some_bytes(100000))
+        path = self.write('data', data)
+        for cls in (XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256):
+            expected = cls(data).digest()
+            self.assertEqual(cls.hash_fileobj(io.BytesIO(data)), expected)
+            self.assertEqual(cls.hash_fileobj(io.BytesIO(data), 999),
+                             expected)
+            # read into a buffer, then mapped, in whole and partial chunks
+            for threshold in (None, 0, 1 << 30):
+                for chunk_size in (4096, 30000, 1 << 20):
+                    self.assertEqual(
+                        cls.hash_file(path, chunk_size, threshold), expected)
+
+    def test_functions(self):
+        """ The module functions select the class by hash type. """
+        data = bytes(self.rng.some_bytes(5000))
+        path = self.write('data', data)
+        self.assertEqual(hash_file(path), hashlib.sha256(data).digest())
+        self.assertEqual(hash_file(path, HashTypes.SHA1, mmap_threshold=0),
+                         hashlib.sha1(data).digest())
+        self.assertEqual(hash_fileobj(io.BytesIO(data), HashTypes.SHA3),
+                         hashlib.sha3_256(data).digest())
+
+        # empty files can't be mapped, but still hash
+        empty = self.write('empty', b'')
+        self.assertEqual(hash_file(empty, mmap_threshold=0),
+                         hashlib.sha256().digest())
+
+        xlh = XLSHA2(b'prefix')
+        self.assertEqual(xlh.update_from(io.BytesIO(data), 1000), 5000)
+        self.assertEqual(xlh.digest(),
+                         hashlib.sha256(b'prefix' + data).digest())
+
+        # a zero chunk size would read nothing and hash nothing
+        self.assertRaises(XLCryptoError, hash_fileobj, io.BytesIO(data),
+                          HashTypes.SHA2, 0)
+        self.assertRaises(XLCryptoError, hash_file, path, HashTypes.SHA2, 0)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "no named pipes")
+    def test_unknown_size(self):
+        """ Files reporting a size of zero are read in whole chunks. """
+        sizes = []
+
+        class Recorder(XLSHA2):
+            """ Records the chunk sizes used. """
+
+            def update_from(self, fileobj, chunk_size=1 << 20):
+                sizes.append(chunk_size)
+                return super().update_from(fileobj, chunk_size)
+
+        data = bytes(self.rng.some_bytes(100000))
+        path = os.path.join(self.dir, 'fifo')
+        os.mkfifo(path)
+
+        def feed():
+            with open(path, 'wb') as file:
+                file.write(data)
+
+        writer = threading.Thread(target=feed)
+        writer.start()
+        try:
+            self.assertEqual(Recorder.hash_file(path, 65536),
+                             hashlib.sha256(data).digest())
+        finally:
+            writer.join()
+        self.assertEqual(sizes, [65536])
+
+
+if __name__ == '__main__':
+    unittest.main()
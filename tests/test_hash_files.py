@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_hash_files.py
+
+""" Test parallel hashing of many files. """
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import hash_files
+
+
+class TestHashFiles(unittest.TestCase):
+    """ Test parallel hashing of many files. """
+
+    def setUp(self):
+        self.rng = SimpleRNG()
+        self.dir = tempfile.mkdtemp(prefix='xlhashes')
+        self.paths = []
+        self.expected = {}
+        for ndx in range(40):
+            data = bytes(self.rng.some_bytes(self.rng.next_int16(20000)))
+            path = os.path.join(self.dir, 'file%02d' % ndx)
+            with open(path, 'wb') as file:
+                file.write(data)
+            self.paths.append(path)
+            self.expected[path] = hashlib.sha1(data).digest()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unordered(self):
+        """ Every file is hashed once, in whatever order. """
+        results = list(hash_files(self.paths, HashTypes.SHA1, workers=4,
+                                  max_pending=3))
+        self.assertEqual(len(results), len(self.paths))
+        self.assertEqual(dict((res.path, res.digest) for res in results),
+                         self.expected)
+        self.assertTrue(all(res.error is None for res in results))
+
+    def test_ordered(self):
+        """ Results can be had in the order of the paths. """
+        paths = iter(self.paths)            # a one-shot iterable
+        results = list(hash_files(paths, HashTypes.SHA1, workers=3,
+                                  ordered=True, mmap_threshold=0))
+        self.assertEqual([res.path for res in results], self.paths)
+        for res in results:
+            self.assertEqual(res.digest, self.expected[res.path])
+
+    def test_errors(self):
+        """ Errors are captured per file, or raised on request. """
+        missing = os.path.join(self.dir, 'missing')
+        paths = self.paths[:5] + [missing] + self.paths[5:10]
+        results = list(hash_files(paths, HashTypes.SHA1, ordered=True))
+        self.assertEqual(len(results), 11)
+        self.assertEqual(results[5].path, missing)
+        self.assertTrue(isinstance(results[5].error, OSError))
+        self.assertEqual(results[5].digest, None)
+        self.assertEqual(results[6].digest, self.expected[paths[6]])
+
+        try:
+            list(hash_files(paths, HashTypes.SHA1, raise_errors=True))
+            self.fail("missing file not reported")
+        except OSError:
+            pass
+
+        # stopping early is fine
+        gen = hash_files(self.paths, HashTypes.SHA1, workers=2)
+        next(gen)
+        gen.close()
+
+        for kwargs in ({'workers': 0}, {'max_pending': 0}):
+            self.assertRaises(XLCryptoError, list,
+                              hash_files(self.paths, **kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
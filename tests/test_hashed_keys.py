@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_hashed_keys.py
+
+""" Exercise filters of arbitrary-length keys. """
+
+import hashlib
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, CountingBloom, KeySelector
+from xlcrypto.filters.keyed import HashedKeyFilter
+
+RNG = SimpleRNG(time.time())
+
+
+class TestHashedKeyFilter(unittest.TestCase):
+    """ Exercise filters of arbitrary-length keys. """
+
+    def make_names(self, count):
+        """ Return a list of distinct keys of varying lengths. """
+        return [b'/objects/%d/' % i + bytes(RNG.some_bytes(RNG.next_int16(64)))
+                for i in range(count)]
+
+    def test_digests(self):
+        """ Digests are blake2b of the filter's key width. """
+        hashed = HashedKeyFilter(BloomSHA(16, 8, 32))
+        data = b'https://example.com/'
+        self.assertEqual(hashed.digest(data),
+                         hashlib.blake2b(data, digest_size=32).digest())
+        self.assertEqual(hashed.digest('https://example.com/'),
+                         hashed.digest(data))
+        names = self.make_names(50)
+        self.assertEqual(hashed.digest_many(names),
+                         [hashed.digest(name) for name in names])
+
+        keyed = HashedKeyFilter(BloomSHA(16, 8, 20), secret=b'shh')
+        self.assertEqual(len(keyed.digest(data)), 20)
+        self.assertNotEqual(keyed.digest(data),
+                            HashedKeyFilter(BloomSHA(16, 8, 20)).digest(data))
+
+        for fltr, secret in ((BloomSHA(16, 8, 65), b''),
+                             (BloomSHA(16, 8, 20), bytes(65))):
+            try:
+                HashedKeyFilter(fltr, secret)
+                self.fail("accepted impossible blake2b parameters")
+            except XLFilterError:
+                pass
+
+    def test_membership(self):
+        """ Keys of any length can be inserted, found, and removed. """
+        fltr = CountingBloom(16, 8, 20)
+        hashed = HashedKeyFilter(fltr, secret=b'salt')
+        names = self.make_names(300)
+        hashed.insert(names[0])
+        self.assertEqual(hashed.insert_many(names[1:]), 299)
+        self.assertEqual(len(hashed), 300)
+        self.assertTrue(hashed.is_member(names[0]))
+        self.assertEqual(hashed.is_member_many(names), [True] * 300)
+        self.assertTrue(fltr.is_member(KeySelector(hashed.digest(names[7]),
+                                                   fltr)))
+
+        hashed.remove(names[0])
+        self.assertEqual(hashed.remove_many(names[1:100]), 99)
+        self.assertEqual(len(fltr), 200)
+        self.assertEqual(hashed.is_member_many(names[100:]), [True] * 200)
+
+        plain = HashedKeyFilter(BloomSHA(16, 8, 20))
+        try:
+            plain.remove(names[0])
+            self.fail("removed a key from a plain BloomSHA")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
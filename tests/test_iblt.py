@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_iblt.py
+
+""" Exercise set reconciliation with Invertible Bloom Lookup Tables. """
+
+import unittest
+
+from filter_keys import make_digest_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import KeySelector
+from xlcrypto.filters.iblt import IBLTSHA
+
+
+class TestIBLTSHA(unittest.TestCase):
+    """ Exercise set reconciliation with Invertible Bloom Lookup Tables. """
+
+    def build(self, keys, m, k=3, key_bytes=20):
+        """ Return a table holding the keys. """
+        table = IBLTSHA(m, k, key_bytes)
+        table.insert_many([KeySelector(key, table) for key in keys])
+        return table
+
+    def test_param_exceptions(self):
+        """ Unacceptable constructor parameters are caught. """
+        for args in [(0,), (10, 0), (10, 3, 0)]:
+            try:
+                IBLTSHA(*args)
+                self.fail("accepted parameters %s" % (args,))
+            except XLFilterError:
+                pass
+
+    def test_selector_geometry(self):
+        """ Selectors built for another geometry are rejected. """
+        table = IBLTSHA(10, 3, 20)
+        key = make_digest_keys(1)[0]
+        for other in (IBLTSHA(12, 3, 20), IBLTSHA(10, 4, 20)):
+            keysel = KeySelector(key, other)
+            self.assertRaises(XLFilterError, table.insert, keysel)
+            self.assertRaises(XLFilterError, table.remove, keysel)
+        self.assertEqual(table.count, 0)
+
+    def test_list_entries(self):
+        """ A small table can be decoded directly. """
+        keys = make_digest_keys(20, salt=b'list')
+        table = self.build(keys, 5)
+        self.assertEqual(table.count, 20)
+        present, absent = table.decode()
+        self.assertEqual(sorted(present), sorted(keys))
+        self.assertEqual(absent, [])
+        # decoding does not change the table
+        self.assertEqual(sorted(table.decode()[0]), sorted(keys))
+
+        for key in keys:
+            table.remove(KeySelector(key, table))
+        self.assertEqual(table.decode(), ([], []))
+
+    def do_test_reconcile(self, key_bytes, common, only_a, only_b):
+        """ Two peers with large sets recover a small difference. """
+        # decoding fails with small but nonzero probability, so the keys
+        # used here are fixed
+        keys = make_digest_keys(common + only_a + only_b, key_bytes,
+                              salt=b'reconcile')
+        set_a = keys[:common + only_a]
+        set_b = keys[:common] + keys[common + only_a:]
+        m = IBLTSHA.m_for_difference(only_a + only_b)
+        table_a = self.build(set_a, m, key_bytes=key_bytes)
+        table_b = self.build(set_b, m, key_bytes=key_bytes)
+
+        # as a peer would receive it
+        table_b = IBLTSHA.from_bytes(table_b.to_bytes())
+        diff = table_a - table_b
+        self.assertEqual(diff.count, only_a - only_b)
+        present, absent = diff.decode()
+        self.assertEqual(sorted(present), sorted(keys[common:common + only_a]))
+        self.assertEqual(sorted(absent), sorted(keys[common + only_a:]))
+
+        diff = IBLTSHA.from_bytes(diff.to_bytes())
+        self.assertEqual(diff.count, only_a - only_b)
+
+    def test_reconcile(self):
+        """ Reconcile sets of SHA1 and SHA2 digests. """
+        self.do_test_reconcile(20, 2000, 10, 20)
+        self.do_test_reconcile(32, 2000, 30, 0)
+
+    def test_undecodable(self):
+        """ A table too small for its contents cannot be decoded. """
+        table = self.build(make_digest_keys(200), 4)
+        try:
+            table.decode()
+            self.fail("decoded 200 keys from 48 cells")
+        except XLFilterError:
+            pass
+        try:
+            table.subtract(IBLTSHA(5, 3, 20))
+            self.fail("subtracted tables of different geometry")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
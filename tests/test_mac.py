@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_mac.py
+
+""" Test MACs with cached keyed states. """
+
+import hashlib
+import hmac
+import threading
+import time
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.mac import MAC
+
+HMAC_FUNCS = {
+    HashTypes.SHA1: hashlib.sha1,
+    HashTypes.SHA2: hashlib.sha256,
+    HashTypes.SHA3: hashlib.sha3_256,
+}
+
+
+class TestMAC(unittest.TestCase):
+    """ Test MACs with cached keyed states. """
+
+    def setUp(self):
+        self.rng = SimpleRNG(time.time())
+
+    def expected(self, hashtype, key, msg):
+        """ Return the MAC computed without caching. """
+        if hashtype == HashTypes.BLAKE2B:
+            return hashlib.blake2b(msg, digest_size=32, key=key).digest()
+        return hmac.new(key, msg, HMAC_FUNCS[hashtype]).digest()
+
+    def test_macs(self):
+        """ MACs match the standard library's for every algorithm. """
+        # short, block-sized, and (for HMAC) longer than a block
+        key_lens = {HashTypes.BLAKE2B: (0, 16, 64)}
+        msgs = [bytes(self.rng.some_bytes(size))
+                for size in (0, 1, 55, 64, 1000)]
+        for hashtype in (HashTypes.SHA1, HashTypes.SHA2, HashTypes.SHA3,
+                         HashTypes.BLAKE2B):
+            mac = MAC(hashtype)
+            for key_len in key_lens.get(hashtype, (0, 16, 64, 136, 200)):
+                key = bytes(self.rng.some_bytes(key_len))
+                tags = [self.expected(hashtype, key, msg) for msg in msgs]
+                for msg, tag in zip(msgs, tags):
+                    self.assertEqual(mac.mac(key, msg), tag)
+                    self.assertTrue(mac.verify(key, msg, tag))
+                # the cached state is reused, and not consumed
+                self.assertEqual(mac.mac_many(key, msgs), tags)
+                self.assertEqual(mac.mac_many(key, msgs), tags)
+
+        mac = MAC(HashTypes.BLAKE2B)
+        try:
+            mac.mac(bytes(65), b'abc')
+            self.fail("accepted 65-byte blake2b key")
+        except XLCryptoError:
+            pass
+
+    def test_verify_many(self):
+        """ Every tag in a batch is checked. """
+        mac = MAC()
+        key = bytes(self.rng.some_bytes(32))
+        msgs = [bytes(self.rng.some_bytes(40)) for _ in range(10)]
+        tags = mac.mac_many(key, msgs)
+        self.assertEqual(mac.verify_many(key, msgs, tags), [True] * 10)
+        bad = list(tags)
+        bad[3] = bytes([bad[3][0] ^ 1]) + bad[3][1:]
+        bad[7] = bad[7][:-1]
+        expect = [True] * 10
+        expect[3] = expect[7] = False
+        self.assertEqual(mac.verify_many(key, msgs, bad), expect)
+        self.assertEqual(mac.verify_many(b'other', msgs, tags), [False] * 10)
+        self.assertRaises(XLCryptoError, mac.verify_many, key, msgs,
+                          tags[1:])
+        self.assertRaises(XLCryptoError, MAC, HashTypes.SHA2, 0)
+
+    def test_eviction(self):
+        """ Only the most recently used keys' states are kept. """
+        mac = MAC(HashTypes.SHA2, max_keys=4)
+        keys = [b'key%d' % ndx for ndx in range(6)]
+        for key in keys[:4]:
+            mac.mac(key, b'msg')
+        mac.mac(keys[0], b'msg')
+        for key in keys[4:]:
+            mac.mac(key, b'msg')
+        self.assertEqual(len(mac), 4)
+        self.assertEqual(sorted(mac._states),
+                         [keys[0], keys[3], keys[4], keys[5]])
+        mac.clear()
+        self.assertEqual(len(mac), 0)
+        self.assertEqual(mac.mac(keys[1], b'msg'),
+                         self.expected(HashTypes.SHA2, keys[1], b'msg'))
+
+    def test_threads(self):
+        """ Threads may share a MAC object and its cache. """
+        mac = MAC(HashTypes.SHA2, max_keys=3)
+        keys = [bytes(self.rng.some_bytes(16)) for _ in range(5)]
+        msgs = [bytes(self.rng.some_bytes(50)) for _ in range(20)]
+        expected = dict((key, [self.expected(HashTypes.SHA2, key, msg)
+                               for msg in msgs]) for key in keys)
+        errors = []
+
+        def work(offset):
+            for ndx in range(50):
+                key = keys[(ndx + offset) % len(keys)]
+                if mac.mac_many(key, msgs) != expected[key]:
+                    errors.append(key)
+
+        threads = [threading.Thread(target=work, args=(ndx, ))
+                   for ndx in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(len(mac) <= 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_multi_hash.py
+
+""" Test single-pass hashing with several algorithms. """
+
+import hashlib
+import io
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import (XLMultiHash, XLSHA1, XLSHA2, XLSHA3,
+                           XLBLAKE2B_256, get_hash_class)
+
+
+class TestMultiHash(unittest.TestCase):
+    """ Test single-pass hashing with several algorithms. """
+
+    def setUp(self):
+        self.rng = SimpleRNG()
+
+    def expected(self, data):
+        """ Digests computed one algorithm at a time. """
+        return dict((cls.hash_name(), cls(data).digest())
+                    for cls in (XLSHA1, XLSHA2, XLSHA3, XLBLAKE2B_256))
+
+    def test_hash_classes(self):
+        """ Each hash type maps to its XLHash class. """
+        self.assertEqual(get_hash_class(HashTypes.SHA2), XLSHA2)
+        self.assertEqual(get_hash_class(HashTypes.BLAKE2B), XLBLAKE2B_256)
+
+    def test_digests(self):
+        """ One pass gives the digests each algorithm gives alone. """
+        data = bytes(self.rng.some_bytes(200000))
+        for threads in (False, True):
+            with XLMultiHash(threads=threads) as multi:
+                self.assertEqual(multi.hash_names(),
+                                 ['sha1', 'sha2', 'sha3', 'blake2b_256'])
+                multi.update(data[:1000])
+                multi.update(data[1000:])
+                self.assertEqual(multi.digests(), self.expected(data))
+
+            multi = XLMultiHash(threads=threads)
+            self.assertEqual(multi.update_from(io.BytesIO(data), 7000),
+                             len(data))
+            self.assertEqual(multi.hexdigests()['sha2'],
+                             hashlib.sha256(data).hexdigest())
+            multi.close()
+
+    def test_selection(self):
+        """ Only the hash types asked for are computed. """
+        multi = XLMultiHash([HashTypes.SHA2, HashTypes.SHA1], b'abc')
+        self.assertEqual(sorted(multi.digests()), ['sha1', 'sha2'])
+        self.assertEqual(multi.digests()['sha1'],
+                         hashlib.sha1(b'abc').digest())
+        self.assertRaises(XLCryptoError, XLMultiHash,
+                          [HashTypes.SHA2, HashTypes.SHA2])
+        self.assertRaises(XLCryptoError, XLMultiHash, [])
+        self.assertRaises(XLCryptoError, multi.update_from,
+                          io.BytesIO(b'abc'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_parallel_build.py
+
+""" Exercise sharded filters and their multi-process build. """
+
+import io
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import KeySelector
+from xlcrypto.filters.parallel import ShardedBloomSHA, build_parallel
+
+
+class TestParallelBuild(unittest.TestCase):
+    """ Exercise sharded filters and their multi-process build. """
+
+    def test_geometry(self):
+        """ k is reduced so that shard bits don't overlap selector bits. """
+        fltr = ShardedBloomSHA(20, 8, 20, shard_bits=4)
+        self.assertEqual((fltr.m, fltr.k, fltr.key_bytes), (20, 7, 20))
+        self.assertEqual(fltr.capacity, 1 << 24)
+        self.assertEqual(len(fltr.shards), 16)
+        fltr = ShardedBloomSHA(16, 8, 20, shard_bits=3)
+        self.assertEqual(fltr.k, 8)
+        for bad in (-1, 9):
+            try:
+                ShardedBloomSHA(16, 8, 20, shard_bits=bad)
+                self.fail("accepted shard_bits %d" % bad)
+            except XLFilterError:
+                pass
+
+    def test_sharded_filter(self):
+        """ Keys are spread over shards and found again. """
+        fltr = ShardedBloomSHA(14, 8, 20, shard_bits=3)
+        keys = make_keys(800)
+        fltr.insert(KeySelector(keys[0], fltr))
+        fltr.insert_many(KeySelector(key, fltr) for key in keys[1:])
+        self.assertEqual(len(fltr), 800)
+        for shard in fltr.shards:
+            self.assertTrue(len(shard) > 0)
+        self.assertTrue(fltr.is_member(KeySelector(keys[5], fltr)))
+        self.assertEqual(
+            fltr.is_member_many(KeySelector(key, fltr) for key in keys),
+            [True] * 800)
+
+        buckets = fltr.partition(b''.join(keys))
+        self.assertEqual(sum(len(bucket) for bucket in buckets), 800 * 20)
+        for ndx, bucket in enumerate(buckets):
+            self.assertEqual(len(bucket) // 20, len(fltr.shards[ndx]))
+
+    def test_build_parallel(self):
+        """ A parallel build matches a serial one, from memory or file. """
+        keys = make_keys(2000)
+        packed = b''.join(keys)
+        serial = ShardedBloomSHA(14, 8, 20, shard_bits=2)
+        serial.insert_many(KeySelector(key, serial) for key in keys)
+
+        for source in (packed, io.BytesIO(packed)):
+            built = build_parallel(source, 14, 8, 20, shard_bits=2,
+                                   workers=2)
+            self.assertEqual(len(built), 2000)
+            for mine, theirs in zip(built.shards, serial.shards):
+                self.assertTrue(mine == theirs)
+
+        word = build_parallel(packed, 14, 8, 20, shard_bits=2, word=True,
+                              workers=2)
+        self.assertEqual(
+            word.is_member_many(KeySelector(key, word) for key in keys),
+            [True] * 2000)
+
+        try:
+            build_parallel(io.BytesIO(packed + b'x'), 14, 8, 20, workers=1)
+            self.fail("accepted partial digest")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_selector_cache.py
+
+""" Exercise the LRU cache of KeySelectors. """
+
+import unittest
+from threading import Thread
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import (BloomSHA, CountingBloom, KeySelector,
+                              SelectorCache)
+
+
+class TestSelectorCache(unittest.TestCase):
+    """ Exercise the LRU cache of KeySelectors. """
+
+    def test_param_exceptions(self):
+        """ Unacceptable parameters are caught. """
+        try:
+            SelectorCache(0)
+            self.fail("accepted zero cache size")
+        except XLFilterError:
+            pass
+        cache = SelectorCache()
+        try:
+            cache.get(make_keys(1)[0], None)
+            self.fail("accepted None filter")
+        except XLFilterError:
+            pass
+        try:
+            cache.get(bytes(15), BloomSHA())
+            self.fail("accepted key of the wrong length")
+        except XLFilterError:
+            pass
+        # a cached selector is not reused for a filter of other key_bytes
+        key = make_keys(1)[0]
+        cache.get(key, BloomSHA(20, 8, 20))
+        try:
+            cache.get(key, BloomSHA(20, 8, 32))
+            self.fail("accepted key of the wrong length from the cache")
+        except XLFilterError:
+            pass
+
+    def test_hits_and_misses(self):
+        """ Cached selectors are the same as freshly built ones. """
+        cache = SelectorCache(16)
+        fltr = BloomSHA(20, 8, 20)
+        other = CountingBloom(20, 8, 20)     # same geometry
+        keys = make_keys(8)
+        for key in keys:
+            keysel = cache.get(key, fltr)
+            fresh = KeySelector(key, fltr)
+            self.assertEqual(keysel.bitsel, fresh.bitsel)
+            self.assertEqual(keysel.bytesel, fresh.bytesel)
+        self.assertEqual((cache.hits, cache.misses), (0, 8))
+
+        for key in keys:
+            self.assertIs(cache.get(key, other), cache.get(key, fltr))
+        self.assertEqual((cache.hits, cache.misses), (16, 8))
+        self.assertAlmostEqual(cache.hit_rate(), 16 / 24)
+
+        # different geometry, different selector
+        small = BloomSHA(12, 8, 20)
+        keysel = cache.get(keys[0], small)
+        self.assertEqual(keysel.bytesel, KeySelector(keys[0], small).bytesel)
+        self.assertEqual(cache.misses, 9)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+    def test_eviction(self):
+        """ The least recently used selectors are evicted first. """
+        cache = SelectorCache(4)
+        fltr = BloomSHA(16, 8, 20)
+        keys = make_keys(5)
+        for key in keys[:4]:
+            cache.get(key, fltr)
+        cache.get(keys[0], fltr)            # now most recently used
+        cache.get(keys[4], fltr)            # evicts keys[1]
+        self.assertEqual(len(cache), 4)
+        misses = cache.misses
+        cache.get(keys[0], fltr)
+        self.assertEqual(cache.misses, misses)
+        cache.get(keys[1], fltr)
+        self.assertEqual(cache.misses, misses + 1)
+
+    def test_threads(self):
+        """ Many threads may share one cache. """
+        cache = SelectorCache(64)
+        fltr = BloomSHA(16, 8, 20)
+        keys = make_keys(128)
+
+        def worker():
+            for _ in range(4):
+                for keysel in cache.get_many(keys, fltr):
+                    fltr.is_member(keysel)
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.hits + cache.misses, 4 * 4 * 128)
+        self.assertTrue(len(cache) <= 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_tinylfu.py
+
+""" Exercise the TinyLFU-style aging frequency sketch. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import KeySelector, NibbleCounters
+from xlcrypto.filters.tinylfu import FrequencySketch
+
+
+class TestFrequencySketch(unittest.TestCase):
+    """ Exercise the TinyLFU-style aging frequency sketch. """
+
+    def test_halve(self):
+        """ Halving nibble counters halves each of them independently. """
+        counters = NibbleCounters(8)
+        for bit in range(256):
+            for _ in range(bit % 16):
+                counters.inc(bit)
+        counters.halve()
+        for bit in range(256):
+            self.assertEqual(counters.value(bit), (bit % 16) // 2)
+        counters.clear()
+        for bit in range(256):
+            self.assertEqual(counters.value(bit), 0)
+
+    def test_param_exceptions(self):
+        """ Unacceptable constructor parameters are caught. """
+        try:
+            FrequencySketch(0)
+            self.fail("accepted m == 0")
+        except XLFilterError:
+            pass
+        try:
+            FrequencySketch(16, 4, 20, sample_size=0)
+            self.fail("accepted zero sample size")
+        except XLFilterError:
+            pass
+        sketch = FrequencySketch(16, 4, 20)
+        self.assertEqual(sketch.sample_size, 10 << 14)
+
+    def test_selector_geometry(self):
+        """ Selectors built for another geometry are rejected. """
+        sketch = FrequencySketch(10, 4, 20)
+        key = make_keys(1)[0]
+        for other in (FrequencySketch(12, 4, 20), FrequencySketch(10, 3, 20)):
+            keysel = KeySelector(key, other)
+            ours = KeySelector(key, sketch)
+            self.assertRaises(XLFilterError, sketch.record, keysel)
+            self.assertRaises(XLFilterError, sketch.record_many,
+                              [ours, keysel])
+            self.assertRaises(XLFilterError, sketch.frequency, keysel)
+            self.assertRaises(XLFilterError, sketch.admit, ours, keysel)
+        self.assertEqual(sketch.frequency(KeySelector(key, sketch)), 0)
+        sketch.record(KeySelector(key, sketch))
+
+    def test_frequency(self):
+        """ Frequencies track the number of sightings, then age. """
+        sketch = FrequencySketch(16, 4, 20, sample_size=1000)
+        hot, cold = make_keys(2)
+        hot_sel = KeySelector(hot, sketch)
+        cold_sel = KeySelector(cold, sketch)
+        self.assertEqual(sketch.frequency(hot_sel), 0)
+
+        sketch.record(hot_sel)              # passes only the doorkeeper
+        self.assertEqual(sketch.frequency(hot_sel), 1)
+        for _ in range(9):
+            sketch.record(hot_sel)
+        self.assertEqual(sketch.frequency(hot_sel), 10)
+        sketch.record(cold_sel)
+        self.assertTrue(sketch.admit(hot_sel, cold_sel))
+        self.assertFalse(sketch.admit(cold_sel, hot_sel))
+
+        for _ in range(20):                 # counters saturate
+            sketch.record(hot_sel)
+        self.assertEqual(sketch.frequency(hot_sel), 16)
+
+        sketch.reset()                      # doorkeeper cleared too
+        self.assertEqual(sketch.resets, 1)
+        self.assertEqual(sketch.frequency(hot_sel), 7)
+        self.assertEqual(sketch.frequency(cold_sel), 0)
+
+    def test_aging(self):
+        """ Counters are halved automatically after sample_size records. """
+        sketch = FrequencySketch(12, 4, 20, sample_size=256)
+        keys = make_keys(300)
+        sketch.record_many([KeySelector(key, sketch) for key in keys])
+        self.assertEqual(sketch.resets, 1)
+
+    def test_without_doorkeeper(self):
+        """ Without a doorkeeper the first sighting reaches the counters. """
+        sketch = FrequencySketch(12, 4, 20, doorkeeper=False)
+        keysel = KeySelector(make_keys(1)[0], sketch)
+        sketch.record(keysel)
+        self.assertEqual(sketch.frequency(keysel), 1)
+        sketch.clear()
+        self.assertEqual(sketch.frequency(keysel), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
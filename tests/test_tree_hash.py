@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_tree_hash.py
+
+""" Test Merkle tree hashing. """
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from rnglib import SimpleRNG
+from xlattice import HashTypes
+from xlcrypto import XLCryptoError
+from xlcrypto.hash import XLTreeHash
+
+
+class TestTreeHash(unittest.TestCase):
+    """ Test Merkle tree hashing. """
+
+    def setUp(self):
+        self.rng = SimpleRNG()
+        self.dir = tempfile.mkdtemp(prefix='xltree')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_blake2b_params(self):
+        """ A two-leaf BLAKE2B tree uses the BLAKE2 tree parameters. """
+        data = bytes(self.rng.some_bytes(1500))
+        params = dict(digest_size=32, fanout=2, depth=255, leaf_size=1000,
+                      inner_size=32)
+        left = hashlib.blake2b(data[:1000], node_offset=0, node_depth=0,
+                               last_node=False, **params).digest()
+        right = hashlib.blake2b(data[1000:], node_offset=1, node_depth=0,
+                                last_node=True, **params).digest()
+        root = hashlib.blake2b(left + right, node_offset=0, node_depth=1,
+                               last_node=True, **params).digest()
+        with XLTreeHash(HashTypes.BLAKE2B, 1000, workers=2) as tree:
+            tree.update(data)
+            self.assertEqual(tree.leaf_digests(), [left, right])
+            self.assertEqual(tree.digest(), root)
+
+        for leaf_size in (0, 1 << 32):
+            self.assertRaises(XLCryptoError, XLTreeHash, HashTypes.BLAKE2B,
+                              leaf_size)
+
+    def test_sha_nodes(self):
+        """ Other hash types prefix leaves and nodes. """
+        data = b'a' * 10 + b'b' * 10 + b'c' * 5
+        tree = XLTreeHash(HashTypes.SHA2, 10)
+        tree.update(data)
+        leaves = [hashlib.sha256(b'\x00' + data[start:start + 10]).digest()
+                  for start in (0, 10, 20)]
+        pair = hashlib.sha256(b'\x01' + leaves[0] + leaves[1]).digest()
+        lone = hashlib.sha256(b'\x01' + leaves[2]).digest()
+        self.assertEqual(tree.digest(),
+                         hashlib.sha256(b'\x01' + pair + lone).digest())
+        tree.close()
+
+        empty = XLTreeHash(HashTypes.SHA1, 10)
+        self.assertEqual(empty.digest(), hashlib.sha1(b'\x00').digest())
+
+    def test_streaming_and_files(self):
+        """ Chunking of updates doesn't matter, and files hash alike. """
+        data = bytes(self.rng.some_bytes(50000))
+        path = os.path.join(self.dir, 'data')
+        with open(path, 'wb') as file:
+            file.write(data)
+        for hashtype in (HashTypes.BLAKE2B, HashTypes.SHA3):
+            whole = XLTreeHash(hashtype, 4096)
+            whole.update(data)
+            expected = whole.digest()
+            whole.close()
+
+            tree = XLTreeHash(hashtype, 4096, workers=3)
+            start = 0
+            while start < len(data):
+                count = self.rng.next_int16(9000)
+                tree.update(data[start:start + count])
+                start += count
+            self.assertEqual(tree.digest(), expected)
+            self.assertEqual(len(tree.leaf_digests()), 13)
+            tree.close()
+
+            for leaf_size in (4096, 1 << 20):
+                from_file = XLTreeHash.hash_file(path, hashtype, leaf_size)
+                mine = XLTreeHash(hashtype, leaf_size)
+                mine.update(data)
+                self.assertEqual(from_file.digest(), mine.digest())
+
+    def test_proofs(self):
+        """ Proofs verify each leaf and reject changed data. """
+        for count in (1, 2, 5, 8, 13):
+            data = bytes(self.rng.some_bytes(100 * count))
+            for hashtype in (HashTypes.BLAKE2B, HashTypes.SHA2):
+                tree = XLTreeHash(hashtype, 100)
+                tree.update(data)
+                root = tree.digest()
+                for ndx in range(count):
+                    leaf = data[ndx * 100:(ndx + 1) * 100]
+                    proof = tree.proof(ndx)
+                    self.assertTrue(tree.verify_leaf(leaf, ndx, count,
+                                                     proof, root))
+                    bad = bytes([leaf[0] ^ 1]) + leaf[1:]
+                    self.assertFalse(tree.verify_leaf(bad, ndx, count,
+                                                      proof, root))
+                    if count > 1:
+                        other = (ndx + 1) % count
+                        self.assertFalse(tree.verify_leaf(
+                            leaf, other, count, proof, root))
+                self.assertRaises(IndexError, tree.proof, count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# xlcrypto_py/test_word_bloom.py
+
+""" Exercise the 64-bit word storage engine for BloomSHA. """
+
+import unittest
+
+from filter_keys import make_keys
+from xlcrypto import XLFilterError
+from xlcrypto.filters import BloomSHA, WordBloomSHA, KeySelector
+
+
+class TestWordBloomSHA(unittest.TestCase):
+    """ Exercise the 64-bit word storage engine for BloomSHA. """
+
+    def test_param_exceptions(self):
+        """ Filters smaller than one word are rejected. """
+        try:
+            WordBloomSHA(5)
+            self.fail("didn't catch filter smaller than a 64-bit word")
+        except XLFilterError:
+            pass
+        fltr = WordBloomSHA(6, 4)
+        self.assertEqual(fltr.capacity, 64)
+        self.assertEqual(len(fltr), 0)
+
+    def test_word_selectors(self):
+        """ Word selectors address the same bits as byte selectors. """
+        fltr = BloomSHA(20, 8, key_bytes=20)
+        for key in make_keys(16, 20):
+            keysel = KeySelector(key, fltr)
+            for j in range(fltr.k):
+                byte_bit = (keysel.bytesel[j] << 3) | keysel.bitsel[j]
+                word_bit = (keysel.wordsel[j] << 6) | keysel.wbitsel[j]
+                self.assertEqual(byte_bit, word_bit)
+                self.assertTrue(0 <= keysel.wbitsel[j] < 64)
+
+    def do_test_engines_agree(self, m, k, key_bytes, count):
+        """ Both engines set the same bits for the same keys. """
+        keys = make_keys(count, key_bytes)
+        byte_fltr = BloomSHA(m, k, key_bytes)
+        word_fltr = WordBloomSHA(m, k, key_bytes)
+        for key in keys:
+            keysel = KeySelector(key, word_fltr)
+            self.assertFalse(word_fltr.is_member(keysel))
+            byte_fltr.insert(keysel)
+            word_fltr.insert(keysel)
+        for key in keys:
+            self.assertTrue(word_fltr.is_member(KeySelector(key, word_fltr)))
+
+        self.assertEqual(len(word_fltr), count)
+        self.assertEqual(byte_fltr.popcount(), word_fltr.popcount())
+        self.assertTrue(byte_fltr == word_fltr)
+        self.assertEqual(byte_fltr.to_bytes(), word_fltr.to_bytes())
+
+        word_fltr.clear()
+        self.assertEqual(len(word_fltr), 0)
+        self.assertEqual(word_fltr.popcount(), 0)
+        self.assertFalse(byte_fltr == word_fltr)
+
+        # filters remain usable as set members and dict keys
+        self.assertEqual(len(set([byte_fltr, word_fltr, byte_fltr])), 2)
+        self.assertEqual({word_fltr: 1}[word_fltr], 1)
+
+    def test_engines_agree(self):
+        """ Compare the engines for various parameter settings. """
+        self.do_test_engines_agree(20, 8, 20, 64)
+        self.do_test_engines_agree(14, 8, 20, 64)
+        self.do_test_engines_agree(13, 7, 20, 64)
+        self.do_test_engines_agree(24, 8, 32, 16)
+
+    def test_serialization(self):
+        """ Either engine loads what the other serializes. """
+        keys = make_keys(100, 32)
+        word_fltr = WordBloomSHA(16, 8, 32)
+        for key in keys:
+            word_fltr.insert(KeySelector(key, word_fltr))
+
+        data = word_fltr.to_bytes()
+        byte_fltr = BloomSHA.from_bytes(data)
+        self.assertEqual((byte_fltr.m, byte_fltr.k, byte_fltr.key_bytes),
+                         (16, 8, 32))
+        self.assertEqual(len(byte_fltr), 100)
+        for key in keys:
+            self.assertTrue(byte_fltr.is_member(KeySelector(key, byte_fltr)))
+
+        copy = WordBloomSHA.from_bytes(byte_fltr.to_bytes())
+        self.assertTrue(copy == word_fltr)
+        self.assertEqual(len(copy), 100)
+
+        try:
+            BloomSHA.from_bytes(data[:-1])
+            self.fail("accepted truncated serialization")
+        except XLFilterError:
+            pass
+        try:
+            BloomSHA.from_bytes(b'XXXX' + data[4:])
+            self.fail("accepted serialization with bad magic")
+        except XLFilterError:
+            pass
+
+    def test_union(self):
+        """ The union of two filters contains the members of both. """
+        keys = make_keys(64, 20)
+        left = WordBloomSHA(16, 8, 20)
+        right = BloomSHA(16, 8, 20)
+        for key in keys[:32]:
+            left.insert(KeySelector(key, left))
+        for key in keys[32:]:
+            right.insert(KeySelector(key, right))
+
+        left.union(right)
+        self.assertEqual(len(left), 64)
+        for key in keys:
+            self.assertTrue(left.is_member(KeySelector(key, left)))
+
+        try:
+            left.union(BloomSHA(17, 8, 20))
+            self.fail("union of filters of different geometry")
+        except XLFilterError:
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()